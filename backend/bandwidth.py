@@ -0,0 +1,124 @@
+'''Token buckets that limit the bandwidth of the video sent to viewers.
+
+One relay with several drones, and many viewers of each, can take all of the backend's uplink. The video a
+stream sends to its viewers (every datagram times the number of viewers) is limited by three token buckets:
+one for the stream, one for the relay it comes from, and one for all video. A bucket fills with `rate` bytes
+per second, up to `burst` bytes, and every byte sent takes one token.
+
+Limits are enforced per frame, never per datagram, since a frame with holes in it is garbage to the viewer:
+when a frame starts and any of the stream's buckets is empty, the whole frame is dropped. If other frames are
+predicted from it, everything up to the next keyframe is dropped too. A frame that was let through is sent
+whole, so a bucket can go into debt by up to one frame. See `DroneVideoStream._forward()`.
+
+The limits can be changed at runtime (see `/video/bandwidth` in `frontend_routes.py`). A relay's bucket is
+kept by its name, so its limit stays when it reconnects.
+
+Classes:
+    TokenBucket: A rate limit in bytes per second.
+
+Functions:
+    relay_bucket: Returns the bucket of a relay.
+
+Attributes:
+    global_bucket (TokenBucket): The bucket of all video sent to viewers.
+    relay_buckets (dict[str, TokenBucket]): The bucket of every relay, by name.
+'''
+
+# Default Python
+import time
+
+from config import (
+    VIDEO_BANDWIDTH_BURST,
+    VIDEO_BANDWIDTH_GLOBAL,
+    VIDEO_BANDWIDTH_RELAY,
+    VIDEO_BANDWIDTH_STREAM
+)
+
+
+class TokenBucket:
+    """A rate limit in bytes per second.
+
+    Attributes:
+        rate (float): Bytes per second. 0 is no limit.
+        burst (float): The most tokens the bucket holds, in bytes.
+        tokens (float): The tokens in the bucket. Negative if the bucket is in debt.
+        dropped_frames (int): Frames dropped because this bucket was empty.
+    """
+
+    def __init__(self, rate: float = 0, burst: float | None = None) -> None:
+        self.rate: float = 0
+        self.burst: float = 0
+        self.tokens: float = 0
+        self.dropped_frames: int = 0
+        self._refilled: float = time.monotonic()
+        self.set_limit(rate, burst)
+
+    def set_limit(self, rate: float, burst: float | None = None) -> None:
+        """Change the limit. The bucket starts full.
+
+        Args:
+            rate (float): Bytes per second. 0 is no limit.
+            burst (float | None): The most tokens the bucket holds, in bytes. `None` is
+                `VIDEO_BANDWIDTH_BURST` seconds at `rate`.
+
+        Raises:
+            ValueError: If `rate` or `burst` is negative.
+        """
+        if burst is None:
+            burst = rate * VIDEO_BANDWIDTH_BURST
+        if rate < 0 or burst < 0:
+            raise ValueError("The rate and burst of a token bucket cannot be negative.")
+
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+
+    def refill(self, now: float) -> bool:
+        """Add the tokens since the last refill.
+
+        Args:
+            now (float): The time now, from `time.monotonic()`.
+
+        Returns:
+            bool: `True` if the bucket is empty (or in debt), so the next frame must be dropped.
+        """
+        elapsed: float = now - self._refilled
+        self._refilled = now
+        if not self.rate:
+            self.tokens = 0
+            return False
+
+        tokens: float = self.tokens + elapsed * self.rate
+        self.tokens = tokens if tokens < self.burst else self.burst
+        return self.tokens <= 0
+
+    def stats(self) -> dict[str, float | int | None]:
+        """Returns the limit of the bucket and how full it is.
+
+        Example:
+            >>> { "rate": 1250000, "burst": 625000, "tokens": 412000.0, "fill": 0.66, "dropped_frames": 12 }
+        """
+        self.refill(time.monotonic())
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "tokens": round(self.tokens, 1),
+            "fill": round(max(self.tokens, 0) / self.burst, 3) if self.rate and self.burst else None,
+            "dropped_frames": self.dropped_frames,
+        }
+
+
+global_bucket: TokenBucket = TokenBucket(VIDEO_BANDWIDTH_GLOBAL)
+relay_buckets: dict[str, TokenBucket] = {}
+
+
+def relay_bucket(name: str) -> TokenBucket:
+    """Returns the bucket of a relay, and makes it with `VIDEO_BANDWIDTH_RELAY` if it has none.
+
+    Args:
+        name (str): The name of the relay.
+    """
+    bucket: TokenBucket | None = relay_buckets.get(name)
+    if bucket is None:
+        bucket = relay_buckets.setdefault(name, TokenBucket(VIDEO_BANDWIDTH_RELAY))
+    return bucket
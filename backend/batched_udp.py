@@ -0,0 +1,368 @@
+'''Batched UDP receive and send with `recvmmsg` and `sendmmsg` (Linux only).
+
+A Tello sends each H.264 frame as a burst of ~1460 byte datagrams. Receiving and sending them one at a
+time costs one system call per datagram per viewer. `recvmmsg()` and `sendmmsg()` move many datagrams
+per system call. Python's `socket` module does not expose them, so they are called through `ctypes`.
+
+Classes:
+    BatchReceiver: Drains up to `batch_size` datagrams from a socket into pool slabs with one `recvmmsg()`.
+    BatchSender: Sends queued datagrams with as few `sendmmsg()` calls as possible.
+    BatchedDatagramTransport: A transport for `DroneVideoStream` that queues `sendto()` until `flush()`.
+
+Functions:
+    available: Returns `True` if batched I/O can be used on this system.
+
+Note:
+    Only IPv4 is supported, like the rest of the video plane.
+'''
+
+# Default Python
+import ctypes, ctypes.util, errno, socket, struct, sys
+
+# Only on Unix, for the fill level of the send buffer. Batched I/O is only used on Linux anyway.
+try:
+    import fcntl, termios
+except ImportError:
+    fcntl = termios = None
+
+# Preallocated receive buffers.
+from buffer_pool import BufferPool, Slab
+
+MSG_DONTWAIT: int = 0x40
+
+# What the kernel counts against the send buffer for a datagram, on top of its payload. On the high side, so a
+# datagram that is let through is not dropped by `sendmmsg()` after all.
+_DATAGRAM_OVERHEAD: int = 1024
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [
+        ('iov_base', ctypes.c_void_p),
+        ('iov_len', ctypes.c_size_t),
+    ]
+
+
+class sockaddr_in(ctypes.Structure):
+    _fields_ = [
+        ('sin_family', ctypes.c_ushort),
+        ('sin_port', ctypes.c_uint8 * 2), # Network byte order.
+        ('sin_addr', ctypes.c_uint8 * 4),
+        ('sin_zero', ctypes.c_uint8 * 8),
+    ]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(iovec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_hdr', msghdr),
+        ('msg_len', ctypes.c_uint),
+    ]
+
+
+def _load_libc() -> object | None:
+    if not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+        return libc
+
+    # No C library or it does not have the functions.
+    except (OSError, AttributeError, TypeError):
+        return None
+
+_libc: object | None = _load_libc()
+
+def available() -> bool:
+    """Returns `True` if `recvmmsg()` and `sendmmsg()` can be used on this system."""
+    return _libc is not None
+
+
+class BatchReceiver:
+    """Drains up to `batch_size` datagrams from a non-blocking socket with one `recvmmsg()`.
+
+    The datagrams are received straight into slabs from a `BufferPool`. They stay acquired until
+    `recycle()` is called, after everything forwarded from them has been sent.
+
+    Slabs have to be posted before `recvmmsg()` is called. To not hold `batch_size` slabs for every idle
+    socket, only about twice the size of the last burst is kept posted.
+
+    Attributes:
+        batch_size (int): The most datagrams received per system call.
+        pool (BufferPool): Where the slabs come from.
+        drained (bool): `True` if the last `recv()` emptied the socket.
+    """
+
+    def __init__(self, sock: socket.socket, pool: BufferPool, batch_size: int = 64) -> None:
+        self._fd: int = sock.fileno()
+        self.batch_size: int = batch_size
+        self.pool: BufferPool = pool
+        self.drained: bool = True
+
+        # The slab posted in each message, or `None` if none is posted.
+        self._slabs: list[Slab | None] = [None] * batch_size
+        self._handed_out: list[Slab] = []
+        self._posted: int = min(batch_size, 8)
+
+        self._names = (sockaddr_in * batch_size)()
+        self._name_addresses: list[int] = [ctypes.addressof(name) for name in self._names]
+        self._iovecs = (iovec * batch_size)()
+        self._msgs = (mmsghdr * batch_size)()
+
+        for i in range(batch_size):
+            self._msgs[i].msg_hdr.msg_name = self._name_addresses[i]
+            self._msgs[i].msg_hdr.msg_namelen = ctypes.sizeof(sockaddr_in)
+            self._msgs[i].msg_hdr.msg_iov = ctypes.pointer(self._iovecs[i])
+            self._msgs[i].msg_hdr.msg_iovlen = 1
+
+        # `(ip, port)` tuples by the raw port and address bytes, so senders are only decoded once.
+        self._addresses: dict[bytes, tuple[str, int]] = {}
+
+    def _post(self, i: int) -> None:
+        slab: Slab = self.pool.acquire()
+        if not slab.address:
+            slab.address = ctypes.addressof(ctypes.c_char.from_buffer(slab.buffer))
+
+        self._slabs[i] = slab
+        self._iovecs[i].iov_base = slab.address
+        self._iovecs[i].iov_len = len(slab.buffer)
+
+    def recv(self) -> list[tuple[memoryview, tuple[str, int]]]:
+        """Receive the datagrams that are waiting, up to the number of posted slabs.
+
+        Returns:
+            list[tuple[memoryview, tuple[str, int]]]: The datagrams and who sent them. Empty if none were waiting.
+                Each datagram is a `memoryview` of a slab, valid until `recycle()`.
+
+        Raises:
+            OSError: If the socket failed for another reason than having no datagrams.
+        """
+        posted: int = self._posted
+        for i in range(posted):
+            if self._slabs[i] is None:
+                self._post(i)
+
+        count: int = _libc.recvmmsg(self._fd, self._msgs, posted, MSG_DONTWAIT, None)
+
+        if count < 0:
+            error: int = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                self.drained = True
+                return []
+            raise OSError(error, errno.errorcode.get(error, 'recvmmsg'))
+
+        datagrams: list[tuple[memoryview, tuple[str, int]]] = []
+        for i in range(count):
+            msg = self._msgs[i]
+            slab: Slab = self._slabs[i]
+            self._slabs[i] = None
+            self._handed_out.append(slab)
+
+            # The port and address are the 6 bytes after `sin_family`.
+            key: bytes = ctypes.string_at(self._name_addresses[i] + 2, 6)
+            addr: tuple[str, int] | None = self._addresses.get(key)
+            if addr is None:
+                addr = (socket.inet_ntoa(key[2:]), int.from_bytes(key[:2], 'big'))
+                self._addresses[key] = addr
+
+            # The kernel overwrites the length of the address. Reset it for the next call.
+            msg.msg_hdr.msg_namelen = ctypes.sizeof(sockaddr_in)
+            datagrams.append((slab.view[:msg.msg_len], addr))
+
+        # If every posted slab was filled there may be more waiting.
+        self.drained = count < posted
+
+        # Keep about twice the last burst posted. Give the rest back to the pool.
+        self._posted = max(4, min(self.batch_size, count * 2))
+        for i in range(self._posted, posted):
+            if self._slabs[i] is not None:
+                self.pool.release(self._slabs[i])
+                self._slabs[i] = None
+
+        return datagrams
+
+    def recycle(self) -> None:
+        """Release the slabs of the last `recv()` back to the pool."""
+        for slab in self._handed_out:
+            self.pool.release(slab)
+        self._handed_out.clear()
+
+    def close(self) -> None:
+        """Release every slab back to the pool."""
+        self.recycle()
+        for i, slab in enumerate(self._slabs):
+            if slab is not None:
+                self.pool.release(slab)
+                self._slabs[i] = None
+
+
+class BatchSender:
+    """Sends datagrams with one `sendmmsg()` per `batch_size` datagrams.
+
+    Attributes:
+        batch_size (int): The most datagrams sent per system call.
+        dropped (int): Datagrams that were dropped because the socket's send buffer was full.
+    """
+
+    def __init__(self, sock: socket.socket, batch_size: int = 64) -> None:
+        self._fd: int = sock.fileno()
+        self.batch_size: int = batch_size
+        self.dropped: int = 0
+
+        self._iovecs = (iovec * batch_size)()
+        self._msgs = (mmsghdr * batch_size)()
+        for i in range(batch_size):
+            self._msgs[i].msg_hdr.msg_iov = ctypes.pointer(self._iovecs[i])
+            self._msgs[i].msg_hdr.msg_iovlen = 1
+            self._msgs[i].msg_hdr.msg_namelen = ctypes.sizeof(sockaddr_in)
+
+        # A `sockaddr_in` (and its address) for every destination.
+        self._names: dict[tuple[str, int], tuple[sockaddr_in, int]] = {}
+
+    def _name(self, addr: tuple[str, int]) -> int:
+        entry = self._names.get(addr)
+        if entry is None:
+            name = sockaddr_in()
+            name.sin_family = socket.AF_INET
+            name.sin_port[:] = addr[1].to_bytes(2, 'big')
+            name.sin_addr[:] = socket.inet_aton(addr[0])
+            entry = (name, ctypes.addressof(name))
+            self._names[addr] = entry
+        return entry[1]
+
+    def send(self, datagrams: list[tuple[bytes | memoryview, tuple[str, int]]]) -> int:
+        """Send datagrams. If the send buffer fills up the rest are dropped, like UDP would.
+
+        Args:
+            datagrams (list[tuple[bytes | memoryview, tuple[str, int]]]): The datagrams and where to send them.
+
+        Returns:
+            int: How many datagrams were sent.
+        """
+        sent: int = 0
+
+        for start in range(0, len(datagrams), self.batch_size):
+            chunk = datagrams[start:start + self.batch_size]
+
+            # The pointers point at the datagram's own buffer, so nothing is copied.
+            # `keep_alive` holds them until the system call returns.
+            keep_alive: list = []
+            for i, (data, addr) in enumerate(chunk):
+                if isinstance(data, bytes):
+                    pointer = ctypes.c_char_p(data)
+                    self._iovecs[i].iov_base = ctypes.cast(pointer, ctypes.c_void_p).value
+                else:
+                    # A `memoryview` of a slab.
+                    pointer = (ctypes.c_char * len(data)).from_buffer(data)
+                    self._iovecs[i].iov_base = ctypes.addressof(pointer)
+                keep_alive.append(pointer)
+                self._iovecs[i].iov_len = len(data)
+                self._msgs[i].msg_hdr.msg_name = self._name(addr)
+
+            count: int = _libc.sendmmsg(self._fd, self._msgs, len(chunk), MSG_DONTWAIT)
+
+            if count < 0:
+                error: int = ctypes.get_errno()
+                if error not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    print(f"Could not send data to client: {errno.errorcode.get(error, error)}")
+                count = 0
+
+            sent += count
+
+            # The send buffer is full. Drop the rest of this round instead of blocking the event loop.
+            if count < len(chunk):
+                self.dropped += len(datagrams) - sent
+                break
+
+        return sent
+
+
+class BatchedDatagramTransport:
+    """A transport for `DroneVideoStream` that sends with `sendmmsg()`.
+
+    `sendto()` only queues the datagram. The `VideoEngine` calls `flush()` after each `recvmmsg()`, so all
+    datagrams forwarded for one burst go out together, and the slabs they came from are recycled.
+
+    `sendmmsg()` drops what does not fit in the socket's send buffer, so `try_sendto()` keeps count of the room
+    left in it. It refuses a datagram that would not fit once the queued ones are sent, so the viewer's
+    `SubscriberQueue` keeps it and can drop whole frames instead of the middle of one.
+
+    Attributes:
+        socket (socket.socket): The non-blocking video socket.
+        receiver (BatchReceiver): Receives from `socket`.
+        sender (BatchSender): Sends on `socket`.
+    """
+
+    def __init__(self, sock: socket.socket, pool: BufferPool, batch_size: int = 64) -> None:
+        self.socket: socket.socket = sock
+        self.receiver: BatchReceiver = BatchReceiver(sock, pool, batch_size)
+        self.sender: BatchSender = BatchSender(sock, batch_size)
+        self._pending: list[tuple[bytes | memoryview, tuple[str, int]]] = []
+
+        # The room left in the send buffer, as the kernel counts it, less what is queued. Only asked for again
+        # when it runs out, so there is no system call per datagram.
+        self._send_buffer: int = sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+        self._room: int = self._send_buffer
+        self._pending_cost: int = 0
+
+    def sendto(self, data: bytes | memoryview, addr: tuple[str, int]) -> None:
+        cost: int = len(data) + _DATAGRAM_OVERHEAD
+        self._room -= cost
+        self._pending_cost += cost
+        self._pending.append((data, addr))
+
+    def try_sendto(self, data: bytes | memoryview, addr: tuple[str, int]) -> bool:
+        """Queue a datagram until `flush()`. Returns `False` if the send buffer has no room for it."""
+        cost: int = len(data) + _DATAGRAM_OVERHEAD
+        if cost > self._room:
+            self._refresh_room()
+            if cost > self._room:
+                return False
+
+        self._room -= cost
+        self._pending_cost += cost
+        self._pending.append((data, addr))
+        return True
+
+    def _refresh_room(self) -> None:
+        """Ask the kernel how much of the send buffer is still in use."""
+        queued: int = 0
+        if fcntl is not None:
+            try:
+                queued = struct.unpack('i', fcntl.ioctl(self.socket.fileno(), termios.TIOCOUTQ, b'\0' * 4))[0]
+            except OSError:
+                pass
+        self._room = self._send_buffer - queued - self._pending_cost
+
+    def flush(self) -> None:
+        if self._pending:
+            sent: int = self.sender.send(self._pending)
+
+            # There was less room than counted. Ask again before letting more through.
+            if sent < len(self._pending):
+                self._room = 0
+
+            self._pending = []
+            self._pending_cost = 0
+
+        # Everything received has been sent. The slabs can be reused.
+        self.receiver.recycle()
+
+    def close(self) -> None:
+        self._pending = []
+        self._pending_cost = 0
+        self.receiver.close()
+        self.socket.close()
@@ -0,0 +1,6 @@
+'''Benchmarks for the backend.
+
+Every benchmark is a module that is run from the `backend` directory, for example:
+
+    python -m benchmarks.video_forwarding
+'''
@@ -0,0 +1,77 @@
+'''Benchmark batched UDP (`recvmmsg`/`sendmmsg`) against one system call per datagram.
+
+Publishers send bursts of 1460 byte datagrams, like the datagrams of one Tello H.264 frame.
+For each mode this reports the forwarded packets per second and the CPU time the video engine thread
+spent per stream (in percent of one core). The modes are:
+    - unpooled: asyncio's `DatagramProtocol`, a new `bytes` object per datagram.
+    - pooled: one `recvfrom_into()` per datagram into a slab from the buffer pool.
+    - batched: `recvmmsg()` into slabs from the buffer pool, and `sendmmsg()`.
+
+Run from the `backend` directory:
+
+    python -m benchmarks.batched_udp --streams 10 100 --duration 5 --rate 300 --burst 10
+'''
+
+# Default Python
+import argparse, asyncio, resource, time
+
+# Own classes for drone video
+from drone_video_stream import DroneVideoStream
+from video_engine import VideoEngine
+
+from benchmarks.video_forwarding import BASE_PORT, run_load
+
+
+def engine_cpu_time(engine: VideoEngine) -> float:
+    """Returns the CPU time (in seconds) the engine thread has used."""
+    async def thread_time() -> float:
+        return time.thread_time()
+    return asyncio.run_coroutine_threadsafe(thread_time(), engine.loop).result()
+
+
+MODES: dict[str, dict[str, object]] = {
+    'unpooled': {'batched_io': False, 'buffer_pool_slabs': 0},
+    'pooled': {'batched_io': False, 'buffer_pool_slabs': 4096},
+    'batched': {'batched_io': True, 'buffer_pool_slabs': 4096},
+}
+
+
+def run(count: int, duration: float, rate: int, burst: int, mode: str) -> dict[str, float]:
+    engine = VideoEngine(**MODES[mode])
+    streams = [DroneVideoStream(BASE_PORT + i, engine=engine) for i in range(count)]
+    try:
+        cpu_before = engine_cpu_time(engine)
+        wall_before = time.perf_counter()
+        result = run_load(streams, duration, rate, burst)
+        result['cpu_per_stream'] = (engine_cpu_time(engine) - cpu_before) / (time.perf_counter() - wall_before) / count
+        result['batched_io'] = engine.batched_io
+        if engine.buffer_pool is not None:
+            result['pool'] = engine.buffer_pool.stats()
+        return result
+    finally:
+        engine.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--rate', type=int, default=300, help='datagrams per second per stream')
+    parser.add_argument('--burst', type=int, default=10, help='datagrams per frame')
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    print(f"{'mode':<12}{'streams':>8}{'offered pps':>14}{'forwarded pps':>15}{'loss':>8}{'cpu/stream':>12}{'pool hwm':>10}{'exhausted':>11}")
+    for count in args.streams:
+        for mode in MODES:
+            result = run(count, args.duration, args.rate, args.burst, mode)
+            if mode == 'batched' and not result['batched_io']:
+                mode = 'batched (unavailable, fell back to pooled)'
+            pool = result.get('pool', {})
+            print(
+                f"{mode:<12}{count:>8}{result['offered_pps']:>14.0f}{result['forwarded_pps']:>15.0f}"
+                f"{result['loss']:>8.1%}{result['cpu_per_stream']:>12.2%}"
+                f"{pool.get('high_water_mark', '-'):>10}{pool.get('exhausted', '-'):>11}"
+            )
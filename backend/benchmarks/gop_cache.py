@@ -0,0 +1,100 @@
+'''Benchmark the time to the first decodable frame for a viewer that joins a running stream.
+
+A relay thread sends synthetic 30 fps H.264 (a keyframe every `--gop` frames) in 1460 byte datagrams.
+Viewers join at random moments, and the time from sending `SUB` to receiving the first SPS (where
+decoding can start) is measured, with the GOP cache turned off and on.
+
+Run from the `backend` directory:
+
+    python -m benchmarks.gop_cache --gop 60 --viewers 20
+'''
+
+# Default Python
+import argparse, random, socket, threading, time
+
+# Own classes for drone video
+from drone_video_stream import DroneVideoStream
+from video_engine import VideoEngine
+
+from benchmarks.h264_parser import DATAGRAM_SIZE, nal_unit
+from benchmarks.video_forwarding import BASE_PORT, percentile
+
+SPS_START = b'\x00\x00\x01\x67'
+
+
+def send_video(address: tuple[str, int], fps: int, gop: int, stop: threading.Event) -> None:
+    """Publish synthetic video until `stop` is set."""
+    rng = random.Random(0)
+    relay = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    relay.sendto(b'RTS', address)
+    relay.recv(32)
+
+    index = 0
+    while not stop.is_set():
+        if index % gop == 0:
+            frame = nal_unit(0x67, 0x64, 12, rng) + nal_unit(0x68, 0xEE, 4, rng) + nal_unit(0x65, 0x88, 30000, rng)
+        else:
+            frame = nal_unit(0x41, 0x9A, 5000, rng)
+        for offset in range(0, len(frame), DATAGRAM_SIZE):
+            relay.sendto(frame[offset:offset + DATAGRAM_SIZE], address)
+        index += 1
+        time.sleep(1 / fps)
+    relay.close()
+
+
+def time_to_first_frame(stream: DroneVideoStream, address: tuple[str, int], timeout: float) -> float:
+    """Subscribe a new viewer, and return the seconds until it receives an SPS."""
+    viewer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    viewer.bind(('127.0.0.1', 0))
+    viewer.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    viewer.settimeout(timeout)
+
+    start = time.perf_counter()
+    viewer.sendto(f'SUB {stream.issue_ticket()}'.encode('utf-8'), address)
+    try:
+        while SPS_START not in viewer.recv(2048):
+            pass
+        return time.perf_counter() - start
+    except socket.timeout:
+        return timeout
+    finally:
+        viewer.sendto(b'UNSUB', address)
+        viewer.close()
+
+
+def run(gop_cache_bytes: int, fps: int, gop: int, viewers: int) -> list[float]:
+    engine = VideoEngine()
+    stream = DroneVideoStream(BASE_PORT, engine=engine, max_subscribers=viewers, gop_cache_bytes=gop_cache_bytes)
+    address = ('127.0.0.1', BASE_PORT)
+    stop = threading.Event()
+    relay = threading.Thread(target=send_video, args=(address, fps, gop, stop))
+    relay.start()
+
+    try:
+        # Let the first GOP arrive.
+        time.sleep(gop / fps + 0.5)
+        results = []
+        for _ in range(viewers):
+            time.sleep(random.uniform(0, gop / fps))
+            results.append(time_to_first_frame(stream, address, timeout=2 * gop / fps + 1))
+        return results
+    finally:
+        stop.set()
+        relay.join()
+        engine.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--gop', type=int, default=60, help='frames per keyframe')
+    parser.add_argument('--viewers', type=int, default=20, help='viewers that join, one after another')
+    args = parser.parse_args()
+
+    print(f"{'gop cache':<12}{'mean ms':>10}{'p50 ms':>10}{'max ms':>10}")
+    for name, gop_cache_bytes in (('off', 0), ('on', 4 * 1024 * 1024)):
+        results = sorted(run(gop_cache_bytes, args.fps, args.gop, args.viewers))
+        print(
+            f"{name:<12}{sum(results) / len(results) * 1000:>10.1f}"
+            f"{percentile(results, 0.5) * 1000:>10.1f}{results[-1] * 1000:>10.1f}"
+        )
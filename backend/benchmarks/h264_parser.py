@@ -0,0 +1,66 @@
+'''Benchmark the H.264 Annex B parser against the load of 500 drones on one core.
+
+Builds one second of synthetic 30 fps video (an IDR frame with SPS and PPS every `--gop` frames, the other
+frames predicted), cut into 1460 byte datagrams like a Tello's. Every stream gets its own `AnnexBParser`,
+and the datagrams are fed to them as `memoryview`s, like the video engine does. This reports the CPU time
+per datagram, and how many streams one core can parse in real time.
+
+Run from the `backend` directory:
+
+    python -m benchmarks.h264_parser --streams 500 --seconds 5
+'''
+
+# Default Python
+import argparse, random, time
+
+from h264 import AnnexBParser
+
+DATAGRAM_SIZE = 1460
+
+
+def nal_unit(header: int, first: int, size: int, rng: random.Random) -> bytes:
+    # No zero bytes in the payload, so it never contains a start code.
+    return b'\x00\x00\x00\x01' + bytes([header, first]) + rng.randbytes(size).replace(b'\x00', b'\x01')
+
+
+def one_second(fps: int, gop: int, keyframe_size: int, frame_size: int) -> list[bytes]:
+    """Returns one second of video, cut into datagrams."""
+    rng = random.Random(0)
+    stream = bytearray()
+    for index in range(fps):
+        if index % gop == 0:
+            stream += nal_unit(0x67, 0x64, 12, rng) + nal_unit(0x68, 0xEE, 4, rng) + nal_unit(0x65, 0x88, keyframe_size, rng)
+        else:
+            stream += nal_unit(0x41, 0x9A, frame_size, rng)
+    return [bytes(stream[offset:offset + DATAGRAM_SIZE]) for offset in range(0, len(stream), DATAGRAM_SIZE)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', type=int, default=500)
+    parser.add_argument('--seconds', type=int, default=5, help='seconds of video per stream')
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--gop', type=int, default=30, help='frames per keyframe')
+    parser.add_argument('--keyframe-size', type=int, default=30000)
+    parser.add_argument('--frame-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    datagrams = [memoryview(datagram) for datagram in one_second(args.fps, args.gop, args.keyframe_size, args.frame_size)]
+    parsers = [AnnexBParser() for _ in range(args.streams)]
+    frames = [0]
+    for stream in parsers:
+        stream.listeners.append(lambda frame: frames.__setitem__(0, frames[0] + 1))
+
+    # Interleave the streams, like datagrams arrive on the engine.
+    start = time.process_time()
+    for _ in range(args.seconds):
+        for datagram in datagrams:
+            for stream in parsers:
+                stream.feed(datagram)
+    cpu = time.process_time() - start
+
+    count = len(datagrams) * args.seconds * args.streams
+    video = args.seconds * args.streams
+    print(f"{args.streams} streams, {len(datagrams)} datagrams per second per stream, {frames[0]} frames parsed")
+    print(f"{cpu:.2f} s CPU for {video} s of video: {cpu / count * 1e6:.2f} us per datagram")
+    print(f"One core keeps up with {video / cpu:.0f} streams ({cpu / args.seconds:.1%} of a core for {args.streams})")
@@ -0,0 +1,72 @@
+'''Benchmark how many drone streams the HLS packager keeps up with in real time.
+
+Synthetic 30 fps H.264 of `--bitrate` Mbit/s (a keyframe every `--gop` frames) is parsed into access units,
+which are then muxed into MPEG-TS with `TsMuxer`, and written as HLS segments by an `HlsPackager`. This
+reports the time per second of video, and so how many streams one core can package in real time.
+
+Run from the `backend` directory:
+
+    python -m benchmarks.hls_packager --seconds 60 --bitrate 2
+'''
+
+# Default Python
+import argparse, random, tempfile, time
+
+# Own classes for drone video
+from h264 import AnnexBParser
+from hls import HlsPackager, TsMuxer
+
+from benchmarks.h264_parser import DATAGRAM_SIZE, nal_unit
+
+FPS = 30
+
+
+def new_frames(seconds: int, bitrate: float, gop: int) -> list:
+    """Synthetic video, parsed into access units that arrive 1/30 second apart."""
+    rng = random.Random(0)
+    frame_size = int(bitrate * 1_000_000 / 8 / FPS)
+
+    parser = AnnexBParser()
+    frames = []
+    parser.listeners.append(frames.append)
+
+    for index in range(seconds * FPS + 1):
+        if index % gop == 0:
+            data = nal_unit(0x67, 0x64, 12, rng) + nal_unit(0x68, 0xEE, 4, rng) + nal_unit(0x65, 0x88, frame_size * 4, rng)
+        else:
+            data = nal_unit(0x41, 0x9A, frame_size, rng)
+        for offset in range(0, len(data), DATAGRAM_SIZE):
+            parser.feed(data[offset:offset + DATAGRAM_SIZE], arrival=index / FPS)
+
+    return frames
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=int, default=60)
+    parser.add_argument('--bitrate', type=float, default=2, help='Mbit/s')
+    parser.add_argument('--gop', type=int, default=30, help='frames between keyframes')
+    args = parser.parse_args()
+
+    frames = new_frames(args.seconds, args.bitrate, args.gop)
+    size = sum(frame.size for frame in frames)
+
+    muxer = TsMuxer()
+    start = time.perf_counter()
+    packets = sum(len(muxer.mux(frame)) for frame in frames) // 188
+    mux_time = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        packager = HlsPackager(directory)
+        start = time.perf_counter()
+        for frame in frames:
+            packager.add(frame)
+        packager.close()
+        package_time = time.perf_counter() - start
+
+    print(f"{args.seconds} s of {args.bitrate} Mbit/s video: {len(frames)} frames, {size / 1e6:.1f} MB, {packets} TS packets")
+    for name, elapsed in (("mux only", mux_time), ("mux and write segments", package_time)):
+        print(
+            f"{name:>24}: {elapsed / args.seconds * 1000:.2f} ms per second of video, "
+            f"{args.seconds / elapsed:.0f} streams per core in real time"
+        )
@@ -0,0 +1,82 @@
+'''Benchmark random seeks in a recording of many GB.
+
+This writes a recording of `--gigabytes` GB in segments of `--segment-megabytes` MB, with a keyframe every
+`--gop` seconds of 2 Mbit/s video, like the `Recorder` would. The segments are sparse files, so they take
+no disk space, but their index is real. Then it seeks to `--seeks` random times, the way the
+`/drone/recording/seek` and `/drone/recording/segment` routes do: it finds the keyframe with
+`seek_recording()`, maps the segment and reads the first 64 KB from the keyframe on.
+
+This reports the latency of a seek (median, 99th percentile and the worst). The 64 KB are read from the page
+cache of a sparse file, so the time of the disk itself is not included.
+
+Run from the `backend` directory:
+
+    python -m benchmarks.recording_seek --gigabytes 8 --seeks 10000
+'''
+
+# Default Python
+import argparse, os, random, statistics, tempfile, time
+
+# Own functions for recorded drone video
+from playback import Segment, seek_recording
+from recorder import INDEX_ENTRY
+
+START = 1716286502.25
+BITRATE = 2_000_000 / 8 # bytes per second
+READ_SIZE = 64 * 1024
+
+
+def write_recording(directory: str, gigabytes: float, segment_megabytes: int, gop: float) -> float:
+    """Write a sparse recording. Returns when it ends."""
+    segment_size: int = segment_megabytes * 1024 * 1024
+    gop_size: int = int(BITRATE * gop)
+    arrival: float = START
+
+    for _ in range(max(int(gigabytes * 1024 / segment_megabytes), 1)):
+        name: str = time.strftime('%Y%m%d-%H%M%S', time.gmtime(arrival)) + f".{int(arrival * 1000) % 1000:03}"
+        path: str = os.path.join(directory, name)
+
+        with open(path + '.idx', 'wb') as index:
+            for offset in range(0, segment_size, gop_size):
+                index.write(INDEX_ENTRY.pack(arrival, offset))
+                arrival += gop
+
+        with open(path + '.h264', 'wb') as segment:
+            segment.truncate(segment_size)
+
+    return arrival
+
+
+def run(directory: str, end: float, seeks: int) -> list[float]:
+    latencies: list[float] = []
+    for _ in range(seeks):
+        timestamp: float = random.uniform(START, end)
+
+        begin: float = time.perf_counter()
+        name, _, offset = seek_recording(directory, timestamp)
+        with Segment(os.path.join(directory, name)) as segment:
+            segment.data[offset:offset + READ_SIZE]
+        latencies.append(time.perf_counter() - begin)
+
+    return latencies
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--gigabytes', type=float, default=8)
+    parser.add_argument('--segment-megabytes', type=int, default=256)
+    parser.add_argument('--gop', type=float, default=1, help='seconds between keyframes')
+    parser.add_argument('--seeks', type=int, default=10000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        end = write_recording(directory, args.gigabytes, args.segment_megabytes, args.gop)
+        segments = len(os.listdir(directory)) // 2
+        keyframes = round((end - START) / args.gop)
+
+        latencies = sorted(run(directory, end, args.seeks))
+        print(f"{args.gigabytes} GB in {segments} segments, {keyframes} keyframes, {(end - START) / 3600:.1f} hours")
+        print(
+            f"seek latency: median {statistics.median(latencies) * 1000:.3f} ms, "
+            f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.3f} ms, max {latencies[-1] * 1000:.3f} ms"
+        )
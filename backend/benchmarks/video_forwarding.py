@@ -0,0 +1,230 @@
+'''Benchmark the video forwarding engine against the old thread-per-stream design.
+
+For every stream a fake relay (publisher) and a fake client (viewer) connect over UDP on localhost.
+The publishers send 1460 byte datagrams (the size of a Tello H.264 datagram) at a fixed rate, each
+stamped with the time it was sent. The viewers record when it arrives. The result is the number of
+packets forwarded per second and the p50/p99 forwarding latency.
+
+Run from the `backend` directory:
+
+    python -m benchmarks.video_forwarding --streams 10 100 500 --duration 5 --rate 50
+'''
+
+# Default Python
+import argparse, resource, selectors, socket, struct, threading, time
+
+# Own classes for drone video
+from drone_video_stream import DroneVideoStream
+from video_engine import VideoEngine
+
+BASE_PORT: int = 40000
+PAYLOAD_SIZE: int = 1460
+TIMESTAMP: struct.Struct = struct.Struct('!d')
+
+
+class ThreadedVideoStream:
+    """The old `DroneVideoStream`: one thread per stream blocking in `recvfrom()`.
+
+    Kept here so the engine can be compared against it.
+    """
+
+    def __init__(self, video_port: int) -> None:
+        self.video_port: int = video_port
+        self.active: bool = True
+        self.connections: list = []
+        self.socket: socket.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('', video_port))
+        threading.Thread(target=self.check_conn, daemon=True).start()
+
+    def check_conn(self) -> None:
+        while len(self.connections) < 2 and self.active:
+            try:
+                _, address = self.socket.recvfrom(2048)
+            except OSError:
+                return
+            if address not in self.connections:
+                self.connections.append(address)
+
+        for address in self.connections:
+            self.socket.sendto(b'hello drone', address)
+
+        while self.active:
+            try:
+                data, addr = self.socket.recvfrom(2048)
+            except OSError:
+                return
+            for address in self.connections:
+                if address != addr:
+                    try:
+                        self.socket.sendto(data, address)
+                    except OSError:
+                        pass
+
+    def close(self) -> None:
+        self.active = False
+        # `shutdown()` wakes the thread blocked in `recvfrom()`, so the port is released.
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+
+
+def connect_peers(port: int, ticket: str = '') -> tuple[socket.socket, socket.socket]:
+    """Connect a publisher and a viewer to a stream and wait for both confirmations.
+
+    Args:
+        port (int): The video port of the stream.
+        ticket (str): A subscription ticket for the viewer.
+
+    Returns:
+        tuple[socket.socket, socket.socket]: The publisher and viewer sockets.
+    """
+    peers: list[socket.socket] = []
+    for _ in range(2):
+        peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        peer.bind(('127.0.0.1', 0))
+        peer.settimeout(0.2)
+        peers.append(peer)
+
+    confirmed: set = set()
+    while len(confirmed) < 2:
+        for peer, hello in zip(peers, (b'RTS', f'SUB {ticket}'.encode('utf-8'))):
+            if peer in confirmed:
+                continue
+            peer.sendto(hello, ('127.0.0.1', port))
+            try:
+                peer.recvfrom(2048)
+                confirmed.add(peer)
+            except socket.timeout:
+                pass
+
+    for peer in peers:
+        peer.setblocking(False)
+
+    return peers[0], peers[1]
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    if not samples:
+        return float('nan')
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def run_load(streams: list[object], duration: float, rate: int, burst: int = 1) -> dict[str, float]:
+    """Send paced video-sized datagrams through every stream and measure what comes out.
+
+    Args:
+        streams (list[object]): The video streams under test.
+        duration (float): How long to send for, in seconds.
+        rate (int): Datagrams per second per stream.
+        burst (int): Datagrams sent back to back per stream, like the datagrams of one Tello frame.
+
+    Returns:
+        dict[str, float]: Offered and forwarded packets per second and latency percentiles in ms.
+    """
+    pairs: list[tuple[socket.socket, socket.socket]] = [
+        connect_peers(stream.video_port, stream.issue_ticket() if hasattr(stream, 'issue_ticket') else '')
+        for stream in streams
+    ]
+    targets: list[tuple[str, int]] = [('127.0.0.1', stream.video_port) for stream in streams]
+
+    latencies: list[float] = []
+    sent: int = 0
+    running: threading.Event = threading.Event()
+    running.set()
+
+    def receive() -> None:
+        selector = selectors.DefaultSelector()
+        for _, viewer in pairs:
+            selector.register(viewer, selectors.EVENT_READ)
+
+        while running.is_set():
+            for key, _ in selector.select(timeout=0.1):
+                try:
+                    while True:
+                        data = key.fileobj.recv(2048)
+                        latencies.append(time.perf_counter() - TIMESTAMP.unpack_from(data)[0])
+                except (BlockingIOError, struct.error):
+                    pass
+        selector.close()
+
+    receiver: threading.Thread = threading.Thread(target=receive, daemon=True)
+    receiver.start()
+
+    padding: bytes = bytes(PAYLOAD_SIZE - TIMESTAMP.size)
+    interval: float = burst / rate
+    start: float = time.perf_counter()
+    next_tick: float = start
+
+    while time.perf_counter() - start < duration:
+        for (publisher, _), target in zip(pairs, targets):
+            for _ in range(burst):
+                try:
+                    publisher.sendto(TIMESTAMP.pack(time.perf_counter()) + padding, target)
+                    sent += 1
+                except BlockingIOError:
+                    pass
+        next_tick += interval
+        delay = next_tick - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    elapsed: float = time.perf_counter() - start
+
+    # Let the last datagrams drain before stopping the receiver.
+    time.sleep(0.5)
+    running.clear()
+    receiver.join()
+
+    for publisher, viewer in pairs:
+        publisher.close()
+        viewer.close()
+
+    return {
+        'offered_pps': sent / elapsed,
+        'forwarded_pps': len(latencies) / elapsed,
+        'loss': 1 - len(latencies) / sent if sent else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def run_threaded(count: int, duration: float, rate: int) -> dict[str, float]:
+    streams = [ThreadedVideoStream(BASE_PORT + i) for i in range(count)]
+    try:
+        return run_load(streams, duration, rate)
+    finally:
+        for stream in streams:
+            stream.close()
+
+
+def run_engine(count: int, duration: float, rate: int) -> dict[str, float]:
+    engine = VideoEngine()
+    streams = [DroneVideoStream(BASE_PORT + i, engine=engine) for i in range(count)]
+    try:
+        return run_load(streams, duration, rate)
+    finally:
+        engine.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--rate', type=int, default=50, help='datagrams per second per stream')
+    args = parser.parse_args()
+
+    # Three sockets per stream. Raise the soft limit for open files as far as we are allowed.
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    print(f"{'design':<10}{'streams':>8}{'offered pps':>14}{'forwarded pps':>15}{'loss':>8}{'p50 ms':>9}{'p99 ms':>9}")
+    for count in args.streams:
+        for design, run in (('threaded', run_threaded), ('engine', run_engine)):
+            result = run(count, args.duration, args.rate)
+            print(
+                f"{design:<10}{count:>8}{result['offered_pps']:>14.0f}{result['forwarded_pps']:>15.0f}"
+                f"{result['loss']:>8.1%}{result['p50_ms']:>9.2f}{result['p99_ms']:>9.2f}"
+            )
@@ -0,0 +1,131 @@
+'''Benchmark what the quality of service metrics cost, compared to forwarding a datagram.
+
+A stream with `--viewers` viewers is fed `--datagrams` synthetic H.264 datagrams of 1460 bytes, straight into
+`DroneVideoStream.datagram_received()`, which parses them and sends them to every viewer over a real UDP
+socket on localhost. That is the cost of forwarding.
+
+The metrics are then timed on their own, since they are too cheap to tell apart from the noise of forwarding:
+the two additions per datagram, and the frame listener called with every frame of the same datagrams.
+
+Run from the `backend` directory:
+
+    python -m benchmarks.video_metrics --datagrams 200000 --viewers 2
+'''
+
+# Default Python
+import argparse, random, socket, time
+
+# Own classes for drone video
+from drone_video_stream import DroneVideoStream
+from h264 import AccessUnit, AnnexBParser
+from video_engine import VideoEngine
+from video_metrics import StreamMetrics
+
+from benchmarks.h264_parser import DATAGRAM_SIZE, nal_unit
+
+VIDEO_PORT = 46322
+RELAY = ('127.0.0.1', 50000)
+
+
+class SocketTransport:
+    """Sends to the viewers on a real socket, like the engine's transport, but never makes them wait."""
+
+    def __init__(self) -> None:
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+    def try_sendto(self, data: bytes, addr: tuple[str, int]) -> bool:
+        try:
+            self.socket.sendto(data, addr)
+        except BlockingIOError:
+            pass
+        return True
+
+
+def new_datagrams(count: int) -> list[bytes]:
+    rng = random.Random(0)
+    data = bytearray()
+    index = 0
+    while len(data) < count * DATAGRAM_SIZE:
+        if index % 30 == 0:
+            data += nal_unit(0x67, 0x64, 12, rng) + nal_unit(0x68, 0xEE, 4, rng) + nal_unit(0x65, 0x88, 30000, rng)
+        else:
+            data += nal_unit(0x41, 0x9A, 5000, rng)
+        index += 1
+    return [bytes(data[offset:offset + DATAGRAM_SIZE]) for offset in range(0, count * DATAGRAM_SIZE, DATAGRAM_SIZE)]
+
+
+def forward(engine: VideoEngine, datagrams: list[bytes], viewers: list[socket.socket]) -> float:
+    """Returns the seconds per datagram."""
+    transport = SocketTransport()
+    stream = DroneVideoStream(VIDEO_PORT, engine=engine)
+    stream.publisher = RELAY
+    for viewer in viewers:
+        address = viewer.getsockname()
+        stream.add_subscriber(address)
+        stream.subscribers[address].send = lambda data, address=address: transport.try_sendto(data, address)
+
+    try:
+        start = time.perf_counter()
+        for datagram in datagrams:
+            stream.datagram_received(datagram, RELAY)
+        return (time.perf_counter() - start) / len(datagrams)
+
+    finally:
+        stream.close()
+        transport.socket.close()
+
+
+def count(datagrams: list[bytes], frames: list[AccessUnit]) -> float:
+    """Returns the seconds per datagram of the metrics, for the same datagrams and their frames."""
+    metrics = StreamMetrics()
+    per_frame = len(datagrams) / len(frames)
+
+    start = time.perf_counter()
+    for datagram in datagrams:
+        metrics.packets += 1
+        metrics.bytes += len(datagram)
+    for index, frame in enumerate(frames):
+        metrics.packets = int(index * per_frame)
+        metrics.frame(frame)
+    elapsed = time.perf_counter() - start
+
+    # The same loops without the metrics, which forwarding does not pay for.
+    start = time.perf_counter()
+    for datagram in datagrams:
+        len(datagram)
+    for index, frame in enumerate(frames):
+        int(index * per_frame)
+    elapsed -= time.perf_counter() - start
+
+    return elapsed / len(datagrams)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--datagrams', type=int, default=200000)
+    parser.add_argument('--viewers', type=int, default=2)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    engine = VideoEngine()
+    viewers = []
+    for _ in range(args.viewers):
+        viewer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        viewer.bind(('127.0.0.1', 0))
+        viewers.append(viewer)
+
+    datagrams = new_datagrams(args.datagrams)
+    frames = []
+    parser = AnnexBParser()
+    parser.listeners.append(frames.append)
+    for datagram in datagrams:
+        parser.feed(datagram)
+
+    forwarding = min(forward(engine, datagrams, viewers) for _ in range(args.rounds))
+    metrics = min(count(datagrams, frames) for _ in range(args.rounds))
+    engine.stop()
+
+    print(f"{args.datagrams} datagrams ({len(frames)} frames) to {args.viewers} viewers, best of {args.rounds}")
+    print(f"  forwarding: {forwarding * 1e6:.2f} us per datagram")
+    print(f"     metrics: {metrics * 1e6:.3f} us per datagram, {metrics / forwarding:.1%} of forwarding")
@@ -0,0 +1,140 @@
+'''Benchmark the video ingest port sharded over 1, 2, 4 and 8 worker processes.
+
+Every stream has a relay socket and a viewer socket. Load generator processes (so the load is not bound by
+one interpreter either) send 1200 byte datagrams with the multiplexed header as fast as the workers take
+them for `--duration` seconds, and count what the viewers receive. This reports the forwarded datagrams per
+second for every number of workers.
+
+The workers only scale as far as there are cores for them (and for the load generators), so run it on
+a machine with at least as many cores as workers.
+
+Run from the `backend` directory:
+
+    python -m benchmarks.video_workers --workers 1 2 4 8 --streams 64 --duration 5
+'''
+
+# Default Python
+import argparse, multiprocessing, os, resource, socket, time
+
+# Own classes for drone video
+from drone_video_stream import DroneVideoStream
+from video_header import VIDEO_HEADER, pack_header
+from video_workers import VideoWorkerPool
+
+INGEST_PORT = 46222
+PAYLOAD_SIZE = 1200
+
+
+def handshake(sock: socket.socket, message: bytes, address: tuple[str, int]) -> bool:
+    """Send `message` until the backend answers. The workers may still be starting."""
+    sock.settimeout(0.5)
+    for _ in range(20):
+        sock.sendto(message, address)
+        try:
+            sock.recv(32)
+            return True
+        except socket.timeout:
+            continue
+    return False
+
+
+def generate_load(streams: list[tuple[int, str]], duration: float, start: float, results: multiprocessing.Queue) -> None:
+    """Publish to and watch `streams` (stream ids and tickets) from one process."""
+    address = ('127.0.0.1', INGEST_PORT)
+    pairs: list[tuple[socket.socket, socket.socket, bytes]] = []
+
+    for stream_id, ticket in streams:
+        relay = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        viewer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        relay.bind(('127.0.0.1', 0))
+        viewer.bind(('127.0.0.1', 0))
+
+        header = bytearray(VIDEO_HEADER.size)
+        pack_header(header, stream_id, 0)
+        handshake(relay, bytes(header) + b'RTS', address)
+        handshake(viewer, f'SUB {ticket}'.encode('utf-8'), address)
+
+        relay.setblocking(False)
+        viewer.setblocking(False)
+        pairs.append((relay, viewer, bytes(header) + bytes(PAYLOAD_SIZE)))
+
+    # Start at the same time as the other generators.
+    time.sleep(max(0, start - time.time()))
+
+    sent: int = 0
+    received: int = 0
+    end: float = time.time() + duration
+    while time.time() < end:
+        for relay, viewer, datagram in pairs:
+            try:
+                relay.sendto(datagram, address)
+                sent += 1
+            except BlockingIOError:
+                pass
+
+            while True:
+                try:
+                    viewer.recv(2048)
+                    received += 1
+                except BlockingIOError:
+                    break
+
+    results.put((sent, received))
+
+
+def run(workers: int, count: int, duration: float, generators: int) -> dict[str, float]:
+    pool = VideoWorkerPool(workers=workers, port=INGEST_PORT)
+    streams = [DroneVideoStream(INGEST_PORT, engine=pool, stream_id=i + 1) for i in range(count)]
+    tickets = [(stream.stream_id, stream.issue_ticket()) for stream in streams]
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    start = time.time() + 5 + count * 0.01
+    processes = [
+        context.Process(target=generate_load, args=(tickets[i::generators], duration, start, results))
+        for i in range(generators)
+    ]
+
+    try:
+        for process in processes:
+            process.start()
+
+        sent = received = 0
+        for _ in processes:
+            process_sent, process_received = results.get()
+            sent += process_sent
+            received += process_received
+
+        return {
+            'offered_pps': sent / duration,
+            'forwarded_pps': received / duration,
+            'loss': 1 - received / sent if sent else 0,
+        }
+
+    finally:
+        for process in processes:
+            process.join()
+        for stream in streams:
+            stream.close()
+        pool.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--streams', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--generators', type=int, default=4, help='load generator processes')
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    print(f"{os.cpu_count()} cores")
+    print(f"{'workers':>8}{'streams':>8}{'offered pps':>14}{'forwarded pps':>15}{'loss':>8}")
+    for workers in args.workers:
+        result = run(workers, args.streams, args.duration, args.generators)
+        print(
+            f"{workers:>8}{args.streams:>8}{result['offered_pps']:>14.0f}"
+            f"{result['forwarded_pps']:>15.0f}{result['loss']:>8.1%}"
+        )
@@ -0,0 +1,106 @@
+'''Benchmark JSON against MessagePack on the bodies a relay with many drones sends and gets all the time.
+
+The bodies are those of a relay with `--drones` drones:
+    - heartbeat: The answer to `/heartbeat`, with every drone's attributes and status.
+    - sync: A `/sync` with the status of every drone, and the versions of their commands.
+    - sync answer: The answer to it, with new commands for a fifth of the drones.
+
+Each is encoded and decoded `--rounds` times, with JSON the way Starlette's `JSONResponse` does it, and with
+MessagePack (see `wire_format.py`). Validating the decoded body into a Pydantic model costs the same either
+way, so it is left out.
+
+Run from the `backend` directory:
+
+    python -m benchmarks.wire_format --drones 50 --rounds 2000
+'''
+
+# Default Python
+import argparse, json, random, time
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# What a Tello EDU sends about ten times a second. See `relaybox.py`.
+STATUS: str = (
+    "mid:-1;x:-100;y:-100;z:-100;mpry:0,0,0;pitch:{pitch};roll:{roll};yaw:{yaw};vgx:0;vgy:0;vgz:0;templ:48;"
+    "temph:50;tof:{tof};h:{height};bat:{battery};baro:{baro:.2f};time:{time};agx:-9.00;agy:-1.00;agz:-998.00;\r\n"
+)
+
+
+def status(rng: random.Random) -> str:
+    return STATUS.format(
+        pitch=rng.randint(-10, 10), roll=rng.randint(-10, 10), yaw=rng.randint(-180, 180), tof=rng.randint(10, 400),
+        height=rng.randint(0, 300), battery=rng.randint(10, 100), baro=rng.uniform(-10, 10), time=rng.randint(0, 600)
+    )
+
+
+def payloads(drones: int, rng: random.Random) -> dict[str, dict]:
+    """Returns the bodies of a relay with `drones` drones, by name."""
+    names: list[str] = [f"drone_{number:03d}" for number in range(1, drones + 1)]
+
+    heartbeat: dict = { "message": "Hello relay_0001", "relay_0001": { "drones": {
+        name: {
+            "name": name, "cmd_queue": [0, 0, 0, 0], "cmd_version": rng.randint(1, 10000), "port": 52221,
+            "stream_id": number, "airborn": True, "should_takeoff": False, "should_land": False,
+            "status_information": status(rng)
+        } for number, name in enumerate(names)
+    } } }
+
+    sync: dict = {
+        "name": "relay_0001",
+        "statuses": { name: status(rng) for name in names },
+        "versions": { name: rng.randint(1, 10000) for name in names },
+        "membership": drones
+    }
+
+    answer: dict = { "drones": {
+        name: { "rc": [rng.randint(-100, 100) for _ in range(4)], "version": rng.randint(1, 10000) }
+        for name in names[::5]
+    }, "membership": drones }
+
+    return { "heartbeat": heartbeat, "sync": sync, "sync answer": answer }
+
+
+def measure(encode, decode, body: dict, rounds: int) -> tuple[float, float, int]:
+    """Returns the seconds to encode and to decode the body once, and its size in bytes."""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        data = encode(body)
+    encoded = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        decode(data)
+    decoded = time.perf_counter() - start
+
+    return encoded / rounds, decoded / rounds, len(data)
+
+
+def json_encode(body: dict) -> bytes:
+    # Like Starlette's `JSONResponse.render()`.
+    return json.dumps(body, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--drones', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"A relay with {args.drones} drones, {args.rounds} rounds")
+    if msgpack is None:
+        print("msgpack is not installed (pip install msgpack), so only JSON is measured")
+
+    for name, body in payloads(args.drones, random.Random(0)).items():
+        encode, decode, size = measure(json_encode, json.loads, body, args.rounds)
+        print(f"{name:>12} JSON: {size:6} bytes, encode {encode * 1e6:7.1f} us, decode {decode * 1e6:7.1f} us")
+
+        if msgpack is not None:
+            packed_encode, packed_decode, packed_size = measure(msgpack.packb, msgpack.unpackb, body, args.rounds)
+            print(
+                f"{'':>12} msgpack: {packed_size:6} bytes, encode {packed_encode * 1e6:7.1f} us, "
+                f"decode {packed_decode * 1e6:7.1f} us ({(encode + decode) / (packed_encode + packed_decode):.1f} "
+                f"times faster, {1 - packed_size / size:.0%} smaller)"
+            )
@@ -0,0 +1,111 @@
+'''A bounded pool of preallocated buffers for receiving video datagrams.
+
+Receiving with `socket.recvfrom()` allocates a new `bytes` object for every datagram. At 30 fps with 10+
+datagrams per frame for every drone, that is a steady stream of allocations. Instead the video sockets
+receive into a `Slab` from the pool (with `recvfrom_into()` or `recvmmsg()`), the datagram is forwarded
+as a `memoryview` of the slab, and the slab is released back to the pool once it has been sent.
+
+Classes:
+    Slab: A fixed-size `bytearray` and a `memoryview` of it.
+    BufferPool: Hands out and takes back slabs, and counts how many are in use.
+
+Example:
+    >>> pool = BufferPool(slab_size=2048, capacity=256)
+    >>> slab = pool.acquire()
+    >>> size, addr = sock.recvfrom_into(slab.buffer)
+    >>> sock.sendto(slab.view[:size], viewer)
+    >>> pool.release(slab)
+
+Note:
+    A `memoryview` of a slab is only valid until the slab is released. Anything that keeps a datagram
+    for longer (for example a cache) must copy it with `bytes()` first.
+'''
+
+
+class Slab:
+    """A fixed-size buffer from a `BufferPool`.
+
+    Attributes:
+        buffer (bytearray): The buffer to receive into.
+        view (memoryview): A `memoryview` of `buffer`. Slice it to forward a datagram without copying.
+        address (int): The memory address of `buffer`, for `ctypes`. Set by `batched_udp.py` when needed.
+        pooled (bool): `False` if the pool was exhausted and this slab was allocated just for this datagram.
+    """
+    __slots__ = ('buffer', 'view', 'address', 'pooled')
+
+    def __init__(self, size: int, pooled: bool = True) -> None:
+        self.buffer: bytearray = bytearray(size)
+        self.view: memoryview = memoryview(self.buffer)
+        self.address: int = 0
+        self.pooled: bool = pooled
+
+
+class BufferPool:
+    """A bounded pool of `Slab`s that are allocated once and reused.
+
+    If every slab is in use, `acquire()` still returns a slab, but a temporary one that is not returned
+    to the pool. This is counted in `exhausted`, so a too small pool shows up in the stats.
+
+    Attributes:
+        slab_size (int): The size of every slab in bytes.
+        capacity (int): The number of slabs in the pool.
+        in_use (int): Slabs from the pool that are currently acquired.
+        high_water_mark (int): The most slabs that have been in use at the same time.
+        exhausted (int): How many times `acquire()` found the pool empty.
+    """
+
+    def __init__(self, slab_size: int = 2048, capacity: int = 1024) -> None:
+        self.slab_size: int = slab_size
+        self.capacity: int = capacity
+        self.in_use: int = 0
+        self.high_water_mark: int = 0
+        self.exhausted: int = 0
+
+        # Preallocate every slab.
+        self._free: list[Slab] = [Slab(slab_size) for _ in range(capacity)]
+
+    def acquire(self) -> Slab:
+        """Get a slab to receive into.
+
+        Returns:
+            Slab: A slab from the pool, or a temporary slab if the pool is exhausted.
+        """
+        try:
+            slab: Slab = self._free.pop()
+
+        except IndexError:
+            self.exhausted += 1
+            return Slab(self.slab_size, pooled=False)
+
+        self.in_use += 1
+        if self.in_use > self.high_water_mark:
+            self.high_water_mark = self.in_use
+
+        return slab
+
+    def release(self, slab: Slab) -> None:
+        """Give a slab back to the pool once its datagram has been sent.
+
+        Args:
+            slab (Slab): A slab from `acquire()`.
+        """
+        # Temporary slabs are left to the garbage collector.
+        if not slab.pooled:
+            return
+
+        self.in_use -= 1
+        self._free.append(slab)
+
+    def stats(self) -> dict[str, int]:
+        """Returns the counters of the pool.
+
+        Example:
+            >>> { "slab_size": 2048, "capacity": 1024, "in_use": 64, "high_water_mark": 128, "exhausted": 0 }
+        """
+        return {
+            "slab_size": self.slab_size,
+            "capacity": self.capacity,
+            "in_use": self.in_use,
+            "high_water_mark": self.high_water_mark,
+            "exhausted": self.exhausted,
+        }
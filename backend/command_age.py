@@ -0,0 +1,70 @@
+'''How old the rc commands of a drone are when its relay gets them.
+
+A command that takes too long to reach the drone flies it with a stick position the user has already let go
+of. Every rc command is stamped with the time the backend got it (see `Drone.set_cmd_queue()`), and the relay
+drops the ones older than `RC_COMMAND_DEADLINE` and hovers instead. These are the ages it reports in `/sync`,
+or, for a relay that polls `/cmd_queue`, the ages when the backend hands the commands over.
+
+Classes:
+    CommandAge: The age of the newest command, its smoothed mean and maximum, and how many were stale.
+'''
+
+# Default Python
+import threading
+
+
+class CommandAge:
+    """The ages of the rc commands of one drone. Can be added to from any thread.
+
+    Attributes:
+        last (float | None): The age of the newest command (ms), or `None` before the first.
+        mean (float): The smoothed mean age (ms), like the jitter of `StreamMetrics`.
+        max (float): The oldest a command was (ms).
+        commands (int): How many commands had their age measured.
+        stale (int): How many commands the relay dropped for being too old.
+    """
+
+    def __init__(self) -> None:
+        self.last: float | None = None
+        self.mean: float = 0
+        self.max: float = 0
+        self.commands: int = 0
+        self.stale: int = 0
+
+        self._lock: threading.Lock = threading.Lock()
+
+    def add(self, age: float) -> None:
+        """Counts the age of a command.
+
+        Args:
+            age (float): How old the command was (ms).
+        """
+        with self._lock:
+            self.mean = age if self.last is None else self.mean + (age - self.mean) / 16
+            self.last = age
+            self.max = max(self.max, age)
+            self.commands += 1
+
+    def add_stale(self, count: int) -> None:
+        """Counts commands the relay dropped for being too old.
+
+        Args:
+            count (int): How many it dropped.
+        """
+        with self._lock:
+            self.stale += count
+
+    def stats(self) -> dict[str, float | int | None]:
+        """Returns the ages as JSON.
+
+        Example:
+            >>> { "last_ms": 12.5, "mean_ms": 14.1, "max_ms": 230.0, "commands": 1520, "stale": 3 }
+        """
+        with self._lock:
+            return {
+                "last_ms": None if self.last is None else round(self.last, 1),
+                "mean_ms": round(self.mean, 1),
+                "max_ms": round(self.max, 1),
+                "commands": self.commands,
+                "stale": self.stale
+            }
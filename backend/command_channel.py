@@ -0,0 +1,143 @@
+'''Push commands to the relayboxes over a WebSocket, instead of waiting for them to poll.
+
+A relaybox opens the WebSocket route `/v1/api/relay/commands` (see `relay_routes.py`) once, and keeps it open.
+When a user tells a drone to take off, land or fly (see `frontend_routes.py`), a message is sent on the
+WebSocket of the drone's relay right away. Every message is a JSON text message for one drone:
+
+    { "drone": "drone_001", "type": "takeoff" }
+    { "drone": "drone_001", "type": "land" }
+    { "drone": "drone_001", "type": "rc", "cmd": [0, 0, 0, 0], "version": 41, "issued": 1718000000.25 }
+
+The flags and the command queue of the drone (see `relaybox.py`) are still set, so a relaybox without the
+WebSocket can poll for them like before. When a relaybox connects, the pending takeoffs, landings and rc
+commands of its drones are sent first, so nothing set while it was polling is missed.
+
+Only the newest rc command of a drone is sent. If a user moves the sticks faster than the WebSocket can send,
+the rc commands in between are skipped instead of piling up in front of the newest one. The `version` and
+`issued` time of an rc command (see `Drone.command()`) let the relaybox drop one that arrives after a newer one,
+or too late to still be flown.
+
+Classes:
+    RelayChannel: The WebSocket of one relaybox, and the messages waiting to be sent on it.
+    CommandChannels: The WebSockets of every relaybox, by name.
+
+Attributes:
+    command_channels (CommandChannels): The WebSockets of the API process.
+'''
+
+# Default Python
+import asyncio, threading
+
+# The types of messages.
+TAKEOFF: str = "takeoff"
+LAND: str = "land"
+RC: str = "rc"
+
+
+class RelayChannel:
+    """The WebSocket of one relaybox, and the messages waiting to be sent on it.
+
+    Messages can be sent from any thread. They are written to the WebSocket on its own event loop, one at a time.
+
+    Attributes:
+        websocket (WebSocket): The accepted WebSocket of the relaybox.
+        sent (int): Messages sent.
+        skipped (int): rc commands skipped because a newer one for the same drone was waiting.
+    """
+
+    def __init__(self, websocket: object) -> None:
+        self.websocket: object = websocket
+        self.sent: int = 0
+        self.skipped: int = 0
+
+        # The event loop of the WebSocket. Messages arrive on the threads of the routes.
+        self._loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+        # The newest rc command of every drone that has one waiting. Only its drone's name is in the queue.
+        self._rc: dict[str, dict] = {}
+
+    def send(self, message: dict) -> None:
+        """Send a message to the relaybox. Can be called from any thread.
+
+        Args:
+            message (dict): The message. See the top of this file.
+        """
+        self._loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message: dict) -> None:
+        if message["type"] != RC:
+            self._queue.put_nowait(message)
+            return
+
+        drone: str = message["drone"]
+        if drone in self._rc:
+            self.skipped += 1
+        else:
+            self._queue.put_nowait(drone)
+        self._rc[drone] = message
+
+    async def run(self) -> None:
+        """Write the messages to the WebSocket until it fails, or the task is cancelled."""
+        while True:
+            message: dict | str = await self._queue.get()
+            if isinstance(message, str):
+                message = self._rc.pop(message)
+
+            await self.websocket.send_json(message)
+            self.sent += 1
+
+
+class CommandChannels:
+    """The WebSockets of every relaybox, by name.
+
+    Attributes:
+        channels (dict[str, RelayChannel]): The connected relayboxes, by name.
+    """
+
+    def __init__(self) -> None:
+        self.channels: dict[str, RelayChannel] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def connect(self, relay_name: str, channel: RelayChannel) -> None:
+        """Send the commands of a relaybox on a channel. It replaces the one it had, if it reconnected.
+
+        Args:
+            relay_name (str): The name of the relaybox.
+            channel (RelayChannel): Its new channel.
+        """
+        with self._lock:
+            self.channels[relay_name] = channel
+
+    def disconnect(self, relay_name: str, channel: RelayChannel) -> None:
+        """Stop sending on a channel, unless it has been replaced already.
+
+        Args:
+            relay_name (str): The name of the relaybox.
+            channel (RelayChannel): The channel that closed.
+        """
+        with self._lock:
+            if self.channels.get(relay_name) is channel:
+                del self.channels[relay_name]
+
+    def push(self, relay_name: str, drone_name: str, type: str, **fields: object) -> bool:
+        """Send a message for a drone to its relaybox, if the relaybox is connected.
+
+        Args:
+            relay_name (str): The name of the relaybox.
+            drone_name (str): The name of the drone.
+            type (str): `TAKEOFF`, `LAND` or `RC`.
+            **fields: The rest of the message, like `cmd` for `RC`.
+
+        Returns:
+            bool: `True` if it was sent, `False` if the relaybox has to poll for it.
+        """
+        channel: RelayChannel | None = self.channels.get(relay_name)
+        if channel is None:
+            return False
+
+        channel.send({ "drone": drone_name, "type": type, **fields })
+        return True
+
+
+command_channels: CommandChannels = CommandChannels()
@@ -0,0 +1,90 @@
+# The most viewers that may subscribe to one drone video stream at the same time.
+# This keeps one popular drone from starving the video streams of the others.
+VIDEO_MAX_SUBSCRIBERS = 8
+
+# Seconds a video subscription ticket can be used before it expires.
+VIDEO_TICKET_LIFETIME = 30
+
+# Use `recvmmsg`/`sendmmsg` to move many video datagrams per system call (Linux only).
+# Falls back to one `recvfrom`/`sendto` per datagram if it is not available.
+VIDEO_BATCHED_IO = False
+
+# The most datagrams received or sent per system call in batched mode.
+VIDEO_BATCH_SIZE = 64
+
+# Preallocated buffers that video datagrams are received into. See `buffer_pool.py`.
+# Set `VIDEO_BUFFER_POOL_SLABS` to 0 to let asyncio allocate a new `bytes` object for every datagram.
+VIDEO_BUFFER_POOL_SLABS = 4096
+VIDEO_BUFFER_SIZE = 2048
+
+# The one well-known port relays send all drone video to in multiplexed mode. See `video_header.py`.
+# Drones whose relay does not ask for multiplexed mode keep a video port of their own.
+VIDEO_INGEST_PORT = 52221
+
+# Worker processes that share the ingest port with `SO_REUSEPORT` (Linux only). See `video_workers.py`.
+# 0 forwards all video on the `VideoEngine` thread of the API process.
+# Above 0, the video of multiplexed drones stays in the workers and is only forwarded to UDP viewers. It gets
+# no WebSocket viewers, recording, HLS, snapshots, stats or bandwidth limits.
+VIDEO_WORKERS = 0
+
+# The most bytes of video kept per stream, so viewers that join can start at the last keyframe.
+# See `gop_cache.py`. 0 turns it off, and viewers wait for the next keyframe.
+VIDEO_GOP_CACHE_BYTES = 1024 * 1024
+
+# The most seconds video may wait for a slow viewer, and the most datagrams, before frames are dropped
+# for that viewer. See `subscriber_queue.py`.
+VIDEO_LATENCY_BUDGET = 0.25
+VIDEO_SUBSCRIBER_QUEUE_DEPTH = 1024
+
+# The most frames waiting to be sent to one browser over its WebSocket. See `video_websocket.py`.
+VIDEO_WEBSOCKET_MAX_FRAMES = 30
+
+# Record the video of every drone to disk, in segments with a keyframe index. See `recorder.py`.
+# A new segment is started at the first keyframe after `VIDEO_RECORDING_SEGMENT_BYTES` or `VIDEO_RECORDING_SEGMENT_SECONDS`.
+# If more than `VIDEO_RECORDING_QUEUE_BYTES` are waiting for the disk, video is dropped until the next keyframe.
+VIDEO_RECORDING = False
+VIDEO_RECORDING_DIRECTORY = "recordings"
+VIDEO_RECORDING_SEGMENT_BYTES = 256 * 1024 * 1024
+VIDEO_RECORDING_SEGMENT_SECONDS = 600
+VIDEO_RECORDING_QUEUE_BYTES = 16 * 1024 * 1024
+VIDEO_RECORDING_WRITE_BUFFER = 1024 * 1024
+
+# Package the video of every drone as HLS, so it plays in a browser. See `hls.py`.
+# A new segment is started at the first keyframe after `VIDEO_HLS_SEGMENT_SECONDS`.
+# The live playlist has the last `VIDEO_HLS_LIVE_SEGMENTS` segments, the VOD playlist all of them.
+VIDEO_HLS = False
+VIDEO_HLS_DIRECTORY = "hls"
+VIDEO_HLS_SEGMENT_SECONDS = 2
+VIDEO_HLS_LIVE_SEGMENTS = 6
+
+# The seconds packet, byte and frame rates of a video stream are counted over. See `video_metrics.py`.
+VIDEO_METRICS_WINDOW = 1
+
+# Put the datagrams from a relay back in order before they are parsed (see `reorder_buffer.py`). At most
+# `VIDEO_REORDER_DEPTH` datagrams wait for a missing one, for at most `VIDEO_REORDER_DEADLINE` seconds.
+# Only in multiplexed mode. 0 turns it off.
+VIDEO_REORDER_DEPTH = 32
+VIDEO_REORDER_DEADLINE = 0.015
+
+# Limits in bytes per second on the video sent to viewers, for every stream, every relay and all of it
+# (see `bandwidth.py`). 0 is no limit. They can be changed at runtime with `/video/bandwidth`.
+# A bucket holds `VIDEO_BANDWIDTH_BURST` seconds of its rate, unless it is given a burst of its own.
+VIDEO_BANDWIDTH_STREAM = 0
+VIDEO_BANDWIDTH_RELAY = 0
+VIDEO_BANDWIDTH_GLOBAL = 0
+VIDEO_BANDWIDTH_BURST = 0.5
+
+# A streaming video session is idle after `VIDEO_SESSION_IDLE` seconds without video, and any session is
+# closed after `VIDEO_SESSION_TIMEOUT` seconds without traffic. Checked every `VIDEO_SESSION_CHECK_INTERVAL`
+# seconds. See `video_sessions.py`.
+VIDEO_SESSION_IDLE = 5
+VIDEO_SESSION_TIMEOUT = 60
+VIDEO_SESSION_CHECK_INTERVAL = 1
+
+# The most seconds `/cmd_queue` holds a long-poll request from a relay before it answers with the same
+# command. Shorter than the idle timeout of the proxies in front of the relays.
+CMD_QUEUE_LONG_POLL_TIMEOUT = 25
+
+# Milliseconds a client's command may have been sent before its newest one and still be a request that was
+# overtaken on the way, which is dropped. One sent even earlier is from a clock that was set back, and is set.
+CMD_REORDER_WINDOW = 1000
@@ -1,11 +1,85 @@
 '''A file for streaming video for a drone
 
-This file defines a `DroneVideoStream` class which allows for streaming video from a drone. 
-It uses UDP and IPv4 to connect with clients and starts streaming video once two clients have connected.
-The class contains methods for binding the socket and waiting for connections from clients, sending and receiving data with the connected clients, and handling any errors that may occur during the process.
-The class also has attributes for storing the video port, socket object, and a list of connected clients.
+This file defines a `DroneVideoStream` class which allows for streaming video from a drone.
+It uses UDP and IPv4. The relay that streams the drone's video is the single publisher, and any number
+of authenticated viewers (up to `VIDEO_MAX_SUBSCRIBERS`) can subscribe and unsubscribe at runtime.
+A `DroneVideoStream` is a lightweight session. It does not own a thread or block on its socket. Instead it
+registers with the shared `VideoEngine` (see `video_engine.py`), which calls `datagram_received()` for
+every datagram that arrives on its video port.
+
+A session with a `stream_id` shares the multiplexed ingest port with other sessions instead. The engine
+strips the header (see `video_header.py`) from the relay's datagrams before they reach the session, and
+passes on viewers' control messages to the session that issued the ticket, so the protocol is the same.
+
+The protocol on the video port:
+    - `RTS <token>` from the relay makes it the publisher. It is answered with `hello drone`. The token is the
+      session's `publisher_token`, which `/new_drone` gives only to the relay (see `relay_routes.py`). Without
+      a token the session takes a bare `RTS` from anyone.
+    - `SUB <ticket>` from a viewer subscribes it. The ticket is issued by `issue_ticket()` to an
+      authorized user (see `frontend_routes.py`). It is answered with `hello drone`, or `FULL` if the
+      stream already has `VIDEO_MAX_SUBSCRIBERS` viewers.
+    - `UNSUB` from a viewer unsubscribes it.
+    - Every other datagram from the publisher is video, and is sent once to every subscriber.
+
+Every video datagram is also fed to an H.264 parser (see `h264.py`), which groups the video into frames.
+Other stages can get every frame with `add_frame_listener()`. The frames since the last keyframe are
+kept in a `GopCache` (see `gop_cache.py`), and sent to every new subscriber before the live video.
+
+The video sent to the subscribers is limited by token buckets for the stream, its relay and all video (see
+`bandwidth.py`). When one is empty, whole frames are dropped before they are sent to anyone.
+
+Each subscriber has a `SubscriberQueue` (see `subscriber_queue.py`). Video a subscriber cannot take right
+now waits there, and whole frames are dropped for it if it falls behind, without holding up the others.
+
+Every datagram and frame from the relay is counted in `metrics` (see `video_metrics.py`). In multiplexed mode
+the loss, reordering and delay of the datagrams from the relay are also counted in `transport_metrics`, from the
+sequence numbers and send times in their headers, and a `ReorderBuffer` (see `reorder_buffer.py`) puts them
+back in order before they are parsed and sent on. If the relay sends parity datagrams, a `FecDecoder` (see
+`fec.py`) rebuilds single lost datagrams from them before they are put back in order.
+
+The video can also be recorded to disk with `start_recording()` (see `recorder.py`), and packaged as HLS
+for browser players with `start_hls()` (see `hls.py`).
 '''
-import threading, socket
+import asyncio, secrets, time
+from typing import Callable
+
+from video_engine import VideoEngine, get_video_engine
+
+# Finds the frames in the video.
+from h264 import AccessUnit, AnnexBParser
+
+# Lets new viewers start at the last keyframe.
+from gop_cache import GopCache
+
+# Lets slow viewers fall behind without holding up the others.
+from subscriber_queue import SubscriberQueue, datagram_sender, starts_decoding
+
+# Packet, byte and frame rates, jitter and bursts.
+from video_metrics import StreamMetrics, TransportMetrics
+
+# Limits the bandwidth of the video sent to the subscribers.
+from bandwidth import TokenBucket, global_bucket
+
+# Puts the datagrams from the relay back in order, and rebuilds lost ones.
+from reorder_buffer import ReorderBuffer
+from fec import FecDecoder
+
+# Writes the video to disk.
+from recorder import Recorder
+
+# Packages the video as HLS.
+from hls import HlsPackager
+
+from config import (
+    VIDEO_BANDWIDTH_STREAM,
+    VIDEO_GOP_CACHE_BYTES,
+    VIDEO_MAX_SUBSCRIBERS,
+    VIDEO_REORDER_DEPTH,
+    VIDEO_TICKET_LIFETIME
+)
+
+# Seconds between attempts to send what is waiting for slow subscribers.
+_FLUSH_INTERVAL: float = 0.005
 
 class DroneVideoStream:
     """
@@ -13,113 +87,467 @@ class DroneVideoStream:
 
     Attributes:
         video_port (int): The port for the video stream.
-        socket (socket.socket | None): The socket used for the video stream.
+        transport (asyncio.DatagramTransport | None): The transport of the socket used for the video stream.
         active (bool): A flag indicating if the video stream is currently active.
-        connections (list): A list of tuples representing the active connections. Each
-            tuple contains the IP address and port number of a connected client.
+        publisher (tuple[str, int] | None): The IP address and port number of the relay streaming the video.
+        subscribers (dict[tuple[str, int], SubscriberQueue]): The IP address and port number of every subscribed
+            viewer, and its queue.
+        max_subscribers (int): The most viewers that may subscribe at the same time.
+        engine (VideoEngine): The engine that owns the socket and calls this session. A `VideoWorkerPool`
+            (see `video_workers.py`) if the session is forwarded by worker processes.
+        stream_id (int | None): The stream id on the multiplexed ingest port, or `None` if the session
+            has a video port of its own.
+        publisher_token (str | None): The secret a relay must send with `RTS` to become the publisher, or
+            `None` if any relay can.
+        parser (AnnexBParser): Groups the video from the publisher into frames.
+        gop_cache (GopCache): The frames since the last keyframe, for new subscribers.
+        metrics (StreamMetrics): The quality of service metrics of the video from the publisher.
+        transport_metrics (TransportMetrics): The loss, reordering and delay of the datagrams from the publisher.
+            Only counted in multiplexed mode.
+        reorder_buffer (ReorderBuffer | None): Puts the datagrams from the publisher back in order. Only in
+            multiplexed mode, if `reorder_depth` is not 0.
+        fec (FecDecoder | None): Rebuilds lost datagrams from the publisher's parity datagrams. Only if
+            `fec_group_size` is not 0, and there is a reorder buffer to put the rebuilt datagrams in.
+        bucket (TokenBucket): Limits the bandwidth of the video sent to the subscribers of this stream.
+        buckets (tuple[TokenBucket, ...]): Every bucket the video sent to the subscribers takes tokens from:
+            `bucket`, the relay's, and `global_bucket`.
+        policed_frames (int): Frames not sent to any subscriber because a bucket was empty, or because a frame
+            they are predicted from was not sent.
+        recorder (Recorder | None): Writes the video to disk, if it is being recorded.
+        packager (HlsPackager | None): Writes the video as HLS, if it is being packaged.
     """
-    
-    def __init__(self, video_port) -> None:
+
+    def __init__(
+        self,
+        video_port: int,
+        engine: VideoEngine | None = None,
+        max_subscribers: int = VIDEO_MAX_SUBSCRIBERS,
+        stream_id: int | None = None,
+        gop_cache_bytes: int = VIDEO_GOP_CACHE_BYTES,
+        reorder_depth: int = VIDEO_REORDER_DEPTH,
+        fec_group_size: int = 0,
+        relay_bucket: TokenBucket | None = None,
+        publisher_token: str | None = None
+    ) -> None:
         print("Initializing Video Server")
-        self.video_port = video_port 
-        self.socket: socket.socket | None = None
+        self.video_port = video_port
+        self.stream_id: int | None = stream_id
+        self.publisher_token: str | None = publisher_token
+        self._ready_to_stream: bytes = b'RTS' if publisher_token is None else b'RTS ' + publisher_token.encode('utf-8')
+        self.transport: asyncio.DatagramTransport | None = None
         self.active: bool = True
-        self.connections: list = [] # example `[(192.168.137.1, 52222), (..., ...), ...]`
-        video_stream: threading.Thread = threading.Thread(target=self.start, args=())
-        video_stream.start()
+        self.publisher: tuple[str, int] | None = None
+        self.subscribers: dict[tuple[str, int], SubscriberQueue] = {} # example `{(192.168.137.1, 52222): SubscriberQueue, ...}`
+        self.max_subscribers: int = max_subscribers
+
+        # Subscription tickets that have not been used yet, and when they expire.
+        self._tickets: dict[bytes, float] = {}
+
+        self.parser: AnnexBParser = AnnexBParser()
+        self.gop_cache: GopCache = GopCache(gop_cache_bytes)
+        self.parser.listeners.append(self.gop_cache.add)
+        self.metrics: StreamMetrics = StreamMetrics()
+        self.parser.listeners.append(self.metrics.frame)
+        self.transport_metrics: TransportMetrics = TransportMetrics()
+        self.reorder_buffer: ReorderBuffer | None = None
+        if stream_id is not None and reorder_depth > 0:
+            self.reorder_buffer = ReorderBuffer(self._forward, reorder_depth)
+        self.fec: FecDecoder | None = None
+        if self.reorder_buffer is not None and fec_group_size > 0:
+            self.fec = FecDecoder(fec_group_size, self._recovered)
+
+        self.bucket: TokenBucket = TokenBucket(VIDEO_BANDWIDTH_STREAM)
+        self.buckets: tuple[TokenBucket, ...] = tuple(
+            bucket for bucket in (self.bucket, relay_bucket, global_bucket) if bucket is not None
+        )
+        self.policed_frames: int = 0
+
+        # The last frame the buckets were checked for, if it is being dropped, and if everything up to the next
+        # keyframe is being dropped.
+        self._policed_frame: AccessUnit | None = None
+        self._policing: bool = False
+        self._policing_until_keyframe: bool = False
+        self.recorder: Recorder | None = None
+        self.packager: HlsPackager | None = None
 
-    def start(self) -> None:
+        # A timer that sends what is waiting in the subscribers' queues, while anything is.
+        self._flush_handle: asyncio.TimerHandle | None = None
+        # A timer that gives up on the missing datagrams the reorder buffer waits for, if no more arrive.
+        self._expire_handle: asyncio.TimerHandle | None = None
+
+        # Bind the video port and let the engine forward datagrams to this session.
+        self.engine: VideoEngine = engine or get_video_engine()
+        self.engine.register(self)
+
+    def issue_ticket(self) -> str:
+        """Issue a one-time ticket that lets a viewer subscribe to this stream.
+
+        Returns:
+            str: The ticket. The viewer sends `SUB <ticket>` to the video port to subscribe.
+
+        Note:
+            Only call this for authorized users. The ticket is the viewer's only credential on the video port.
         """
-        Bind a UDP socket to a specific IP address and port number for video streaming.
-        
-        This method gets the hostname of the computer running the code and uses the `socket.gethostbyname()` method
-        to get the IP address associated with the hostname. It then creates a socket object with the IPv4 protocol
-        and the UDP protocol and binds it to the obtained IP address and the port number specified by `self.video_port`.
-        
-        This method also calls the `check_conn()` method to listen for incoming connections and start the video stream.
+        ticket: str = secrets.token_urlsafe(16)
+        now: float = time.time()
+
+        # Forget tickets that were never used.
+        for key, expire in list(self._tickets.items()):
+            if expire < now:
+                self._tickets.pop(key, None)
+
+        self._tickets[ticket.encode('utf-8')] = now + VIDEO_TICKET_LIFETIME
+        return ticket
+
+    def add_frame_listener(self, listener: Callable[[AccessUnit], None]) -> None:
+        """Call `listener` with every frame of the video.
+
+        Args:
+            listener (Callable[[AccessUnit], None]): Called on the `VideoEngine` event loop, so it must never block.
+                The frame's chunks are views of a buffer of its own, not of the datagrams, so they can be kept.
         """
-        # Create address from IPv4 and port
-        print(self.video_port)
-        ADDRESS = ('', self.video_port)
-        
-        # Create socket and bind
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # IPv4 with UDP
-        self.socket.bind(ADDRESS) # Bind socket to ADDRESS
-        
-        self.check_conn()
+        self.parser.listeners.append(listener)
+
+    def remove_frame_listener(self, listener: Callable[[AccessUnit], None]) -> None:
+        """Stop calling `listener` with the frames of the video."""
+        # A new list, so this can be called from a listener while the parser goes through the old one.
+        self.parser.listeners = [other for other in self.parser.listeners if other is not listener]
 
+    def start_recording(self, directory: str) -> None:
+        """Record the video to disk, from the next keyframe on.
 
-    def handle_stream(self) -> None:
-        """Sends and receives data with the connected clients.
+        Args:
+            directory (str): Where to write the segments. See `recording_directory()` in `recorder.py`.
+        """
+        if self.recorder is not None:
+            return
+        self.recorder = Recorder(directory)
+        self.add_frame_listener(self.recorder.add)
+
+    def stop_recording(self) -> None:
+        """Stop recording the video, after writing what is waiting for the disk."""
+        recorder: Recorder | None = self.recorder
+        if recorder is None:
+            return
+        self.recorder = None
+        self.remove_frame_listener(recorder.add)
+        recorder.close()
 
-        Sends confirmation packets to each client to confirm their connection, then enters a loop
-        where it waits for data from one of the clients and sends that data to the other client.
+    def start_hls(self, directory: str, uri_prefix: str = '') -> None:
+        """Package the video as HLS, from the next keyframe on.
 
-        Raises:
-            Exception: If the socket is closed or the client is disconnected.
+        Args:
+            directory (str): Where to write the segments and playlists.
+            uri_prefix (str): Put in front of the file name of every segment in the playlists.
         """
+        if self.packager is not None:
+            return
+        self.packager = HlsPackager(directory, uri_prefix)
+        self.add_frame_listener(self.packager.add)
 
-        # Send confirmation packets to both clients
-        for address in self.connections:
-            self.socket.sendto("hello drone".encode('utf-8'), address)
+    def stop_hls(self) -> None:
+        """Stop packaging the video as HLS, and finish the VOD playlist."""
+        packager: HlsPackager | None = self.packager
+        if packager is None:
+            return
+        self.packager = None
+        self.remove_frame_listener(packager.add)
+        packager.close()
 
+    def has_ticket(self, ticket: bytes) -> bool:
+        """Returns `True` if this stream issued `ticket` and it has not been used yet."""
+        return ticket in self._tickets
 
-        # While both clients are connected and the stream is active
-        while self.active:
-            try:
-                # Receive data from one of the clients
-                data, addr = self.socket.recvfrom(2048)
+    def datagram_received(
+        self,
+        data: bytes | memoryview,
+        addr: tuple[str, int],
+        sequence: int | None = None,
+        send_time: int | None = None
+    ) -> None:
+        """Handle a datagram that arrived on the video port.
 
-            except Exception:
-                print('Could not retrieve message/Timeout: Socket Most Likely Closed.')
-                return
-            
-            try:
-                # Send the data to the other client
-                for address in self.connections:
-                    if address != addr:
-                        try:
-                            self.socket.sendto(data, address)
-                        except Exception:
-                            print("Could not send data to client.")
-            except Exception:
+        Args:
+            data (bytes | memoryview): The received datagram. A `memoryview` is only valid until this returns.
+            addr (tuple[str, int]): The IP address and port number of the sender.
+            sequence (int | None): The sequence number from the header, if it came with one.
+            send_time (int | None): The send time from the header, if it came with one.
+
+        Note:
+            This is called on the `VideoEngine` event loop, so it must never block.
+        """
+        if not self.active:
+            return
+
+        # Video from the relay. Send the same buffer to every subscriber, the payload is only copied if it has
+        # to wait to be put back in order.
+        if addr == self.publisher:
+            if data == self._ready_to_stream:
+                # The relay did not get our confirmation. Send it again.
+                self.transport.sendto(b'hello drone', addr)
                 return
-        return
 
+            metrics: StreamMetrics = self.metrics
+            metrics.packets += 1
+            metrics.bytes += len(data)
+            if sequence is not None:
+                now: float = time.time()
+                self.transport_metrics.received_datagram(sequence, send_time, now)
+                if self.fec is not None:
+                    self.fec.add(sequence, data)
+
+                reorder_buffer: ReorderBuffer | None = self.reorder_buffer
+                if reorder_buffer is not None:
+                    reorder_buffer.push(sequence, data, now)
+                    if reorder_buffer.buffered and self._expire_handle is None:
+                        self._expire_handle = self.engine.loop.call_later(reorder_buffer.deadline, self._expire)
+                    return
+
+            self._forward(data)
+            return
+
+        if data[:3] == b'RTS':
+            # Only the relay that knows the token. Anyone else could take over the stream.
+            if secrets.compare_digest(bytes(data), self._ready_to_stream):
+                self.publish(addr)
 
-    def check_conn(self) -> None:
-        print("Checking Connections for Drone")
-        """Waits for two clients to connect.
+        elif data[:4] == b'SUB ':
+            self.subscribe(addr, bytes(data[4:]))
 
-        Continuously listens for data from clients until two clients have connected, then calls
-        handle_stream to start sending and receiving data.
+        elif data == b'UNSUB':
+            self.unsubscribe(addr)
 
-        Raises:
-            Exception: If the socket is closed.
+    def parity_received(self, data: bytes | memoryview, addr: tuple[str, int], first: int, lengths: int) -> None:
+        """Handle a parity datagram from the relay.
+
+        Args:
+            data (bytes | memoryview): The payload of the parity datagram.
+            addr (tuple[str, int]): The IP address and port number of the sender.
+            first (int): The sequence number of the first datagram of its group.
+            lengths (int): The XOR of the lengths of the datagrams of its group.
         """
-        address = None
-        # Wait for two clients to connect
-        while len(self.connections) < 2 and self.active:
-            if self.active:
-                try:
-                    print("Waiting For Data")
-                    data, address = self.socket.recvfrom(2048)
-                    print(data, address)
-
-                except Exception:
-                    print('Listen or Send Cancelled: Socket Most Likely Closed.')
-
-            if address != None:
-                if address not in self.connections: #If the connection is not in the list
-                    self.connections.append(address)
-                    print(f"Connections: {self.connections}")
-
-            if self.active and len(self.connections) == 2:
-                print("Both have connected via udp")
-                self.socket.settimeout(8)
-                self.handle_stream()
-
-            else:
-                if not self.active:
-                    print("Drone Disconnected, Video Session Closed.")
-                    break
\ No newline at end of file
+        if self.active and addr == self.publisher and self.fec is not None:
+            self.fec.add_parity(first, lengths, data)
+
+    def _recovered(self, sequence: int, data: bytes) -> None:
+        """Put a datagram the FEC decoder rebuilt in its place among the others."""
+        reorder_buffer: ReorderBuffer = self.reorder_buffer
+        reorder_buffer.push(sequence, data, time.time())
+        if reorder_buffer.buffered and self._expire_handle is None:
+            self._expire_handle = self.engine.loop.call_later(reorder_buffer.deadline, self._expire)
+
+    def _forward(self, data: bytes | memoryview) -> None:
+        """Parse a video datagram from the relay, and send it to every subscriber the buckets let it."""
+        # Find the frame first, so the queues know which datagrams they may drop.
+        self.parser.feed(data)
+        frame: AccessUnit = self.parser.partial
+
+        subscribers: dict[tuple[str, int], SubscriberQueue] = self.subscribers
+        if not subscribers:
+            return
+
+        # The buckets are checked once per frame, so frames are sent whole or not at all.
+        if frame is not self._policed_frame:
+            self._policed_frame = frame
+            self._policing = self._police(frame)
+        if self._policing:
+            return
+
+        cost: int = len(data) * len(subscribers)
+        for bucket in self.buckets:
+            bucket.tokens -= cost
+
+        backlog: bool = False
+        for queue in subscribers.values():
+            queue.push(data, frame)
+            backlog = backlog or len(queue) > 0
+
+        if backlog:
+            self._schedule_flush()
+
+    def _police(self, frame: AccessUnit | None) -> bool:
+        """Returns `True` if a frame that just started must not be sent, because a bucket is empty."""
+        now: float = time.monotonic()
+        empty: bool = False
+        for bucket in self.buckets:
+            if bucket.refill(now):
+                bucket.dropped_frames += 1
+                empty = True
+
+        if self._policing_until_keyframe:
+            if empty or not starts_decoding(frame):
+                self.policed_frames += 1
+                return True
+            self._policing_until_keyframe = False
+
+        if not empty:
+            return False
+
+        # Other frames are predicted from it, so they cannot be decoded without it either.
+        self.policed_frames += 1
+        if frame is not None and frame.reference:
+            self._policing_until_keyframe = True
+        return True
+
+    def _expire(self) -> None:
+        """Give up on the missing datagrams the reorder buffer waited too long for. Runs again while any wait."""
+        self._expire_handle = None
+        reorder_buffer: ReorderBuffer | None = self.reorder_buffer
+        if not self.active or reorder_buffer is None:
+            return
+
+        reorder_buffer.expire(time.time())
+        if reorder_buffer.buffered:
+            self._expire_handle = self.engine.loop.call_later(reorder_buffer.deadline, self._expire)
+
+    def publish(self, addr: tuple[str, int]) -> None:
+        """Make a relay the publisher of this stream.
+
+        Args:
+            addr (tuple[str, int]): The IP address and port number of the relay.
+        """
+        if self.publisher is not None:
+            print(f"Publisher {self.publisher} replaced by {addr}, the relay most likely reconnected.")
+
+        self.publisher = addr
+        print(f"Publisher: {self.publisher}")
+        self.transport.sendto(b'hello drone', addr)
+
+    def subscribe(self, addr: tuple[str, int], ticket: bytes) -> None:
+        """Subscribe a viewer to this stream.
+
+        Args:
+            addr (tuple[str, int]): The IP address and port number of the viewer.
+            ticket (bytes): A ticket from `issue_ticket()`. It can only be used once.
+        """
+        # A viewer resending `SUB` because it did not get our confirmation.
+        if addr in self.subscribers:
+            self.transport.sendto(b'hello drone', addr)
+            return
+
+        expire: float | None = self._tickets.pop(ticket, None)
+        if expire is None or expire < time.time():
+            print(f"Rejected viewer {addr}: invalid or expired ticket.")
+            return
+
+        if len(self.subscribers) >= self.max_subscribers:
+            print(f"Rejected viewer {addr}: the stream already has {self.max_subscribers} viewers.")
+            self.transport.sendto(b'FULL', addr)
+            return
+
+        self.add_subscriber(addr)
+        print(f"Subscribers: {list(self.subscribers)}")
+        self.transport.sendto(b'hello drone', addr)
+        self.send_gop(addr)
+
+    def add_subscriber(self, addr: tuple[str, int]) -> None:
+        """Start sending the video to a viewer, without checking a ticket.
+
+        Args:
+            addr (tuple[str, int]): The IP address and port number of the viewer.
+        """
+        self.subscribers[addr] = SubscriberQueue(datagram_sender(self.transport, addr))
+
+    def send_gop(self, addr: tuple[str, int]) -> None:
+        """Send a new subscriber the video since the last keyframe, so it can start decoding right away.
+
+        Args:
+            addr (tuple[str, int]): The IP address and port number of the subscriber.
+        """
+        queue: SubscriberQueue | None = self.subscribers.get(addr)
+        if queue is None:
+            return
+
+        # A whole GOP is more than the socket takes at once. The rest waits in the queue.
+        for chunk in self.gop_cache.replay(self.parser.partial):
+            queue.push(chunk)
+
+        if len(queue) > 0:
+            self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        if self._flush_handle is None:
+            self._flush_handle = self.engine.loop.call_later(_FLUSH_INTERVAL, self._flush)
+
+    def _flush(self) -> None:
+        """Send what is waiting in the subscribers' queues. Runs again later while anything is left."""
+        self._flush_handle = None
+        if not self.active:
+            return
+
+        backlog: bool = False
+        for queue in list(self.subscribers.values()):
+            if len(queue) > 0 and not queue.flush():
+                backlog = True
+
+        # The batched transport only sends on `flush()`.
+        if hasattr(self.transport, 'flush'):
+            self.transport.flush()
+
+        if backlog:
+            self._schedule_flush()
+
+    def stats(self) -> dict[str, dict]:
+        """Returns the metrics of the stream and its transport, and the counters of its reorder buffer, FEC
+        decoder, token bucket, parser, GOP cache, subscriber queues, recorder and HLS packager.
+
+        Example:
+            >>> { "metrics": { "packets_per_second": 270.2, ... }, "transport": { "loss_rate": 0.0037, ... },
+            ...   "reorder_buffer": { "reordered": 210, "late": 3, ... }, "fec": { "recovered": 41, ... },
+            ...   "bandwidth": { "policed_frames": 0, "bucket": { "rate": 0, ... } },
+            ...   "parser": { "nal_units": 2718, ... }, "gop_cache": { "bytes": 181440, ... },
+            ...   "subscribers": { "192.168.137.1:52222": { "queue_depth": 0, "dropped_frames": 3, ... } },
+            ...   "recording": { "segments": 3, "dropped_bytes": 0, ... }, "hls": None }
+        """
+        recorder: Recorder | None = self.recorder
+        packager: HlsPackager | None = self.packager
+        return {
+            "metrics": self.metrics.stats(),
+            "transport": self.transport_metrics.stats() if self.transport_metrics.received else None,
+            "reorder_buffer": self.reorder_buffer.stats() if self.reorder_buffer is not None else None,
+            "fec": self.fec.stats() if self.fec is not None else None,
+            "bandwidth": { "policed_frames": self.policed_frames, "bucket": self.bucket.stats() },
+            "parser": self.parser.stats(),
+            "gop_cache": self.gop_cache.stats(),
+            "subscribers": {
+                f"{address[0]}:{address[1]}": queue.stats() for address, queue in list(self.subscribers.items())
+            },
+            "recording": recorder.stats() if recorder is not None else None,
+            "hls": packager.stats() if packager is not None else None,
+        }
+
+    def unsubscribe(self, addr: tuple[str, int]) -> None:
+        """Unsubscribe a viewer from this stream.
+
+        Args:
+            addr (tuple[str, int]): The IP address and port number of the viewer.
+        """
+        if self.subscribers.pop(addr, None) is not None:
+            print(f"Subscribers: {list(self.subscribers)}")
+
+    def detach(self) -> None:
+        """Forget the subscribers and stop the timers.
+
+        Note:
+            Called by the engine when the session is unregistered, on the thread that forwards its video, so the
+            subscribers never change while they are being sent to.
+        """
+        self.subscribers.clear()
+
+        for handle in (self._flush_handle, self._expire_handle):
+            if handle is not None:
+                handle.cancel()
+        self._flush_handle = None
+        self._expire_handle = None
+
+    def close(self) -> None:
+        """Stop the video stream and close its socket. Can be called from any thread."""
+        self.active = False
+
+        # The subscribers are forgotten by the engine, on its own thread. See `detach()`.
+        self.engine.unregister(self)
+
+        # These block until the files are written, so they are left to the calling thread.
+        self.stop_recording()
+        self.stop_hls()
+        print("Drone Disconnected, Video Session Closed.")
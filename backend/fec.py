@@ -0,0 +1,195 @@
+'''Forward error correction for the video datagrams from a relay, with XOR parity.
+
+Video is live, so a lost datagram is never sent again. Instead, in multiplexed mode a relay can send one parity
+datagram after every group of `N` video datagrams. Its payload is the XOR of the payloads of the group, and the
+backend can rebuild any one datagram of the group that was lost from it and the others.
+
+A group is the `N` datagrams from a sequence number divisible by `N`. The parity datagram has the same header
+as the video (see `video_header.py`), with:
+    - `FLAG_PARITY` set.
+    - The sequence number of the first datagram of the group.
+    - The XOR of the lengths of the payloads of the group in the send time field, so the length of the lost one
+      can be rebuilt too.
+
+Payloads of different lengths are XORed as if the shorter ones ended in zeros. The XOR is done on whole
+payloads at once, as Python integers (`int.from_bytes`), not a byte at a time. Little endian, so the first
+bytes of every payload line up.
+
+Classes:
+    ParityEncoder: Makes the parity datagrams of a stream. Used by the relay.
+    FecDecoder: Rebuilds lost datagrams of a stream. Used by the backend.
+
+Note:
+    `relay/fec.py` is the relay's copy of this file. Keep them the same.
+'''
+
+# Default Python
+from typing import Callable
+
+from video_header import FLAG_PARITY, VIDEO_HEADER, pack_header
+
+# The largest group. A group is kept as a bit mask, and larger groups protect too little to be worth it.
+MAX_GROUP_SIZE: int = 64
+
+# The groups a decoder keeps at once. Parity arrives right after its group, so only the last few matter.
+_GROUPS: int = 4
+
+
+class ParityEncoder:
+    """Makes the parity datagrams of a stream.
+
+    Attributes:
+        group_size (int): The video datagrams per parity datagram.
+    """
+
+    def __init__(self, group_size: int) -> None:
+        if not 0 < group_size <= MAX_GROUP_SIZE:
+            raise ValueError(f"The group size must be from 1 to {MAX_GROUP_SIZE}, not {group_size}")
+
+        self.group_size: int = group_size
+        self._parity: int = 0
+        self._lengths: int = 0
+        self._longest: int = 0
+
+    def add(self, stream_id: int, sequence: int, payload: bytes | memoryview) -> bytes | None:
+        """Add a video datagram to the parity of its group.
+
+        Args:
+            stream_id (int): The stream id of the drone.
+            sequence (int): The sequence number of the datagram.
+            payload (bytes | memoryview): The payload of the datagram, without the header.
+
+        Returns:
+            bytes | None: The parity datagram to send after this one, if it was the last of its group.
+        """
+        self._parity ^= int.from_bytes(payload, 'little')
+        self._lengths ^= len(payload)
+        if len(payload) > self._longest:
+            self._longest = len(payload)
+
+        if sequence % self.group_size != self.group_size - 1:
+            return None
+
+        datagram = bytearray(VIDEO_HEADER.size + self._longest)
+        pack_header(datagram, stream_id, sequence - self.group_size + 1, FLAG_PARITY, self._lengths)
+        datagram[VIDEO_HEADER.size:] = self._parity.to_bytes(self._longest, 'little')
+
+        self._parity = self._lengths = self._longest = 0
+        return bytes(datagram)
+
+
+class _Group:
+    """The XOR of the datagrams of one group that have arrived, and which have."""
+    __slots__ = ('first', 'parity', 'lengths', 'received')
+
+    def __init__(self) -> None:
+        self.first: int = -1
+        self.parity: int = 0
+        self.lengths: int = 0
+        self.received: int = 0
+
+
+class FecDecoder:
+    """Rebuilds lost datagrams of a stream from the parity datagrams.
+
+    Every video datagram is XORed into its group as it arrives, so nothing is copied or kept. When the parity
+    datagram of a group arrives with one datagram missing, the missing one is the XOR of the parity and the
+    group, and `recover` is called with it.
+
+    Attributes:
+        group_size (int): The video datagrams per parity datagram.
+        recover (Callable[[int, bytes], None]): Called with the sequence number and payload of every datagram
+            that was rebuilt.
+        parity (int): Parity datagrams received.
+        recovered (int): Datagrams rebuilt.
+        unrecoverable (int): Groups that lost more than one datagram, or whose parity arrived too late.
+    """
+
+    def __init__(self, group_size: int, recover: Callable[[int, bytes], None]) -> None:
+        if not 0 < group_size <= MAX_GROUP_SIZE:
+            raise ValueError(f"The group size must be from 1 to {MAX_GROUP_SIZE}, not {group_size}")
+
+        self.group_size: int = group_size
+        self.recover: Callable[[int, bytes], None] = recover
+        self.parity: int = 0
+        self.recovered: int = 0
+        self.unrecoverable: int = 0
+
+        # A ring of the last few groups.
+        self._groups: list[_Group] = [_Group() for _ in range(_GROUPS)]
+        self._complete: int = (1 << group_size) - 1
+
+    def _group(self, first: int) -> _Group:
+        """The slot of the group that starts at a sequence number."""
+        return self._groups[first // self.group_size % _GROUPS]
+
+    def add(self, sequence: int, payload: bytes | memoryview) -> None:
+        """Add a video datagram to its group.
+
+        Args:
+            sequence (int): The sequence number of the datagram.
+            payload (bytes | memoryview): The payload of the datagram, without the header.
+        """
+        index: int = sequence % self.group_size
+        group: _Group = self._group(sequence - index)
+        if group.first != sequence - index:
+            # The first datagram of this group to arrive. The slot had an older group.
+            group.first = sequence - index
+            group.parity = group.lengths = group.received = 0
+
+        bit: int = 1 << index
+        if group.received & bit:
+            return
+
+        group.received |= bit
+        group.parity ^= int.from_bytes(payload, 'little')
+        group.lengths ^= len(payload)
+
+    def add_parity(self, first: int, lengths: int, payload: bytes | memoryview) -> None:
+        """Rebuild the missing datagram of a group from its parity datagram, if only one is missing.
+
+        Args:
+            first (int): The sequence number of the first datagram of the group, from the parity's header.
+            lengths (int): The XOR of the lengths of the group, from the parity's header.
+            payload (bytes | memoryview): The payload of the parity datagram.
+        """
+        self.parity += 1
+        if first % self.group_size:
+            return
+
+        # If the slot has another group, nothing of this one arrived. Leave the slot to the other one.
+        group: _Group = self._group(first)
+        if group.first != first:
+            group = _Group()
+
+        missing: int = self._complete & ~group.received
+        if not missing:
+            return
+
+        # More than one is missing.
+        if missing & (missing - 1):
+            self.unrecoverable += 1
+            return
+
+        length: int = lengths ^ group.lengths
+        data: int = int.from_bytes(payload, 'little') ^ group.parity
+        if length > len(payload) or data.bit_length() > 8 * length:
+            self.unrecoverable += 1
+            return
+
+        group.received = self._complete
+        self.recovered += 1
+        self.recover((first + missing.bit_length() - 1) & 0xFFFFFFFF, data.to_bytes(length, 'little'))
+
+    def stats(self) -> dict[str, int]:
+        """Returns the counters of the decoder.
+
+        Example:
+            >>> { "group_size": 10, "parity": 8123, "recovered": 41, "unrecoverable": 2 }
+        """
+        return {
+            "group_size": self.group_size,
+            "parity": self.parity,
+            "recovered": self.recovered,
+            "unrecoverable": self.unrecoverable,
+        }
@@ -0,0 +1,158 @@
+'''A cache of the current group of pictures (GOP) of a drone video stream.
+
+A viewer can only start decoding at a keyframe (an IDR frame, after the SPS and PPS). A Tello sends one
+every few seconds, so a viewer who joins in between would see grey or garbage until the next one.
+`GopCache` keeps the last SPS and PPS and every frame since the last keyframe. A new subscriber is sent
+those first, and then the live video, so it can start decoding right away.
+
+The cache holds at most `max_bytes`. If a GOP grows larger than that, it is dropped and the cache stays
+empty until the next keyframe, because frames without the keyframe before them cannot be decoded.
+
+Classes:
+    GopCache: Keeps the frames since the last keyframe, and replays them to new subscribers.
+
+Example:
+    >>> cache = GopCache(max_bytes=1024 * 1024)
+    >>> parser.listeners.append(cache.add)
+    >>> for chunk in cache.replay(parser.partial):
+    ...     transport.sendto(chunk, viewer)
+'''
+
+from h264 import AccessUnit, NAL_PPS, NAL_SPS, split_nal_units
+
+from config import VIDEO_GOP_CACHE_BYTES
+
+
+class GopCache:
+    """Keeps the last SPS and PPS and every frame since the last keyframe, up to `max_bytes`.
+
+    Attributes:
+        max_bytes (int): The most bytes of frames kept. 0 turns the cache off.
+        frames (list[AccessUnit]): The frames since the last keyframe, starting with it.
+        size (int): The bytes of `frames`.
+        sps (bytes | None): The last sequence parameter set.
+        pps (bytes | None): The last picture parameter set.
+        overflows (int): GOPs that were dropped because they grew larger than `max_bytes`.
+        keyframe (AccessUnit | None): The last keyframe. Kept even if its GOP is not, or the cache is off.
+    """
+
+    def __init__(self, max_bytes: int = VIDEO_GOP_CACHE_BYTES) -> None:
+        self.max_bytes: int = max_bytes
+        self.frames: list[AccessUnit] = []
+        self.size: int = 0
+        self.sps: bytes | None = None
+        self.pps: bytes | None = None
+        self.overflows: int = 0
+        self.keyframe: AccessUnit | None = None
+
+    def add(self, frame: AccessUnit) -> None:
+        """Add a frame. Use this as a listener of the stream's `AnnexBParser`.
+
+        Args:
+            frame (AccessUnit): The next frame of the stream.
+        """
+        # Parameter sets are rare, usually once per keyframe, so copying them out is cheap.
+        if NAL_SPS in frame.nal_types or NAL_PPS in frame.nal_types:
+            for unit in split_nal_units(frame.data()):
+                if unit[4] & 0x1F == NAL_SPS:
+                    self.sps = unit
+                elif unit[4] & 0x1F == NAL_PPS:
+                    self.pps = unit
+
+        if frame.keyframe:
+            self.keyframe = frame
+
+        if self.max_bytes <= 0:
+            return
+
+        # A keyframe starts a new GOP. The old one is no longer needed.
+        if frame.keyframe:
+            self.frames = []
+            self.size = 0
+
+        # Without the keyframe before it, a frame cannot be decoded. Wait for the next keyframe.
+        elif not self.frames:
+            return
+
+        if self.size + frame.size > self.max_bytes:
+            print(f"GOP larger than {self.max_bytes} bytes. Not cached until the next keyframe.")
+            self.overflows += 1
+            self.frames = []
+            self.size = 0
+            return
+
+        self.frames.append(frame)
+        self.size += frame.size
+
+    def replay(self, partial: AccessUnit | None = None) -> list[bytes | memoryview]:
+        """Returns what a new subscriber must be sent before the live video, to start at the last keyframe.
+
+        Args:
+            partial (AccessUnit | None): The frame the parser is putting together (`AnnexBParser.partial`).
+                Its datagrams have been forwarded already, so the subscriber gets them from here.
+
+        Returns:
+            list[bytes | memoryview]: The SPS and PPS (unless the keyframe has them), every cached frame and
+                what has arrived of `partial`, in order. Empty if there is no keyframe to start at.
+        """
+        # The keyframe may be arriving right now.
+        if not self.frames:
+            if partial is not None and partial.keyframe and self.max_bytes > 0:
+                return list(partial.chunks)
+            return []
+
+        chunks: list[bytes | memoryview] = []
+        if NAL_SPS not in self.frames[0].nal_types and self.sps is not None and self.pps is not None:
+            chunks += [self.sps, self.pps]
+
+        for frame in self.frames:
+            chunks += frame.chunks
+
+        if partial is not None:
+            chunks += partial.chunks
+
+        return chunks
+
+    def replay_frames(self) -> list[bytes]:
+        """Returns the cached frames, for viewers that get whole frames instead of datagrams.
+
+        Returns:
+            list[bytes]: Every cached frame in Annex B format, the SPS and PPS in front of the keyframe
+                (unless it has them). Empty if there is no keyframe to start at.
+        """
+        if not self.frames:
+            return []
+
+        frames: list[bytes] = [frame.data() for frame in self.frames]
+        if NAL_SPS not in self.frames[0].nal_types and self.sps is not None and self.pps is not None:
+            frames[0] = self.sps + self.pps + frames[0]
+
+        return frames
+
+    def keyframe_bundle(self) -> bytes | None:
+        """Returns the last keyframe, with the SPS and PPS in front of it (unless it has them).
+
+        Returns:
+            bytes | None: Annex B data a decoder can decode one picture from, or `None` if no keyframe has arrived.
+        """
+        keyframe: AccessUnit | None = self.keyframe
+        if keyframe is None:
+            return None
+
+        data: bytes = keyframe.data()
+        if NAL_SPS not in keyframe.nal_types and self.sps is not None and self.pps is not None:
+            data = self.sps + self.pps + data
+        return data
+
+    def stats(self) -> dict[str, int]:
+        """Returns the memory used by the cache.
+
+        Example:
+            >>> { "bytes": 181440, "max_bytes": 1048576, "frames": 23, "overflows": 0 }
+        """
+        return {
+            "bytes": self.size + len(self.sps or b'') + len(self.pps or b''),
+            "max_bytes": self.max_bytes,
+            "frames": len(self.frames),
+            "overflows": self.overflows,
+        }
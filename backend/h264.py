@@ -0,0 +1,256 @@
+'''An incremental H.264 Annex B parser for drone video.
+
+A Tello sends its video as an H.264 Annex B byte stream cut into ~1460 byte datagrams, with no regard for
+where frames begin. `AnnexBParser` is fed the datagrams one at a time and finds the start codes
+(`00 00 01`) in them, also when a start code is split over two datagrams. It reads the type of every NAL
+unit and groups the datagrams into access units (one frame each), which it hands to its listeners.
+
+Scanning is done with `bytearray.find()`, so the bytes between start codes are never looked at from Python.
+The datagrams may be `memoryview`s of pooled buffers (see `buffer_pool.py`) that are reused as soon as `feed()`
+returns. So every datagram is appended once, straight from its view, to the buffer of the frame it belongs to,
+without a `bytes` object per datagram. The frame keeps that buffer, so it can outlive the datagrams (in the GOP
+cache or the recorder) without being copied again. Only the bytes of the next frame that arrived in the same
+datagram are moved to the buffer of the next frame when a frame ends.
+
+An access unit is only complete once the first NAL unit of the next one arrives, so listeners get a frame
+about one frame interval after its first datagram.
+
+Classes:
+    AccessUnit: One frame, in a buffer of its own.
+    AnnexBParser: Finds NAL units in a stream of datagrams and groups them into access units.
+
+Functions:
+    split_nal_units: Splits Annex B data into its NAL units.
+
+Example:
+    >>> parser = AnnexBParser()
+    >>> parser.listeners.append(lambda frame: print(frame.keyframe, frame.size))
+    >>> for datagram in datagrams:
+    ...     parser.feed(datagram)
+
+Reference:
+    [0] [ITU-T H.264] (https://www.itu.int/rec/T-REC-H.264), Annex B and section 7.4.1.2.3.
+'''
+
+# Default Python
+import time
+from typing import Callable
+
+START_CODE: bytes = b'\x00\x00\x01'
+
+# NAL unit types (`nal_unit_type`).
+NAL_SLICE: int = 1
+NAL_IDR: int = 5
+NAL_SEI: int = 6
+NAL_SPS: int = 7
+NAL_PPS: int = 8
+NAL_AUD: int = 9
+
+# A start code, the NAL header and the first byte of the slice header. Needed to tell where a frame begins.
+_LOOKAHEAD: int = 5
+
+
+def split_nal_units(data: bytes) -> list[bytes]:
+    """Split Annex B data into its NAL units.
+
+    Args:
+        data (bytes): One or more NAL units in Annex B format.
+
+    Returns:
+        list[bytes]: Every NAL unit, with a 4 byte start code in front of it.
+    """
+    units: list[bytes] = []
+    position: int = data.find(START_CODE)
+    while position != -1:
+        following: int = data.find(START_CODE, position + 3)
+        end: int = len(data) if following == -1 else following
+
+        # Leave out the zero byte of the next 4 byte start code.
+        if following != -1 and data[end - 1] == 0:
+            end -= 1
+
+        units.append(b'\x00' + data[position:end])
+        position = following
+    return units
+
+
+class AccessUnit:
+    """One frame of video, made of the NAL units between two frame boundaries.
+
+    Attributes:
+        chunks (list[memoryview]): The frame in Annex B format, start codes included. One read-only view of the
+            frame's own buffer once the frame is complete. Of a frame the parser is still putting together, a
+            copy of what has arrived so far.
+        nal_types (list[int]): The type of every NAL unit in the frame, in order.
+        keyframe (bool): If the frame has an IDR slice, so decoding can start here (after SPS and PPS).
+        reference (bool): If other frames may be predicted from this frame. Frames that are not can be
+            dropped without breaking the frames after them.
+        size (int): The size of the frame in bytes.
+        arrival (float): When the first datagram of the frame arrived (seconds since 1970).
+    """
+    __slots__ = ('nal_types', 'keyframe', 'reference', 'size', 'arrival', '_slices', '_buffer', '_chunks')
+
+    def __init__(self, arrival: float) -> None:
+        self.nal_types: list[int] = []
+        self.keyframe: bool = False
+        self.reference: bool = False
+        self.size: int = 0
+        self.arrival: float = arrival
+        self._slices: int = 0
+
+        # The bytes of the frame. Grows while the parser puts the frame together, and is left alone after.
+        self._buffer: bytearray = bytearray()
+        self._chunks: list[memoryview] | None = None
+
+    @property
+    def chunks(self) -> list[memoryview]:
+        if self._chunks is not None:
+            return self._chunks
+
+        # Still growing, and a view would keep it from growing.
+        return [memoryview(bytes(self._buffer))] if self._buffer else []
+
+    def data(self) -> bytes:
+        """Returns the frame as one `bytes` object. This copies the payload."""
+        return bytes(self._buffer)
+
+
+class AnnexBParser:
+    """Finds NAL units in H.264 Annex B datagrams and groups them into access units.
+
+    Attributes:
+        listeners (list[Callable[[AccessUnit], None]]): Called with every complete access unit.
+        nal_units (int): NAL units seen.
+        access_units (int): Access units handed to the listeners.
+        keyframes (int): Access units with an IDR slice.
+    """
+
+    def __init__(self) -> None:
+        self.listeners: list[Callable[[AccessUnit], None]] = []
+        self.nal_units: int = 0
+        self.access_units: int = 0
+        self.keyframes: int = 0
+
+        # The access unit being put together.
+        self._current: AccessUnit = AccessUnit(time.time())
+
+        # The access unit a NAL unit began, until the current one has been handed to the listeners.
+        self._pending: AccessUnit | None = None
+
+        # Where the next scan for start codes begins in the buffer of the current access unit. Start codes in
+        # its last bytes are scanned again with the next datagram, since the NAL header after them is not here yet.
+        self._scanned: int = 0
+
+    def feed(self, data: bytes | memoryview, arrival: float | None = None) -> None:
+        """Parse the next datagram of the stream.
+
+        Args:
+            data (bytes | memoryview): The datagram. It is not kept, so it can be a view of a pooled buffer.
+            arrival (float | None): When the datagram arrived. Defaults to now.
+        """
+        now: float = arrival if arrival is not None else time.time()
+        buffer: bytearray = self._current._buffer
+
+        # Nothing has arrived of the current access unit yet, so it arrives now.
+        if not buffer:
+            self._current.arrival = now
+
+        # The only copy of the payload.
+        buffer += data
+
+        # Start codes, as long as the bytes after them are here too.
+        last: int = len(buffer) - _LOOKAHEAD
+        position: int = buffer.find(START_CODE, self._scanned)
+        while 0 <= position <= last:
+            if self._nal_unit(buffer[position + 3], buffer[position + 4], now):
+                # The zero byte of a 4 byte start code belongs to the new NAL unit too.
+                split: int = position
+                if position > 0 and buffer[position - 1] == 0:
+                    split -= 1
+
+                buffer = self._split(split)
+                position -= split
+                last -= split
+            position = buffer.find(START_CODE, position + 3)
+
+        self._scanned = max(0, last + 1)
+
+    @property
+    def partial(self) -> AccessUnit:
+        """The access unit being put together, with everything that has arrived of it so far."""
+        return self._current
+
+    def _nal_unit(self, header: int, first: int, now: float) -> bool:
+        """Account for a NAL unit. Returns `True` if it begins a new access unit.
+
+        Args:
+            header (int): The NAL header byte.
+            first (int): The byte after it. For a slice, its first bit is set if it is the first slice of a frame.
+            now (float): When the datagram arrived.
+        """
+        nal_type: int = header & 0x1F
+        current: AccessUnit = self._current
+        self.nal_units += 1
+
+        # A new frame begins with its first slice, or with the SEI, SPS, PPS or delimiter in front of it.
+        new: bool = False
+        if nal_type == NAL_SLICE or nal_type == NAL_IDR:
+            new = current._slices > 0 and first & 0x80 != 0
+        elif NAL_SEI <= nal_type <= NAL_AUD:
+            new = current._slices > 0
+
+        if new:
+            current = AccessUnit(now)
+            self._pending = current
+
+        current.nal_types.append(nal_type)
+        if nal_type == NAL_SLICE or nal_type == NAL_IDR:
+            current._slices += 1
+            current.keyframe |= nal_type == NAL_IDR
+            current.reference |= header & 0x60 != 0
+
+        return new
+
+    def _split(self, split: int) -> bytearray:
+        """End the current access unit at `split` in its buffer. Returns the buffer of the next one."""
+        buffer: bytearray = self._current._buffer
+        following: bytearray = self._pending._buffer
+
+        # What arrived of the next access unit, at most about one datagram.
+        with memoryview(buffer) as view:
+            following += view[split:]
+        del buffer[split:]
+
+        self._emit()
+        return following
+
+    def _emit(self) -> None:
+        """Hand the current access unit to the listeners, and start the next one."""
+        frame: AccessUnit = self._current
+        self._current = self._pending
+        self._pending = None
+
+        # The stream was joined in the middle of a NAL unit. There is nothing to decode.
+        if not frame.nal_types:
+            return
+
+        frame.size = len(frame._buffer)
+        frame._chunks = [memoryview(frame._buffer).toreadonly()]
+        self.access_units += 1
+        if frame.keyframe:
+            self.keyframes += 1
+
+        for listener in self.listeners:
+            listener(frame)
+
+    def stats(self) -> dict[str, int]:
+        """Returns the counters of the parser.
+
+        Example:
+            >>> { "nal_units": 2718, "access_units": 900, "keyframes": 30 }
+        """
+        return {
+            "nal_units": self.nal_units,
+            "access_units": self.access_units,
+            "keyframes": self.keyframes,
+        }
@@ -0,0 +1,301 @@
+'''Package drone video as HLS (MPEG-TS segments and playlists), so it plays in a normal browser player.
+
+`TsMuxer` wraps H.264 access units into an MPEG transport stream, with one program and one video stream,
+in pure Python. The presentation time (PTS) of a frame is when its first datagram arrived, on the 90 kHz
+clock of MPEG-TS, counted from the first frame.
+
+`HlsPackager` is a frame listener of a `DroneVideoStream` (see `DroneVideoStream.start_hls()`). It starts a
+new segment at the first keyframe after `VIDEO_HLS_SEGMENT_SECONDS`, as the stream runs, and keeps two
+playlists next to the segments:
+    - `live.m3u8`: The last `VIDEO_HLS_LIVE_SEGMENTS` segments, for watching live.
+    - `vod.m3u8`: Every segment. It is only appended to while the stream runs (an `EVENT` playlist), and
+      becomes a `VOD` playlist of the whole recording when the packager is closed.
+
+Like the `Recorder` (see `recorder.py`) it never blocks forwarding. The frames are muxed and written on the
+writer thread of the packager, and dropped up to the next keyframe if it falls behind.
+
+Classes:
+    TsMuxer: Wraps H.264 access units into MPEG-TS packets.
+    HlsPackager: Writes a stream as HLS segments, with a live and a VOD playlist.
+
+Reference:
+    [0] [ISO/IEC 13818-1] MPEG-2 systems (transport stream, PES and PSI).
+    [1] [RFC 8216] (https://datatracker.ietf.org/doc/html/rfc8216), HTTP Live Streaming.
+'''
+
+# Default Python
+import math, os
+
+from h264 import AccessUnit
+
+# Reuses the queue, writer thread and dropping of the recorder.
+from recorder import Recorder
+
+from config import VIDEO_HLS_LIVE_SEGMENTS, VIDEO_HLS_SEGMENT_SECONDS, VIDEO_RECORDING_QUEUE_BYTES
+
+PACKET_SIZE: int = 188
+PAT_PID: int = 0x0000
+PMT_PID: int = 0x1000
+VIDEO_PID: int = 0x0100
+
+# The 90 kHz clock of PTS and PCR, and where it wraps around (33 bits).
+CLOCK: int = 90000
+_PTS_WRAP: int = 1 << 33
+
+# The first frame has PTS 1 second, and the PCR is 0.1 seconds ahead of the PTS, so neither is negative.
+_PTS_START: int = CLOCK
+_PCR_DELAY: int = CLOCK // 10
+
+
+def _crc32(data: bytes) -> int:
+    """The CRC-32 of MPEG-2 (polynomial 0x04C11DB7, no reflection), which ends every PSI section."""
+    crc: int = 0xFFFFFFFF
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = (crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1
+            crc &= 0xFFFFFFFF
+    return crc
+
+
+def _section(pid: int, section: bytes) -> bytes:
+    """One TS packet with a PSI section, its CRC and stuffing."""
+    section += _crc32(section).to_bytes(4, 'big')
+    packet: bytes = bytes((0x47, 0x40 | pid >> 8, pid & 0xFF, 0x10, 0x00)) + section
+    return packet + b'\xFF' * (PACKET_SIZE - len(packet))
+
+
+# The program association table (one program, its PMT on `PMT_PID`) and the program map table (one H.264
+# stream on `VIDEO_PID`, which also carries the PCR). They never change, so they are built once.
+_PAT: bytes = _section(PAT_PID, bytes((
+    0x00, 0xB0, 0x0D, 0x00, 0x01, 0xC1, 0x00, 0x00,
+    0x00, 0x01, 0xE0 | PMT_PID >> 8, PMT_PID & 0xFF
+)))
+_PMT: bytes = _section(PMT_PID, bytes((
+    0x02, 0xB0, 0x12, 0x00, 0x01, 0xC1, 0x00, 0x00,
+    0xE0 | VIDEO_PID >> 8, VIDEO_PID & 0xFF, 0xF0, 0x00,
+    0x1B, 0xE0 | VIDEO_PID >> 8, VIDEO_PID & 0xFF, 0xF0, 0x00
+)))
+
+# The header of every packet that continues a PES packet, by continuity counter.
+_CONTINUATION: list[bytes] = [bytes((0x47, VIDEO_PID >> 8, VIDEO_PID & 0xFF, 0x10 | counter)) for counter in range(16)]
+
+
+class TsMuxer:
+    """Wraps H.264 access units into MPEG-TS packets, with PTS from the time they arrived.
+
+    Attributes:
+        pts (int | None): The PTS of the last frame, on the 90 kHz clock.
+    """
+
+    def __init__(self) -> None:
+        self.pts: int | None = None
+
+        # The arrival time of the first frame, PTS `_PTS_START`.
+        self._base: float | None = None
+
+        # The continuity counter of the video PID, and of the PAT and PMT.
+        self._counter: int = 0
+        self._table_counter: int = 0
+
+    def pts_of(self, arrival: float) -> int:
+        """Returns the PTS of a frame that arrived at `arrival`. Always later than the one before it."""
+        if self._base is None:
+            self._base = arrival
+
+        pts: int = _PTS_START + round((arrival - self._base) * CLOCK)
+        if self.pts is not None and pts <= self.pts:
+            pts = self.pts + 1
+        return pts
+
+    def tables(self) -> bytes:
+        """Returns the PAT and the PMT. Every segment starts with them, so it can be played on its own."""
+        counter: int = self._table_counter
+        self._table_counter = (counter + 1) & 0x0F
+        return (
+            _PAT[:3] + bytes((0x10 | counter,)) + _PAT[4:] +
+            _PMT[:3] + bytes((0x10 | counter,)) + _PMT[4:]
+        )
+
+    def mux(self, frame: AccessUnit, pts: int | None = None) -> bytes:
+        """Returns the TS packets of one frame, as one PES packet.
+
+        Args:
+            frame (AccessUnit): The frame. Its chunks are Annex B, which is what H.264 in MPEG-TS is.
+            pts (int | None): The PTS of the frame, from `pts_of()`. Defaults to the PTS of its arrival.
+        """
+        self.pts = pts = pts if pts is not None else self.pts_of(frame.arrival)
+        wrapped: int = pts % _PTS_WRAP
+
+        # The PES header: video stream 0, no length (allowed for video), and the PTS.
+        payload: bytes = b''.join((
+            b'\x00\x00\x01\xE0\x00\x00\x80\x80\x05',
+            bytes((
+                0x21 | (wrapped >> 29) & 0x0E, (wrapped >> 22) & 0xFF, (wrapped >> 14) & 0xFE | 1,
+                (wrapped >> 7) & 0xFF, (wrapped << 1) & 0xFE | 1
+            )),
+            *frame.chunks
+        ))
+
+        # The first packet has an adaptation field with the PCR, and says if decoding can start here.
+        pcr: int = (pts - _PCR_DELAY) % _PTS_WRAP
+        adaptation: bytes = bytes((
+            0x07, 0x50 if frame.keyframe else 0x10,
+            (pcr >> 25) & 0xFF, (pcr >> 17) & 0xFF, (pcr >> 9) & 0xFF, (pcr >> 1) & 0xFF, (pcr & 1) << 7 | 0x7E, 0x00
+        ))
+        room: int = PACKET_SIZE - 4 - len(adaptation)
+        view: memoryview = memoryview(payload)
+        counter: int = self._counter
+
+        if len(payload) < room:
+            # Everything fits in the first packet. The adaptation field fills up the rest.
+            stuffing: int = room - len(payload)
+            adaptation = bytes((adaptation[0] + stuffing,)) + adaptation[1:] + b'\xFF' * stuffing
+            room = len(payload)
+
+        packets: list[bytes] = [
+            bytes((0x47, 0x40 | VIDEO_PID >> 8, VIDEO_PID & 0xFF, 0x30 | counter)), adaptation, view[:room]
+        ]
+
+        # Full packets with only payload. The last one is filled up with an adaptation field.
+        position: int = room
+        end: int = len(payload)
+        while position < end:
+            counter = (counter + 1) & 0x0F
+            left: int = end - position
+            if left >= PACKET_SIZE - 4:
+                packets.append(_CONTINUATION[counter])
+                packets.append(view[position:position + PACKET_SIZE - 4])
+                position += PACKET_SIZE - 4
+                continue
+
+            header: bytes = bytes((0x47, VIDEO_PID >> 8, VIDEO_PID & 0xFF, 0x30 | counter))
+            stuffing = PACKET_SIZE - 4 - left
+            if stuffing == 1:
+                packets.append(header + b'\x00')
+            else:
+                packets.append(header + bytes((stuffing - 1, 0x00)) + b'\xFF' * (stuffing - 2))
+            packets.append(view[position:])
+            position = end
+
+        self._counter = (counter + 1) & 0x0F
+        return b''.join(packets)
+
+
+class HlsPackager(Recorder):
+    """Writes the frames of one stream as HLS segments, with a live and a VOD playlist.
+
+    Attributes:
+        uri_prefix (str): Put in front of the file name of every segment in the playlists.
+        live_segments (int): The segments in the live playlist.
+        durations (list[float]): The duration of every finished segment, in seconds.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        uri_prefix: str = '',
+        segment_seconds: float = VIDEO_HLS_SEGMENT_SECONDS,
+        live_segments: int = VIDEO_HLS_LIVE_SEGMENTS,
+        max_queue_bytes: int = VIDEO_RECORDING_QUEUE_BYTES
+    ) -> None:
+        self.uri_prefix: str = uri_prefix
+        self.live_segments: int = live_segments
+        self.durations: list[float] = []
+
+        # Only used by the writer thread.
+        self._muxer: TsMuxer = TsMuxer()
+        self._segment_pts: int = 0
+        self._previous_pts: int | None = None
+        self._interval: int = CLOCK // 30
+        self._vod: object | None = None
+
+        super().__init__(directory, segment_seconds=segment_seconds, max_queue_bytes=max_queue_bytes)
+
+    def _name(self, number: int) -> str:
+        return f"segment_{number:05}.ts"
+
+    def _write(self, frame: AccessUnit) -> None:
+        """Mux a frame, and start a new segment first if it is a keyframe and the segment is long enough."""
+        try:
+            pts: int = self._muxer.pts_of(frame.arrival)
+            if frame.keyframe and (self._segment is None or pts - self._segment_pts >= self.segment_seconds * CLOCK):
+                self._finish_segment(pts)
+                self._segment = open(os.path.join(self.directory, self._name(self.segments)), 'wb')
+                self._segment.write(self._muxer.tables())
+                self._segment_pts = pts
+                self.segments += 1
+
+            # Opening the segment failed. Nothing can be written until the next keyframe.
+            if self._segment is None:
+                raise OSError("no segment open")
+
+            self._segment.write(self._muxer.mux(frame, pts))
+            if self._previous_pts is not None:
+                self._interval = pts - self._previous_pts
+            self._previous_pts = pts
+            self.bytes_written += frame.size
+
+        except OSError as error:
+            print(f"HLS packaging to {self.directory} failed: {error}")
+            self.dropped_bytes += frame.size
+            self.dropped_frames += 1
+
+    def _finish_segment(self, end: int) -> None:
+        """Close the segment being written, and add it to the playlists. It ends at PTS `end`."""
+        if self._segment is None:
+            return
+
+        self._segment.close()
+        self._segment = None
+        self.durations.append((end - self._segment_pts) / CLOCK)
+
+        number: int = len(self.durations) - 1
+        entry: str = f"#EXTINF:{self.durations[-1]:.3f},\n{self.uri_prefix}{self._name(number)}\n"
+
+        # The VOD playlist is only appended to, so writing it does not take longer as the recording grows.
+        # Segments only end at keyframes, so they can be longer than `segment_seconds`. The target duration
+        # is a guess until the packager is closed, and the playlist is written once more with the real one.
+        if self._vod is None:
+            self._vod = open(os.path.join(self.directory, 'vod.m3u8'), 'w')
+            self._vod.write(self._header(math.ceil(self.segment_seconds * 2), 0, "EVENT"))
+        self._vod.write(entry)
+        self._vod.flush()
+
+        # The live playlist is small, and replaced at once so a player never reads half of it.
+        first: int = max(len(self.durations) - self.live_segments, 0)
+        self._write_playlist('live.m3u8', first, None)
+
+    def _header(self, target: int, sequence: int, kind: str | None) -> str:
+        return (
+            "#EXTM3U\n#EXT-X-VERSION:3\n"
+            + (f"#EXT-X-PLAYLIST-TYPE:{kind}\n" if kind is not None else "")
+            + f"#EXT-X-TARGETDURATION:{target}\n#EXT-X-MEDIA-SEQUENCE:{sequence}\n"
+        )
+
+    def _write_playlist(self, name: str, first: int, kind: str | None, end: bool = False) -> None:
+        """Replace a playlist with the segments from `first` on."""
+        target: int = max(math.ceil(max(self.durations[first:], default=0)), 1)
+        text: str = self._header(target, first, kind) + "".join(
+            f"#EXTINF:{duration:.3f},\n{self.uri_prefix}{self._name(first + number)}\n"
+            for number, duration in enumerate(self.durations[first:])
+        ) + ("#EXT-X-ENDLIST\n" if end else "")
+
+        path: str = os.path.join(self.directory, name)
+        with open(path + '.tmp', 'w') as playlist:
+            playlist.write(text)
+        os.replace(path + '.tmp', path)
+
+    def _close_segment(self) -> None:
+        """Finish the last segment, and make the VOD playlist of the whole stream."""
+        if self._segment is None:
+            return
+
+        # The last segment ends one frame interval after its last frame.
+        self._finish_segment(self._previous_pts + self._interval)
+
+        if self._vod is not None:
+            self._vod.close()
+            self._vod = None
+        self._write_playlist('vod.m3u8', 0, "VOD", end=True)
+        self._write_playlist('live.m3u8', max(len(self.durations) - self.live_segments, 0), None, end=True)
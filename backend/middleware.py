@@ -27,10 +27,19 @@ routes_with_authorization: list = [ # TODO: Add all routes that is sensitive + d
     "/v1/api/frontend/logout",
     "/v1/api/frontend/users/me",
     "/v1/api/frontend/relayboxes/all",
+    "/v1/api/frontend/relayboxes/snapshot",
     "/v1/api/frontend/drone/takeoff",
     "/v1/api/frontend/drone/land",
     "/v1/api/frontend/drone/new_command",
+    "/v1/api/frontend/drone/video/subscribe",
+    "/v1/api/frontend/drone/video/stats",
+    "/v1/api/frontend/drone/recording/segments",
+    "/v1/api/frontend/drone/recording/seek",
+    "/v1/api/frontend/drone/recording/segment",
+    "/v1/api/frontend/drone/hls",
+    "/v1/api/frontend/video/bandwidth",
     "/v1/api/relay/heartbeat", 
+    "/v1/api/relay/sync",
     "/v1/api/relay/relayboxes/all"
 ]
 
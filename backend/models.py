@@ -7,11 +7,13 @@ is given FastAPI returns a field required exception (HTTP response of 422).
 Models:
 - RelayHandshakeModel: The Pydantic model for a Relay's handshake.
 - RelayHeartbeatModel: The Pydantic model for a Relay's heartbeat.
+- RelaySyncModel: The Pydantic model for a Relay's sync, with the status of all its drones.
 - DroneModel: The Pydantic model for a drone.
 - DroneStatusInformationModel: The Pydantic model for a drone's status information.
 - TokenModel: The Pydantic model for an access token.
 - UserModel: The Pydantic model for a user.
 - NewCMDModel: The Pydantic model for a new command.
+- BandwidthLimitModel: The Pydantic model for a new bandwidth limit on video sent to viewers.
 '''
 
 from pydantic import BaseModel
@@ -25,6 +27,15 @@ class RelayHeartbeatModel(BaseModel):
     name: str
 
 
+class RelaySyncModel(BaseModel):
+    name: str
+    statuses: dict[str, str] = {}
+    versions: dict[str, int] = {}
+    membership: int | None = None
+    ages: dict[str, list[float]] = {}
+    stale: dict[str, int] = {}
+
+
 class DroneModel(BaseModel):
     name: str
     parent: str
@@ -50,3 +61,12 @@ class NewCMDModel(BaseModel):
     relay_name: str
     drone_name: str
     cmd: list
+    client: str | None = None
+    issued: float | None = None
+
+
+class BandwidthLimitModel(BaseModel):
+    relay_name: str | None = None
+    drone_name: str | None = None
+    rate: float
+    burst: float | None = None
@@ -0,0 +1,202 @@
+'''Play back and seek in recorded drone video.
+
+A recording is the segments a `Recorder` wrote to a drone's directory (see `recorder.py`). A segment is
+opened with `mmap`, so seeking never reads the file: the segment is found from the start time in its name,
+and the keyframe from a binary search over its `.idx` file. Only the pages that are sent are read from disk,
+so seeking takes about as long on a recording of many GB as on a small one.
+
+Seeking to a time finds the last keyframe at or before it, since a player can only start decoding there.
+The bytes of the segment from that offset are sent as a ranged HTTP response (see `frontend_routes.py`).
+
+Classes:
+    Segment: One memory mapped segment and its keyframe index.
+
+Functions:
+    list_segments: Returns the names of the segments in a drone's directory, oldest first.
+    segment_start: Returns when a segment starts, from its name.
+    seek_recording: Finds the last keyframe at or before a time in a drone's recording.
+    parse_range: Parses an HTTP `Range` header.
+
+Example:
+    >>> directory = recording_directory("relay_0", "drone_0")
+    >>> name, arrival, offset = seek_recording(directory, 1716286502.25)
+    >>> with Segment(os.path.join(directory, name)) as segment:
+    ...     data = segment.data[offset:offset + 65536]
+'''
+
+# Default Python
+import bisect, calendar, mmap, os, re, time
+
+from recorder import INDEX_ENTRY
+
+# The name of a segment, the time (UTC) of its first frame. For example `20240521-101502.250`.
+_SEGMENT_NAME: re.Pattern = re.compile(r'^\d{8}-\d{6}\.\d{3}$')
+
+
+def list_segments(directory: str) -> list[str]:
+    """Returns the names of the segments in a drone's directory, oldest first.
+
+    Args:
+        directory (str): The drone's directory. See `recording_directory()` in `recorder.py`.
+
+    Returns:
+        list[str]: The names, without `.h264` and `.idx`. Empty if nothing was recorded.
+    """
+    try:
+        files: list[str] = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+
+    names: list[str] = [file[:-5] for file in files if file.endswith('.h264') and _SEGMENT_NAME.match(file[:-5])]
+    return sorted(names)
+
+
+def segment_start(name: str) -> float:
+    """Returns when a segment starts (seconds since 1970), from its name."""
+    return calendar.timegm(time.strptime(name[:15], '%Y%m%d-%H%M%S')) + int(name[16:19]) / 1000
+
+
+class _Arrivals:
+    """The arrival times in an index, as a sequence for `bisect`, without unpacking the whole index."""
+
+    def __init__(self, index: mmap.mmap | bytes) -> None:
+        self.index = index
+
+    def __len__(self) -> int:
+        return len(self.index) // INDEX_ENTRY.size
+
+    def __getitem__(self, position: int) -> float:
+        return INDEX_ENTRY.unpack_from(self.index, position * INDEX_ENTRY.size)[0]
+
+
+class Segment:
+    """One memory mapped segment and its keyframe index.
+
+    Attributes:
+        path (str): The path of the segment, without `.h264` and `.idx`.
+        data (mmap.mmap | bytes): The H.264 of the segment.
+        index (mmap.mmap | bytes): The keyframe index of the segment. See `INDEX_ENTRY` in `recorder.py`.
+        keyframes (int): The keyframes in the index.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        self.data: mmap.mmap | bytes = self._map(path + '.h264')
+        self.index: mmap.mmap | bytes = self._map(path + '.idx')
+
+        # The last entry may only be partly written, if the segment is being recorded.
+        self.keyframes: int = len(self.index) // INDEX_ENTRY.size
+
+    @staticmethod
+    def _map(path: str) -> mmap.mmap | bytes:
+        with open(path, 'rb') as file:
+            # An empty file cannot be mapped.
+            if os.fstat(file.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self) -> 'Segment':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def keyframe(self, number: int) -> tuple[float, int]:
+        """Returns the arrival time and offset of a keyframe.
+
+        Args:
+            number (int): The keyframe, counted from the start of the segment.
+        """
+        return INDEX_ENTRY.unpack_from(self.index, number * INDEX_ENTRY.size)
+
+    def seek(self, timestamp: float) -> tuple[float, int] | None:
+        """Find the last keyframe at or before a time.
+
+        Args:
+            timestamp (float): The time to seek to (seconds since 1970).
+
+        Returns:
+            tuple[float, int] | None: The arrival time and offset of the keyframe, the first keyframe if
+                `timestamp` is before it, or `None` if the segment has no keyframes.
+        """
+        if self.keyframes == 0:
+            return None
+        number: int = bisect.bisect_right(_Arrivals(self.index), timestamp, hi=self.keyframes) - 1
+        return self.keyframe(max(number, 0))
+
+    def close(self) -> None:
+        """Unmap the segment."""
+        for mapping in (self.data, self.index):
+            if isinstance(mapping, mmap.mmap):
+                mapping.close()
+
+
+def seek_recording(directory: str, timestamp: float) -> tuple[str, float, int] | None:
+    """Find the last keyframe at or before a time in a drone's recording.
+
+    Args:
+        directory (str): The drone's directory. See `recording_directory()` in `recorder.py`.
+        timestamp (float): The time to seek to (seconds since 1970).
+
+    Returns:
+        tuple[str, float, int] | None: The name of the segment, the arrival time of the keyframe and its
+            offset in the segment. The first keyframe if `timestamp` is before the recording, and `None` if
+            nothing was recorded. A segment without keyframes (one that was just started, or whose index
+            is missing) is skipped for the one before it.
+
+    Example:
+        >>> seek_recording("recordings/relay_0/drone_0", 1716286600)
+        ('20240521-101502.250', 1716286599.75, 14123008)
+    """
+    names: list[str] = list_segments(directory)
+    if not names:
+        return None
+
+    starts: list[float] = [segment_start(name) for name in names]
+    number: int = max(bisect.bisect_right(starts, timestamp) - 1, 0)
+
+    for name in reversed(names[:number + 1]):
+        try:
+            with Segment(os.path.join(directory, name)) as segment:
+                found: tuple[float, int] | None = segment.seek(timestamp)
+        except FileNotFoundError:
+            continue
+
+        if found is not None:
+            return name, found[0], found[1]
+
+    return None
+
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """Parses an HTTP `Range` header with a single range of bytes.
+
+    Args:
+        header (str | None): The header, for example `bytes=1000-` or `bytes=0-499` or `bytes=-500`.
+        size (int): The size of the file.
+
+    Returns:
+        tuple[int, int] | None: The first and last byte (inclusive), or `None` if there is no header.
+
+    Raises:
+        ValueError: If the range is malformed or not within the file.
+    """
+    if header is None:
+        return None
+
+    match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', header)
+    if match is None or match.group(1) == match.group(2) == '':
+        raise ValueError(f"Unsupported range: {header}")
+
+    # `bytes=-500` is the last 500 bytes.
+    if match.group(1) == '':
+        start: int = max(size - int(match.group(2)), 0)
+        end: int = size - 1
+    else:
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+
+    if start >= size or start > end:
+        raise ValueError(f"Range not satisfiable: {header}")
+
+    return start, end
@@ -0,0 +1,255 @@
+'''Record drone video to disk, for looking at an inspection afterwards.
+
+A `Recorder` is a frame listener of a `DroneVideoStream` (see `DroneVideoStream.start_recording()`). It
+writes the raw H.264 (Annex B) of the stream into segment files in the drone's directory, and starts a new
+segment at the first keyframe after `VIDEO_RECORDING_SEGMENT_BYTES` bytes or `VIDEO_RECORDING_SEGMENT_SECONDS`
+seconds, so every segment can be played on its own. A segment is named after the time (UTC) of its first frame:
+
+    recordings/<relay>/<drone>/20240521-101502.250.h264
+    recordings/<relay>/<drone>/20240521-101502.250.idx
+
+The `.idx` file next to a segment has one entry per keyframe (see `INDEX_ENTRY`), in order:
+
+    | arrival (8, double, seconds since 1970) | offset in the segment (8, unsigned) |
+
+Recording never blocks forwarding. The `VideoEngine` thread only puts the frame in a queue, and a writer
+thread of the recorder writes it with large buffered writes. The queue holds at most
+`VIDEO_RECORDING_QUEUE_BYTES`. If the disk falls behind and it is full, video is dropped until the next
+keyframe (so the recording stays decodable) and counted in `dropped_bytes`.
+
+Classes:
+    Recorder: Writes the frames of one stream into segment files with a keyframe index.
+
+Functions:
+    recording_directory: Returns the directory of a drone's recordings.
+'''
+
+# Default Python
+import os, re, struct, threading, time
+from collections import deque
+
+from h264 import AccessUnit, NAL_PPS, NAL_SPS, split_nal_units
+
+from config import (
+    VIDEO_RECORDING_DIRECTORY,
+    VIDEO_RECORDING_QUEUE_BYTES,
+    VIDEO_RECORDING_SEGMENT_BYTES,
+    VIDEO_RECORDING_SEGMENT_SECONDS,
+    VIDEO_RECORDING_WRITE_BUFFER
+)
+
+INDEX_ENTRY: struct.Struct = struct.Struct('!dQ')
+
+
+def recording_directory(relay_name: str, drone_name: str, root: str = VIDEO_RECORDING_DIRECTORY) -> str:
+    """Returns the directory of a drone's recordings.
+
+    Args:
+        relay_name (str): The name of the relay the drone is connected to.
+        drone_name (str): The name of the drone.
+        root (str): The directory of every drone's recordings. `VIDEO_HLS_DIRECTORY` for HLS (see `hls.py`).
+
+    Returns:
+        str: `<root>/<relay>/<drone>`. Names are made safe for the file system, so they cannot point outside of it.
+    """
+    def safe(name: str) -> str:
+        return re.sub(r'[^A-Za-z0-9_.-]', '_', name).lstrip('.') or '_'
+    return os.path.join(root, safe(relay_name), safe(drone_name))
+
+
+class Recorder:
+    """Writes the frames of one stream into segment files with a keyframe index.
+
+    Attributes:
+        directory (str): Where the segments are written.
+        segment_bytes (int): A new segment is started at the first keyframe after this many bytes.
+        segment_seconds (float): A new segment is started at the first keyframe after this many seconds.
+        max_queue_bytes (int): The most bytes waiting for the writer thread before video is dropped.
+        segments (int): Segments started.
+        bytes_written (int): Bytes of video written.
+        dropped_bytes (int): Bytes of video dropped because the disk fell behind.
+        dropped_frames (int): Frames dropped because the disk fell behind.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = VIDEO_RECORDING_SEGMENT_BYTES,
+        segment_seconds: float = VIDEO_RECORDING_SEGMENT_SECONDS,
+        max_queue_bytes: int = VIDEO_RECORDING_QUEUE_BYTES
+    ) -> None:
+        self.directory: str = directory
+        self.segment_bytes: int = segment_bytes
+        self.segment_seconds: float = segment_seconds
+        self.max_queue_bytes: int = max_queue_bytes
+        self.segments: int = 0
+        self.bytes_written: int = 0
+        self.dropped_bytes: int = 0
+        self.dropped_frames: int = 0
+
+        # Frames waiting for the writer thread, oldest first, and their bytes.
+        self._items: deque[AccessUnit] = deque()
+        self._queued_bytes: int = 0
+        self._condition: threading.Condition = threading.Condition()
+        self._closing: bool = False
+
+        # A recording starts at a keyframe. After video was dropped, it goes on at the next one.
+        self._waiting_for_keyframe: bool = True
+        self._started: bool = False
+
+        # Only used by the writer thread.
+        self._segment: object | None = None
+        self._index: object | None = None
+        self._segment_start: float = 0
+        self._segment_size: int = 0
+        self._sps: bytes | None = None
+        self._pps: bytes | None = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._thread: threading.Thread = threading.Thread(target=self._run, name=f"Recorder {directory}", daemon=True)
+        self._thread.start()
+
+    def add(self, frame: AccessUnit) -> None:
+        """Queue a frame for writing. Use this as a frame listener of the stream. It never blocks.
+
+        Args:
+            frame (AccessUnit): The next frame of the stream.
+        """
+        if self._closing:
+            return
+
+        if self._waiting_for_keyframe:
+            if not frame.keyframe:
+                if self._started:
+                    self.dropped_bytes += frame.size
+                    self.dropped_frames += 1
+                return
+            self._waiting_for_keyframe = False
+            self._started = True
+
+        # The disk is falling behind. Frames after a dropped one cannot be decoded, so drop up to the next keyframe.
+        if self._queued_bytes + frame.size > self.max_queue_bytes:
+            print(f"Recording to {self.directory} is falling behind. Dropping video until the next keyframe.")
+            self.dropped_bytes += frame.size
+            self.dropped_frames += 1
+            self._waiting_for_keyframe = True
+            return
+
+        with self._condition:
+            self._items.append(frame)
+            self._queued_bytes += frame.size
+            self._condition.notify()
+
+    def close(self) -> None:
+        """Write what is waiting, close the segment and stop the writer thread."""
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self) -> None:
+        """The writer thread. Writes whatever is waiting at once, until the recorder is closed."""
+        while True:
+            with self._condition:
+                while not self._items and not self._closing:
+                    self._condition.wait()
+                items: deque[AccessUnit] = self._items
+                self._items = deque()
+                closing: bool = self._closing
+
+            written: int = 0
+            for frame in items:
+                self._write(frame)
+                written += frame.size
+
+            with self._condition:
+                self._queued_bytes -= written
+
+            if closing and not self._items:
+                break
+
+        self._close_segment()
+
+    def _write(self, frame: AccessUnit) -> None:
+        """Write a frame, and start a new segment first if it is a keyframe and the segment is full."""
+        try:
+            if frame.keyframe and (
+                self._segment is None
+                or self._segment_size >= self.segment_bytes
+                or frame.arrival - self._segment_start >= self.segment_seconds
+            ):
+                self._open_segment(frame.arrival)
+
+            # Opening the segment failed. Nothing can be written until the next keyframe.
+            if self._segment is None:
+                raise OSError("no segment open")
+
+            if frame.keyframe:
+                # Parameter sets are rare, usually once per keyframe, so copying them out is cheap.
+                if NAL_SPS in frame.nal_types or NAL_PPS in frame.nal_types:
+                    for unit in split_nal_units(frame.data()):
+                        if unit[4] & 0x1F == NAL_SPS:
+                            self._sps = unit
+                        elif unit[4] & 0x1F == NAL_PPS:
+                            self._pps = unit
+
+                offset: int = self._segment_size
+
+                # A keyframe without them cannot be decoded from the start of the segment.
+                if NAL_SPS not in frame.nal_types and self._sps is not None and self._pps is not None:
+                    self._segment.write(self._sps + self._pps)
+                    self._segment_size += len(self._sps) + len(self._pps)
+
+            self._segment.writelines(frame.chunks)
+            self._segment_size += frame.size
+            self.bytes_written += frame.size
+
+            # Seeking in the segment being recorded finds the keyframe right away: the keyframe is on disk
+            # before its index entry, and the entry is not left in the write buffer.
+            if frame.keyframe:
+                self._segment.flush()
+                self._index.write(INDEX_ENTRY.pack(frame.arrival, offset))
+                self._index.flush()
+
+        except OSError as error:
+            print(f"Recording to {self.directory} failed: {error}")
+            self.dropped_bytes += frame.size
+            self.dropped_frames += 1
+
+    def _open_segment(self, start: float) -> None:
+        """Close the segment being written, and start a new one named after `start`."""
+        self._close_segment()
+
+        name: str = time.strftime('%Y%m%d-%H%M%S', time.gmtime(start)) + f".{int(start * 1000) % 1000:03}"
+        path: str = os.path.join(self.directory, name)
+        segment = open(path + '.h264', 'wb', buffering=VIDEO_RECORDING_WRITE_BUFFER)
+        try:
+            self._index = open(path + '.idx', 'wb', buffering=VIDEO_RECORDING_WRITE_BUFFER)
+        except OSError:
+            segment.close()
+            raise
+        self._segment = segment
+        self._segment_start = start
+        self._segment_size = 0
+        self.segments += 1
+
+    def _close_segment(self) -> None:
+        if self._segment is not None:
+            self._segment.close()
+            self._index.close()
+            self._segment = None
+            self._index = None
+
+    def stats(self) -> dict[str, int]:
+        """Returns the counters of the recorder.
+
+        Example:
+            >>> { "segments": 3, "bytes_written": 73400320, "queue_bytes": 0, "dropped_bytes": 0, "dropped_frames": 0 }
+        """
+        return {
+            "segments": self.segments,
+            "bytes_written": self.bytes_written,
+            "queue_bytes": self._queued_bytes,
+            "dropped_bytes": self.dropped_bytes,
+            "dropped_frames": self.dropped_frames,
+        }
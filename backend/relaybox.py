@@ -10,17 +10,38 @@ connected to it. It has methods to add and delete drones, and to obtain
 available ports for video streams.
 '''
 
+# Default Python
+import asyncio, itertools, secrets, threading, time
+
+from command_age import CommandAge
+from config import CMD_REORDER_WINDOW, VIDEO_INGEST_PORT
+
+# Versions of the command queues. Shared by every drone, so a drone that was removed and added again never
+# has a version a relay saw before.
+_cmd_versions: itertools.count = itertools.count(1)
+
+# The most clients of a drone whose newest command times are kept. The one heard from the longest ago is forgotten.
+_MAX_CMD_CLIENTS: int = 16
+
 class Drone:
     """Represents a drone object, similar to the Tello EDU Drone.
 
     Attributes:
         name (str): The name of the drone.
-        cmd_queue (list): A command queue for flying the drone.
+        cmd_queue (list): A command queue for flying the drone. Set it with `set_cmd_queue()`.
+        cmd_version (int): Grows every time `cmd_queue` is set, so a relay can tell if it changed. It is the
+            sequence number of the command.
+        cmd_issued (float): When the backend got `cmd_queue` (seconds since 1970), so a relay can tell how old
+            it is.
         port (int | None): The socket port used to send video.
+        stream_id (int | None): The stream id of the drone's video on the multiplexed ingest port, or `None`
+            if the drone has a video port of its own.
+        publisher_token (str): The secret the relay sends with `RTS` to become the publisher of the drone's video.
         airborn (bool): A flag indicating whether the drone is currently airborn.
         should_takeoff (bool): A flag indicating whether the drone should take off.
         should_land (bool): A flag indicating whether the drone should land.
         status_information (dict): A dictionary containing information about the drone's status.
+        command_age (CommandAge): How old the rc commands are when the relay gets them.
     """
 
     def __init__(self, name) -> None:
@@ -29,10 +50,27 @@ class Drone:
 
         # Command queue for flying a drone
         self.cmd_queue: list[int, int, int, int] = [0, 0, 0, 0]
+        self.cmd_version: int = next(_cmd_versions)
+        self.cmd_issued: float = time.time()
+
+        # When every client sent its newest command (ms since 1970, by its own clock), to drop the ones that
+        # arrive after it. By client, since the clocks of the clients are not the same.
+        self._cmd_clients: dict[str, float] = {}
+
+        # Set when the command queue changes, for the long-polls waiting for it. See `wait_for_cmd_queue()`.
+        self._cmd_changed: asyncio.Event | None = None
+        self._cmd_loop: asyncio.AbstractEventLoop | None = None
+        self._cmd_lock: threading.Lock = threading.Lock()
 
         # The Socket Port to send video via.
         self.port: int | None = None
 
+        # The stream id on the multiplexed ingest port. See `video_header.py`.
+        self.stream_id: int | None = None
+
+        # Only the relay that was given this by `/new_drone` can publish the drone's video.
+        self.publisher_token: str = secrets.token_urlsafe(16)
+
         # To validate the state of a drone
         self.airborn: bool = False
         self.should_takeoff: bool = False
@@ -41,6 +79,95 @@ class Drone:
         # A dict of status information.
         self.status_information: dict = {}
 
+        # How old the rc commands are when the relay gets them. Private, so it is left out of the heartbeat.
+        self._command_age: CommandAge = CommandAge()
+
+    @property
+    def command_age(self) -> CommandAge:
+        return self._command_age
+
+    def set_cmd_queue(
+        self, cmd: list[int, int, int, int], client: str | None = None, client_issued: float | None = None
+    ) -> bool:
+        """Set the command queue, and wake the long-polls waiting for it. Can be called from any thread.
+
+        The newest command of a client wins: one the client sent before its newest command (the requests of a
+        client can overtake each other) is dropped. Only the times of the same client are compared, by its own
+        clock. A command sent more than `CMD_REORDER_WINDOW` ms before is from a clock that was set back, and is
+        set. Commands without a client are set in the order they arrive.
+
+        Args:
+            cmd (list[int, int, int, int]): The new command.
+            client (str | None): The id of the client that sent it, if it says.
+            client_issued (float | None): When the client sent it (ms since 1970, its own clock), if it says.
+
+        Returns:
+            bool: `False` if the command was dropped for being older than the newest one of its client.
+        """
+        with self._cmd_lock:
+            if client is not None and client_issued is not None:
+                newest: float | None = self._cmd_clients.pop(client, None)
+                if newest is not None and newest - CMD_REORDER_WINDOW < client_issued <= newest:
+                    self._cmd_clients[client] = newest
+                    return False
+
+                # Heard from last, so forgotten last.
+                self._cmd_clients[client] = client_issued
+                if len(self._cmd_clients) > _MAX_CMD_CLIENTS:
+                    del self._cmd_clients[next(iter(self._cmd_clients))]
+
+            self.cmd_queue = cmd
+            self.cmd_version = next(_cmd_versions)
+            self.cmd_issued = time.time()
+
+            # The next long-poll waits for a new event.
+            event, loop = self._cmd_changed, self._cmd_loop
+            self._cmd_changed = None
+
+        if event is not None:
+            loop.call_soon_threadsafe(event.set)
+
+        return True
+
+    def reset_cmd_queue(self) -> None:
+        """Hover, and forget the times of the clients' commands. For a new flight."""
+        with self._cmd_lock:
+            self._cmd_clients.clear()
+
+        self.set_cmd_queue([0, 0, 0, 0])
+
+    def command(self) -> dict[str, any]:
+        """Returns the command queue with its version and when it was issued, all of the same command.
+
+        Example:
+            >>> { "rc": [0, 20, 0, 0], "version": 41, "issued": 1718000000.25 }
+        """
+        with self._cmd_lock:
+            return { "rc": self.cmd_queue, "version": self.cmd_version, "issued": self.cmd_issued }
+
+    async def wait_for_cmd_queue(self, version: int, timeout: float) -> None:
+        """Wait until the command queue is newer than a version, or a timeout expires.
+
+        Waits on the event loop of the caller, so a long-poll holds no thread while it waits.
+
+        Args:
+            version (int): The last version the relay saw.
+            timeout (float): The most seconds to wait.
+        """
+        with self._cmd_lock:
+            if self.cmd_version != version:
+                return
+
+            if self._cmd_changed is None:
+                self._cmd_changed = asyncio.Event()
+                self._cmd_loop = asyncio.get_running_loop()
+            event: asyncio.Event = self._cmd_changed
+
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
     def set_status_information(self, status_information: bytes) -> None:
         """Update status information 
 
@@ -80,6 +207,7 @@ class Relay:
         drones (dict[str, Drone]): A dictionary of drones connected to the relay.
         active_relays (dict[str, object]): A dictionary of active relays.
         last_heartbeat_received (int | None): A integer of seconds since 1970 (utc).
+        membership (int): Grows every time a drone is added or removed, so the relay can tell if it changed.
     """
 
     def __init__(
@@ -97,12 +225,15 @@ class Relay:
         self.drones: dict[str, Drone] = {}
         self.active_relays: dict[str, object] = active_relays
         self.last_heartbeat_received: int | None = None # A int for sec since 1970 (utc). Se `relay_routes` for more detail.
+        self.membership: int = 0
 
-    def add_drone(self, name: str) -> None:
+    def add_drone(self, name: str, multiplexed: bool = False) -> int:
         """Adds a new drone to the relay.
 
         Args:
             name (str): The name of the drone.
+            multiplexed (bool): If the relay sends the drone's video to the multiplexed ingest port
+                instead of a video port of its own.
 
         Returns:
             int: The port number for the video stream of the new drone.
@@ -110,11 +241,29 @@ class Relay:
         Raises:
             ValueError: If all available ports are taken.
         """
+        # Every multiplexed drone shares the ingest port, and is told apart by its stream id. The ids are
+        # random, so they cannot be guessed from the ones before.
+        if multiplexed:
+            used_stream_ids: set = {
+                drone.stream_id for relay in self.active_relays.values() for drone in relay.drones.values()
+            }
+            stream_id: int = 0
+            while stream_id == 0 or stream_id in used_stream_ids:
+                stream_id = secrets.randbits(32)
+
+            drone: Drone = Drone(name)
+            drone.port = VIDEO_INGEST_PORT
+            drone.stream_id = stream_id
+            self.drones[name] = drone
+            self.membership += 1
+            return VIDEO_INGEST_PORT
+
         # Check for available ports
         used_ports: set = set()
         for relay in self.active_relays.values():
             for drone in relay.drones.values():
-                used_ports.add(drone.port)
+                if drone.stream_id is None:
+                    used_ports.add(drone.port)
 
         # usable ports for video streams.
         for port in range(52222, 53334):
@@ -132,9 +281,19 @@ class Relay:
         
         # Append new drone to drones
         self.drones[name]: dict[str: Drone] = drone
+        self.membership += 1
 
         return video_port
 
+    def remove_drone(self, name: str) -> None:
+        """Removes a drone from the relay.
+
+        Args:
+            name (str): The name of the drone.
+        """
+        del self.drones[name]
+        self.membership += 1
+
 if __name__ == '__main__':
     drone = Drone("drone_001")
     drone.set_status_information(
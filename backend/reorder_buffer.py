@@ -0,0 +1,202 @@
+'''A small buffer that puts the datagrams from a relay back in order.
+
+The internet sometimes delivers UDP datagrams out of order. Two datagrams of an H.264 frame swapped around
+corrupt the frame for every viewer, so in multiplexed mode (where the datagrams have sequence numbers, see
+`video_header.py`) each stream puts them back in order before they are parsed and sent on.
+
+A datagram that arrives in order is passed on at once, without being copied, so the buffer costs nothing
+while the network keeps the order. A datagram that arrives after a gap is copied into a ring of `depth`
+slots, and waits for the datagrams before it. The buffer gives up on a gap, and passes on what comes after
+it, when:
+    - The datagram that waited longest has waited `deadline` seconds, so the latency stays bounded.
+    - A datagram arrives that does not fit in the ring.
+
+A datagram that arrives after the buffer gave up on it is too late, and is dropped.
+
+Classes:
+    ReorderBuffer: Puts the datagrams of one stream back in order.
+'''
+
+# Default Python
+from typing import Callable
+
+from config import VIDEO_REORDER_DEADLINE, VIDEO_REORDER_DEPTH
+
+# A jump in sequence numbers larger than this is a relay that started over, not lost datagrams (like RFC 3550).
+_MAX_DROPOUT: int = 3000
+# A datagram further than this behind the next one is a relay that started over, not a late datagram.
+_MAX_MISORDER: int = 100
+
+
+class ReorderBuffer:
+    """Puts the datagrams of one stream back in order.
+
+    Attributes:
+        depth (int): The most datagrams that can wait for a gap.
+        deadline (float): The most seconds a datagram waits for a gap.
+        emit (Callable[[bytes | memoryview], None]): Called with every datagram, in order.
+        buffered (int): Datagrams waiting for a gap now.
+        max_buffered (int): The most datagrams that waited at once.
+        reordered (int): Datagrams that arrived after a gap and were put back in order.
+        late (int): Datagrams that arrived after the buffer gave up on them, or twice. They are dropped.
+        skipped (int): Datagrams the buffer gave up waiting for.
+        resets (int): Times the relay started its sequence numbers over.
+    """
+
+    def __init__(
+        self,
+        emit: Callable[[bytes | memoryview], None],
+        depth: int = VIDEO_REORDER_DEPTH,
+        deadline: float = VIDEO_REORDER_DEADLINE
+    ) -> None:
+        self.depth: int = depth
+        self.deadline: float = deadline
+        self.emit: Callable[[bytes | memoryview], None] = emit
+        self.buffered: int = 0
+        self.max_buffered: int = 0
+        self.reordered: int = 0
+        self.late: int = 0
+        self.skipped: int = 0
+        self.resets: int = 0
+
+        # The ring. The datagram with sequence number `s` waits in slot `s % depth`, with when it arrived.
+        self._slots: list[bytes | None] = [None] * depth
+        self._arrivals: list[float] = [0.0] * depth
+
+        # The sequence number of the next datagram to pass on.
+        self._next: int | None = None
+
+    def push(self, sequence: int, data: bytes | memoryview, now: float) -> None:
+        """Add a datagram, and pass on every datagram that is now in order.
+
+        Args:
+            sequence (int): The sequence number of the datagram.
+            data (bytes | memoryview): The datagram. It is copied if it has to wait.
+            now (float): When it arrived (seconds since 1970).
+        """
+        expected: int | None = self._next
+
+        # The next datagram, which is by far the most common.
+        if sequence == expected or expected is None:
+            self._next = (sequence + 1) & 0xFFFFFFFF
+            self.emit(data)
+            if self.buffered:
+                self._drain()
+                self.expire(now)
+            return
+
+        # How far ahead of the next datagram it is, from -2^31 to 2^31, so it wraps with the sequence number.
+        ahead: int = ((sequence - expected + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+        if ahead > _MAX_DROPOUT or ahead < -_MAX_MISORDER:
+            # The relay started over. Pass on what is waiting, and start over with it.
+            self.resets += 1
+            self.expire(float('inf'))
+            self._next = (sequence + 1) & 0xFFFFFFFF
+            self.emit(data)
+            return
+
+        if ahead < 0:
+            self.late += 1
+            return
+
+        # It does not fit in the ring. Give up on the gaps until it does.
+        if ahead >= self.depth:
+            self._skip(ahead - self.depth + 1)
+            if sequence == self._next:
+                self._next = (sequence + 1) & 0xFFFFFFFF
+                self.emit(data)
+                self._drain()
+                return
+
+        slot: int = sequence % self.depth
+        if self._slots[slot] is not None:
+            self.late += 1
+            return
+
+        # Copied, since a `memoryview` of a datagram is only valid until it has been handled.
+        self._slots[slot] = bytes(data)
+        self._arrivals[slot] = now
+        self.buffered += 1
+        if self.buffered > self.max_buffered:
+            self.max_buffered = self.buffered
+
+        self.expire(now)
+
+    def expire(self, now: float) -> None:
+        """Give up on the gaps in front of every datagram that has waited `deadline` seconds.
+
+        Call this again `deadline` seconds after a datagram was buffered if nothing arrives, or it waits forever.
+
+        Args:
+            now (float): The time now (seconds since 1970).
+        """
+        while self.buffered:
+            # The first datagram that waits. The gap in front of it is the oldest.
+            # Wrapped like the sequence numbers, so the slots are the ones `push()` uses for any depth.
+            waiting: int = 1
+            slot: int = ((self._next + waiting) & 0xFFFFFFFF) % self.depth
+            while self._slots[slot] is None:
+                waiting += 1
+                slot = ((self._next + waiting) & 0xFFFFFFFF) % self.depth
+
+            if now - self._arrivals[slot] < self.deadline:
+                return
+
+            self._skip(waiting)
+
+    def _skip(self, count: int) -> None:
+        """Give up on the next `count` sequence numbers, passing on those that arrived, then drain the ring."""
+        slots: list[bytes | None] = self._slots
+        for index in range(count):
+            if not self.buffered:
+                # Nothing else waits, so the rest can be skipped at once.
+                self.skipped += count - index
+                self._next = (self._next + count - index) & 0xFFFFFFFF
+                return
+
+            slot: int = self._next % self.depth
+            data: bytes | None = slots[slot]
+            if data is not None:
+                slots[slot] = None
+                self.buffered -= 1
+                self.reordered += 1
+                self.emit(data)
+            else:
+                self.skipped += 1
+            self._next = (self._next + 1) & 0xFFFFFFFF
+
+        self._drain()
+
+    def _drain(self) -> None:
+        """Pass on the datagrams that are in order now."""
+        slots: list[bytes | None] = self._slots
+        while self.buffered:
+            slot: int = self._next % self.depth
+            data: bytes | None = slots[slot]
+            if data is None:
+                return
+
+            slots[slot] = None
+            self.buffered -= 1
+            self.reordered += 1
+            self._next = (self._next + 1) & 0xFFFFFFFF
+            self.emit(data)
+
+    def stats(self) -> dict[str, int | float]:
+        """Returns the counters of the buffer.
+
+        Example:
+            >>> { "depth": 32, "deadline_ms": 15.0, "buffered": 0, "max_buffered": 4, "reordered": 210,
+            ...   "late": 3, "skipped": 12, "resets": 0 }
+        """
+        return {
+            "depth": self.depth,
+            "deadline_ms": round(self.deadline * 1000, 1),
+            "buffered": self.buffered,
+            "max_buffered": self.max_buffered,
+            "reordered": self.reordered,
+            "late": self.late,
+            "skipped": self.skipped,
+            "resets": self.resets,
+        }
@@ -10,10 +10,21 @@ Routes:
     - /users/me: Retrieves the current user's username from the access token
 
     - /relayboxes/all: Retrieves all data the backend has for active relayboxes
+    - /relayboxes/snapshot: Returns the last keyframe of a drone's video, or a JPEG of it
 
     - /drone/takeoff: Sends a command to a drone to take off
     - /drone/land: Sends a command to a drone to land
     - /drone/new_command: Sends a new command to a drone
+    - /drone/video/subscribe: Issues a ticket for subscribing to a drone's video stream
+    - /drone/video/stats: Returns the quality of service metrics and counters of a drone's video stream
+    - /drone/video/{relay_name}/{drone_name}: A WebSocket that sends a drone's video to a browser
+    - /drone/recording/segments: Lists the recorded segments of a drone's video
+    - /drone/recording/seek: Finds the last keyframe at or before a time in a drone's recording
+    - /drone/recording/segment: Sends a recorded segment, or a range of bytes of it
+    - /drone/hls: Sends the HLS playlists and segments of a drone's video
+
+    - /video/bandwidth: Returns the bandwidth limits on video sent to viewers, and how full their buckets are,
+      or (POST) changes one of them
 '''
 
 # FastAPI 
@@ -22,24 +33,55 @@ from fastapi import (
     APIRouter, # Just like `app = FastAPI()`
     status, # Status code. example `400`
     Depends, 
-    Request
+    Request,
+    Header,
+    WebSocket,
+    WebSocketDisconnect
 )
+from fastapi.responses import FileResponse, Response, StreamingResponse
 
-# The dict for active relays. Se `main.py` for more information.
-from routes.relay_routes import active_relays
+# The dict for active relays and video sessions. Se `main.py` for more information.
+from routes.relay_routes import active_relays, active_sessions
 
 # Own Pydantic models
 from models import (
     UserModel, 
     NewCMDModel, 
-    DroneModel
+    DroneModel,
+    BandwidthLimitModel
 )
 
 # Own functions for JWT
 from helper_functions import (
     generate_access_token,
-    decode_access_token
+    decode_access_token,
+    is_user_authorized
 )
+
+# Access tokens of users that logged out. WebSockets do not go through the middleware.
+from middleware import blacklisted_tokens
+
+# Pushes commands to the relays over a WebSocket.
+from command_channel import LAND, RC, TAKEOFF, command_channels
+
+# Sends a drone's video over a WebSocket.
+from video_websocket import WebSocketViewer
+from video_engine import VideoEngine
+
+# Recorded video of the drones.
+import os, re
+from recorder import recording_directory
+from playback import Segment, list_segments, parse_range, seek_recording, segment_start
+from config import VIDEO_HLS_DIRECTORY
+
+# Still images of the drones' video.
+from snapshot import snapshot_cache
+
+# The state of the video sessions.
+from video_sessions import session_manager
+
+# Bandwidth limits on the video sent to viewers.
+from bandwidth import TokenBucket, global_bucket, relay_bucket, relay_buckets
 # Database. This is how to use MongoBD
 from mongodb_handler import get_mongo
 
@@ -137,13 +179,17 @@ def handle():
                             "name": "drone_001",
                             "port": 53222,
                             "airborn": False,
-                            "status_information": str
+                            "status_information": str,
+                            "video": { "packets_per_second": 270.2, "bytes_per_second": 344210.5, ... },
+                            "command": { "last_ms": 12.5, "mean_ms": 14.1, "max_ms": 230.0, ... }
                         },
                         "drone_002": {
                             "name": "drone_002",
                             "port": 53223,
                             "airborn": False,
-                            "status_information": str
+                            "status_information": str,
+                            "video": None,
+                            "command": { "last_ms": None, "mean_ms": 0, "max_ms": 0, ... }
                         }
                     ]
                 }
@@ -159,16 +205,82 @@ def handle():
         for drone_key in relay_object.drones.keys():
             drone: object = relay_object.drones[drone_key]
             
+            # The quality of service metrics of its video, if it has a video stream.
+            video_stream: object | None = active_sessions.get((relay_object.name, drone_key))
+
             # Append the attributes to the result dict.
             result[relay_object.name][drone_key]: dict = { 
                 "name": drone.name, 
                 "port": drone.port, 
                 "airborn": drone.airborn,
-                "status_information": drone.status_information
+                "status_information": drone.status_information,
+                "video": video_stream.metrics.stats() if video_stream is not None else None,
+                "command": drone.command_age.stats()
             }
     
     return result
 
+@frontend_router.get("/relayboxes/snapshot")
+def handle(relay: str, drone: str, format: str = "h264"):
+    """Returns the last keyframe of a drone's video, from memory, without joining the stream.
+
+    Args:
+        relay (str): A query parameter. The name of the relay the drone is connected to.
+        drone (str): A query parameter. The name of the drone.
+        format (str): A query parameter. `h264` for the keyframe with the SPS and PPS in front of it (Annex B),
+            or `jpeg` for a decoded picture. Decoded once per keyframe, see `snapshot.py`.
+
+    Raises:
+        HTTPException(status_code=400): If the format is not `h264` or `jpeg`.
+        HTTPException(status_code=404): If the drone has no video stream, or no keyframe has arrived yet.
+        HTTPException(status_code=501): If a JPEG is asked for, but OpenCV is not installed.
+        HTTPException(status_code=503): If the keyframe could not be decoded in time.
+
+    Returns:
+        The snapshot. The `X-Keyframe-Time` header is when the keyframe arrived (seconds since 1970).
+    """
+    if format not in ("h264", "jpeg"):
+        raise HTTPException(
+            detail=f"Unsupported format {format}, use h264 or jpeg",
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+
+    # Get the video stream of the drone
+    session: tuple[str, str] = (relay, drone)
+    if session not in active_sessions:
+        raise HTTPException(
+            detail=f"{drone} on {relay} does not exist or has no video",
+            status_code=status.HTTP_404_NOT_FOUND
+        )
+
+    try:
+        if format == "h264":
+            found: tuple[float, bytes | None] | None = snapshot_cache.bundle(active_sessions[session])
+        else:
+            found = snapshot_cache.jpeg(active_sessions[session])
+
+    except RuntimeError as error:
+        raise HTTPException(detail=str(error), status_code=status.HTTP_501_NOT_IMPLEMENTED)
+
+    except TimeoutError:
+        raise HTTPException(detail="Decoding the snapshot took too long", status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    if found is None:
+        raise HTTPException(
+            detail=f"No keyframe from {drone} on {relay} yet",
+            status_code=status.HTTP_404_NOT_FOUND
+        )
+
+    arrival, data = found
+    if data is None:
+        raise HTTPException(detail="The keyframe could not be decoded", status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    return Response(
+        content=data,
+        media_type="video/h264" if format == "h264" else "image/jpeg",
+        headers={ "X-Keyframe-Time": str(arrival), "Cache-Control": "no-cache" }
+    )
+
 @frontend_router.post("/drone/takeoff")
 def handle(drone: DroneModel):
     """Flag a drone to take off.
@@ -222,6 +334,9 @@ def handle(drone: DroneModel):
     
     # Now the drone should take off.
     drone.should_takeoff = True
+
+    # Tell the relay right away, if it has a command channel. Otherwise it polls `/drone/should_takeoff`.
+    command_channels.push(relay.name, drone.name, TAKEOFF)
  
     return { "message": "ok"}
 
@@ -279,6 +394,9 @@ def handle(drone: DroneModel):
     # Now the drone should land.
     drone.should_land = True
 
+    # Tell the relay right away, if it has a command channel. Otherwise it polls `/drone/should_land`.
+    command_channels.push(relay.name, drone.name, LAND)
+
     return { "message": "ok"}
 
 
@@ -286,11 +404,15 @@ def handle(drone: DroneModel):
 def handle(cmd_model: NewCMDModel):
     """Updates new command to a drones command queue.
 
+    The newest command of a client wins. A command with an `issued` time older than the last command of the same
+    `client` (the requests of a client can overtake each other) is dropped.
+
     Args:
         cmd_model (NewCMDModel): A NewCMDModel object representing the new command to send to the drone.
 
     Raises:
         HTTPException with status code 404: If the specified relay or drone is not found.
+        HTTPException with status code 409: If a newer command from the same client was already received.
         HTTPException with status code 425: If the specified drone is not airborn.
 
     Returns:
@@ -332,7 +454,380 @@ def handle(cmd_model: NewCMDModel):
             detail="Drone is not airborn"
         )
 
-    # Update the drones command queue.
-    drone.cmd_queue = cmd
+    # Update the drones command queue. Wakes the relay if it is long-polling `/cmd_queue`.
+    if not drone.set_cmd_queue(cmd, cmd_model.client, cmd_model.issued):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A newer command was already received"
+        )
+
+    # Tell the relay right away, if it has a command channel. Otherwise it polls `/cmd_queue`.
+    command: dict[str, any] = drone.command()
+    command_channels.push(relay.name, drone.name, RC, cmd=command["rc"], version=command["version"],
+                          issued=command["issued"])
 
     return { "message": "OK" }
+
+@frontend_router.post("/drone/video/subscribe")
+def handle(drone: DroneModel):
+    """Issues a ticket for subscribing to a drone's video stream.
+
+    The viewer sends `SUB <ticket>` over UDP to the video port to subscribe, and `UNSUB` to unsubscribe.
+    See `drone_video_stream.py` for more detail.
+
+    Args:
+        drone (DroneModel): A DroneModel object representing the drone to watch.
+
+    Raises:
+        HTTPException with status code 404: If the specified relay, drone or video stream is not found.
+
+    Returns:
+        JSON containing the video port and a one-time ticket.
+    """
+    # Check if relay (drone.parent) is a valid/active relay
+    if drone.parent not in active_relays.keys():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Relay not found"
+        )
+
+    # Get relay object
+    relay: object = active_relays[drone.parent]
+
+    # Check if drone (drone.name) is valid/active drone
+    if drone.name not in relay.drones.keys():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Drone not found",
+        )
+
+    # Get the video stream of the drone
+    session: tuple[str, str] = (relay.name, drone.name)
+    if session not in active_sessions:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Video stream not found",
+        )
+
+    port: int = active_sessions[session].video_port
+    ticket: str = active_sessions[session].issue_ticket()
+
+    return { "video_port": port, "ticket": ticket }
+
+
+@frontend_router.get("/drone/video/stats")
+def handle(relay: str, drone: str):
+    """Returns the quality of service metrics and counters of a drone's video stream.
+
+    Args:
+        relay (str): A query parameter. The name of the relay the drone is connected to.
+        drone (str): A query parameter. The name of the drone.
+
+    Raises:
+        HTTPException(status_code=404): If the drone has no video stream.
+
+    Returns:
+        JSON containing the state of the session (see `video_sessions.py`), the metrics of the video from the
+        relay and of its transport (see `video_metrics.py`), and the counters of the parser, GOP cache, every
+        viewer's queue, the recorder and the HLS packager.
+
+    Example:
+        >>> { "state": "streaming", "metrics": { "packets_per_second": 270.2, "jitter_ms": 2.1, ... },
+        ...   "transport": { "loss_rate": 0.0037, "reorder_depth": 2, "delay_trend_ms_per_second": 3.5, ... },
+        ...   "subscribers": { "192.168.137.1:52222": { "send_failures": 5, ... } }, ... }
+    """
+    session: tuple[str, str] = (relay, drone)
+    if session not in active_sessions:
+        raise HTTPException(
+            detail=f"{drone} on {relay} does not exist or has no video",
+            status_code=status.HTTP_404_NOT_FOUND
+        )
+
+    return { "state": session_manager.state(session), **active_sessions[session].stats() }
+
+
+@frontend_router.websocket("/drone/video/{relay_name}/{drone_name}")
+async def handle(websocket: WebSocket, relay_name: str, drone_name: str, token: str | None = None):
+    """A WebSocket that sends a drone's video to a browser.
+
+    Every binary message is one H.264 frame with its length in front of it. See `video_websocket.py` for more detail.
+
+    Args:
+        websocket (WebSocket): The WebSocket of the browser.
+        relay_name (str): The name of the relay the drone is connected to.
+        drone_name (str): The name of the drone to watch.
+        token (str | None): A query parameter with the access token (`Bearer xxx` or just `xxx`).
+            Browsers cannot set headers on a WebSocket, so the `access_token` cookie is used if it is left out.
+
+    Note:
+        The WebSocket is closed with code 1008 if the user is not authorized, and 1011 if there is no such video stream
+        or its video is forwarded by worker processes (see `VIDEO_WORKERS` in `config.py`).
+    """
+    # Authorize the user like `middleware.py` does. The middleware only handles HTTP.
+    access_token: str | None = token or websocket.cookies.get('access_token')
+    if access_token is not None and access_token.startswith("Bearer"):
+        access_token = access_token.split("Bearer ")[-1]
+
+    if (
+        not access_token
+        or access_token in blacklisted_tokens.values()
+        or not is_user_authorized(access_token, blacklisted_tokens)
+    ):
+        await websocket.close(code=1008)
+        return
+
+    # Get the video stream of the drone
+    session: tuple[str, str] = (relay_name, drone_name)
+    if session not in active_sessions:
+        await websocket.close(code=1011)
+        return
+
+    # Video forwarded by worker processes never reaches this process, so there are no frames to send.
+    if not isinstance(active_sessions[session].engine, VideoEngine):
+        await websocket.close(code=1011)
+        return
+
+    await websocket.accept()
+    viewer: WebSocketViewer = WebSocketViewer(websocket, active_sessions[session])
+    await viewer.start()
+
+    # The browser sends nothing. Wait until it disconnects.
+    try:
+        while True:
+            await websocket.receive_bytes()
+
+    except (WebSocketDisconnect, RuntimeError, KeyError):
+        pass
+
+    finally:
+        await viewer.stop()
+
+
+@frontend_router.get("/drone/recording/segments")
+def handle(relay: str, drone: str):
+    """Lists the recorded segments of a drone's video.
+
+    Args:
+        relay (str): A query parameter. The name of the relay the drone is connected to.
+        drone (str): A query parameter. The name of the drone.
+
+    Returns:
+        JSON containing every segment, oldest first, with when it starts and its size in bytes.
+
+    Example:
+        >>> { "segments": [ { "name": "20240521-101502.250", "start": 1716286502.25, "size": 268435456 }, ... ] }
+    """
+    directory: str = recording_directory(relay, drone)
+    return {
+        "segments": [
+            {
+                "name": name,
+                "start": segment_start(name),
+                "size": os.path.getsize(os.path.join(directory, name + '.h264'))
+            }
+            for name in list_segments(directory)
+        ]
+    }
+
+@frontend_router.get("/drone/recording/seek")
+def handle(relay: str, drone: str, timestamp: float):
+    """Finds the last keyframe at or before a time in a drone's recording, so playback can start there.
+
+    Args:
+        relay (str): A query parameter. The name of the relay the drone is connected to.
+        drone (str): A query parameter. The name of the drone.
+        timestamp (float): A query parameter. The time to seek to (seconds since 1970).
+
+    Raises:
+        HTTPException(status_code=404): If nothing was recorded of the drone.
+
+    Returns:
+        JSON containing the segment, the time of the keyframe and its offset in the segment.
+        Get the video from there with `/drone/recording/segment` and `Range: bytes=<offset>-`.
+
+    Example:
+        >>> { "segment": "20240521-101502.250", "timestamp": 1716286599.75, "offset": 14123008 }
+    """
+    found: tuple[str, float, int] | None = seek_recording(recording_directory(relay, drone), timestamp)
+    if found is None:
+        raise HTTPException(
+            detail=f"Nothing was recorded of {drone} on {relay}",
+            status_code=status.HTTP_404_NOT_FOUND
+        )
+
+    name, arrival, offset = found
+    return { "segment": name, "timestamp": arrival, "offset": offset }
+
+@frontend_router.get("/drone/recording/segment")
+def handle(relay: str, drone: str, name: str, range_header: str | None = Header(default=None, alias="Range")):
+    """Sends a recorded segment of a drone's video (raw H.264), or the range of bytes in the `Range` header.
+
+    Args:
+        relay (str): A query parameter. The name of the relay the drone is connected to.
+        drone (str): A query parameter. The name of the drone.
+        name (str): A query parameter. The name of the segment, see `/drone/recording/segments`.
+        range_header (str | None): The `Range` header, for example `bytes=14123008-`.
+
+    Raises:
+        HTTPException(status_code=404): If there is no such segment.
+        HTTPException(status_code=416): If the range is malformed or not within the segment.
+
+    Returns:
+        The bytes of the segment. Status code 206 if a range was asked for.
+    """
+    # Only names that are in the directory, so the name cannot point outside of it.
+    directory: str = recording_directory(relay, drone)
+    if name not in list_segments(directory):
+        raise HTTPException(
+            detail=f"{name} was not recorded of {drone} on {relay}",
+            status_code=status.HTTP_404_NOT_FOUND
+        )
+
+    # The recorder could not create its index, so it is not a segment that can be played.
+    try:
+        segment: Segment = Segment(os.path.join(directory, name))
+    except FileNotFoundError:
+        raise HTTPException(
+            detail=f"{name} was not recorded of {drone} on {relay}",
+            status_code=status.HTTP_404_NOT_FOUND
+        )
+    size: int = len(segment.data)
+    try:
+        byte_range: tuple[int, int] | None = parse_range(range_header, size)
+    except ValueError as error:
+        segment.close()
+        raise HTTPException(
+            detail=str(error),
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+
+    start, end = byte_range if byte_range is not None else (0, size - 1)
+
+    def read():
+        # Straight from the memory map, so only the pages that are sent are read from disk.
+        try:
+            for position in range(start, end + 1, 1024 * 1024):
+                yield segment.data[position:min(position + 1024 * 1024, end + 1)]
+        finally:
+            segment.close()
+
+    headers: dict[str, str] = { "Accept-Ranges": "bytes", "Content-Length": str(end + 1 - start) }
+    if byte_range is not None:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    return StreamingResponse(
+        read(),
+        status_code=status.HTTP_206_PARTIAL_CONTENT if byte_range is not None else status.HTTP_200_OK,
+        media_type="video/h264",
+        headers=headers
+    )
+
+@frontend_router.get("/drone/hls")
+def handle(relay: str, drone: str, file: str):
+    """Sends the HLS playlists and segments of a drone's video, for a browser player (for example hls.js).
+
+    Args:
+        relay (str): A query parameter. The name of the relay the drone is connected to.
+        drone (str): A query parameter. The name of the drone.
+        file (str): A query parameter. `live.m3u8` to watch live, `vod.m3u8` for everything since the drone
+            connected, or a segment named in one of them.
+
+    Raises:
+        HTTPException(status_code=404): If there is no such file.
+
+    Note:
+        The playlists name the segments with this route, so the player sends the same access token for them.
+    """
+    # Only the names the packager writes, so the name cannot point outside of the drone's directory.
+    if not re.fullmatch(r'(live|vod)\.m3u8|segment_\d{5}\.ts', file):
+        raise HTTPException(detail=f"No such file: {file}", status_code=status.HTTP_404_NOT_FOUND)
+
+    path: str = os.path.join(recording_directory(relay, drone, root=VIDEO_HLS_DIRECTORY), file)
+    if not os.path.isfile(path):
+        raise HTTPException(detail=f"No such file: {file}", status_code=status.HTTP_404_NOT_FOUND)
+
+    # The playlists change as the stream runs. The segments never do.
+    if file.endswith(".m3u8"):
+        return FileResponse(path, media_type="application/vnd.apple.mpegurl", headers={ "Cache-Control": "no-cache" })
+    return FileResponse(path, media_type="video/mp2t")
+
+@frontend_router.get("/video/bandwidth")
+def handle():
+    """Returns the bandwidth limits on video sent to viewers, and how full their buckets are.
+
+    The limits are in bytes per second, 0 is no limit. See `bandwidth.py` for more detail.
+
+    Returns:
+        JSON containing the bucket of all video, of every relay, and of every drone's video stream.
+
+    Example:
+        >>> { "global": { "rate": 0, "burst": 0, "tokens": 0, "fill": None, "dropped_frames": 0 },
+        ...   "relays": { "relay_0001": { "rate": 1250000, "burst": 625000, "fill": 0.66, ... } },
+        ...   "streams": { "relay_0001": { "drone_001": { "rate": 0, ... } } } }
+    """
+    streams: dict[str, dict[str, dict]] = {}
+    for (relay_name, drone_name), session in list(active_sessions.items()):
+        streams.setdefault(relay_name, {})[drone_name] = session.bucket.stats()
+
+    return {
+        "global": global_bucket.stats(),
+        "relays": { name: bucket.stats() for name, bucket in list(relay_buckets.items()) },
+        "streams": streams,
+    }
+
+@frontend_router.post("/video/bandwidth")
+def handle(limit: BandwidthLimitModel):
+    """Changes a bandwidth limit on video sent to viewers. The bucket starts full.
+
+    Without `relay_name` the limit is on all video, with only `relay_name` on the video of every drone of that
+    relay, and with both on the video of that drone.
+
+    Args:
+        limit (BandwidthLimitModel): The new limit in bytes per second (0 is no limit), and optionally the most
+            bytes the bucket holds. See `models.py` for more detail.
+
+    Raises:
+        HTTPException(status_code=400): If `drone_name` is given without `relay_name`, or the limit is negative.
+        HTTPException(status_code=404): If the relay is not online, or the drone has no video stream.
+
+    Returns:
+        JSON containing the bucket with its new limit.
+    """
+    # Find the bucket.
+    if limit.relay_name is None:
+        if limit.drone_name is not None:
+            raise HTTPException(
+                detail="drone_name needs a relay_name",
+                status_code=status.HTTP_400_BAD_REQUEST
+            )
+        bucket: TokenBucket = global_bucket
+
+    elif limit.drone_name is None:
+        # Only relays that are online, so a typo does not make a bucket that nothing ever uses.
+        if limit.relay_name not in active_relays.keys():
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Relay not found"
+            )
+        bucket: TokenBucket = relay_bucket(limit.relay_name)
+
+    else:
+        session: object | None = active_sessions.get((limit.relay_name, limit.drone_name))
+        if session is None:
+            raise HTTPException(
+                detail=f"{limit.drone_name} has no video stream",
+                status_code=status.HTTP_404_NOT_FOUND
+            )
+        bucket: TokenBucket = session.bucket
+
+    # Change its limit.
+    try:
+        bucket.set_limit(limit.rate, limit.burst)
+    except ValueError as error:
+        raise HTTPException(
+            detail=str(error),
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+
+    return bucket.stats()
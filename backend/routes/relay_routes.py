@@ -5,8 +5,11 @@ This module defines the FastAPI routes and handlers for the drone relay URLs, in
 Routes:
     - /handshake: Handle the handshake process between a relay and the backend.
     - /heartbeat:
-    - /cmd_queue:
-    - /new_drone: Add a new drone to an existing relay. Returns an available video port for video streaming.
+    - /sync: Uploads the status of every drone of a relay and refreshes its heartbeat, and returns what changed
+      for its drones since the last sync.
+    - /cmd_queue: Returns the command queue of a drone, at once or when it changes (long-poll).
+    - /new_drone: Add a new drone to an existing relay. Returns an available video port for video streaming,
+      or the multiplexed ingest port and a stream id.
     - /drones: Returns information about all drones currently connected to a relay.
     - /drone/status_information:
     - /drone/should_land:
@@ -14,24 +17,28 @@ Routes:
     - /drone/should_takeoff:
     - /drone/successful_takeoff:
     - /drone/disconnected: Remove a drone from a relay and close the socket connection with the drone.
+    - /commands: A WebSocket that pushes the takeoffs, landings and rc commands of a relay's drones to it.
+
+Every route reads and writes MessagePack bodies instead of JSON if the relay asks for it. See `wire_format.py`.
 
 Note: 
     The code in this module is not a complete implementation of the Drone Relay service. Some parts have been omitted or simplified for clarity.
 '''
 
 # Default Python
-import threading, time, copy
+import asyncio, threading, time, copy
 
 # FastAPI
 from fastapi import (
     HTTPException, 
     APIRouter,
     status, 
-    Depends 
+    Depends,
+    WebSocket
 )
 
 # For JWT token.
-from helper_functions import generate_access_token
+from helper_functions import decode_access_token, generate_access_token
 
 # Database. This is how to use MongoBD.
 from mongodb_handler import get_mongo
@@ -41,18 +48,43 @@ from models import (
     DroneModel, 
     RelayHandshakeModel, 
     RelayHeartbeatModel, 
+    RelaySyncModel,
     DroneStatusInformationModel
 )
 
+# MessagePack bodies for the relays that ask for them.
+from wire_format import MessagePackRoute, NegotiatedResponse
+
 # Own Relay class
 from relaybox import Relay
 
 # Own class for drone video
 from drone_video_stream import DroneVideoStream
 
-relay_router = APIRouter()
+# Opens, tracks, reclaims and reaps the video sessions.
+from video_sessions import session_manager
+
+# Pushes commands to the relays over a WebSocket.
+from command_channel import LAND, RC, TAKEOFF, RelayChannel, command_channels
+
+# Worker processes for the video ingest port.
+from video_workers import get_video_workers
+
+# The bandwidth limit on the video of every relay.
+from bandwidth import relay_bucket
+
+# The largest group of video datagrams the relay may send a parity datagram for.
+from fec import MAX_GROUP_SIZE
+
+# Where a drone's video is recorded.
+from recorder import recording_directory
+from urllib.parse import urlencode
+
+from config import CMD_QUEUE_LONG_POLL_TIMEOUT, VIDEO_HLS, VIDEO_HLS_DIRECTORY, VIDEO_RECORDING, VIDEO_WORKERS
+
+relay_router = APIRouter(route_class=MessagePackRoute, default_response_class=NegotiatedResponse)
 active_relays: dict[str, Relay] = {}
-active_sessions: dict[int, DroneVideoStream] = {}
+active_sessions: dict[tuple[str, str], DroneVideoStream] = session_manager.sessions # By `(relay name, drone name)`.
 
 
 
@@ -131,25 +163,123 @@ def handle(relay: RelayHeartbeatModel):
     print(f"(!) Heartbeat from {relay.name} | timestamp {utc}")
     print(f"(!) Retrieving all data related to {relay.name}")
 
+    # The public attributes of every drone. The private ones (like the lock of its command queue) are not JSON.
+    # The publisher token is only ever sent by `/new_drone`, since anyone can send a heartbeat for the relay.
+    drones: dict[str, dict[str, any]] = {
+        name: {key: value for key, value in vars(drone).items() if not key.startswith('_') and key != 'publisher_token'}
+        for name, drone in list(relay.drones.items())
+    }
+
     return { "message": f"Hello {relay.name}",
-             f"{relay.name}": {"drones": relay.drones} }
+             f"{relay.name}": {"drones": drones} }
+
+@relay_router.post("/sync")
+def handle(relay: RelaySyncModel):
+    """Syncs a relay with the backend, in one request for all of its drones.
+
+    Instead of a heartbeat and, for every drone, a stream of status updates and polls of `/cmd_queue`,
+    `/drone/should_land` and `/drone/should_takeoff`, a relay can call this many times a second. It uploads
+    the newest status of its drones and refreshes the heartbeat. It gets back only what changed:
+        - `rc`, `version` and `issued`: The command queue of a drone, if it is newer than the version the relay
+          sent, and when the backend got it.
+        - `takeoff` and `land`: If a drone should take off or land. Like the polls, these are only sent once.
+        - `members`: The names of the relay's drones, if a drone was added or removed since the `membership`
+          the relay sent. The newest `membership` is always sent.
+        - `time`: The time of the backend, so the relay can tell how old a command is by the backend's clock.
+
+    Arguments:
+        relay (RelaySyncModel): The name of the relay, the newest status of its drones by name, the versions of
+            the command queues it has seen by name, and the membership it has seen. Also how old (ms) the rc
+            commands it got since its last sync were, and how many it dropped for being too old, by name.
+
+    Raises:
+        HTTPException(status_code=404): If the relay name does not exist or is not online.
+
+    Returns:
+        JSON containing what changed, by drone. Drones without changes are left out.
+
+    Example:
+        >>> { "drones": { "drone_001": { "rc": [0, 20, 0, 0], "version": 41, "issued": 1718000000.25 },
+        ...               "drone_002": { "land": true } },
+        ...   "membership": 7, "time": 1718000000.31 }
+    """
+    # Check if relay is a valid/active relay.
+    if relay.name not in active_relays.keys():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Relay not found",
+    )
+
+    sync: RelaySyncModel = relay
+    relay: Relay = active_relays[sync.name]
+
+    # Refresh the heartbeat, like `/heartbeat`.
+    relay.last_heartbeat_received: int = int(time.time())
+
+    changes: dict[str, dict[str, any]] = {}
+    for name, drone in list(relay.drones.items()):
+        # Update the drone with its newest status, like `/drone/status_information`.
+        status_information: str | None = sync.statuses.get(name)
+        if status_information is not None:
+            drone.status_information: str = status_information
+
+        # How old the commands were when the relay got them.
+        for age in sync.ages.get(name, ()):
+            drone.command_age.add(age)
+        if sync.stale.get(name):
+            drone.command_age.add_stale(sync.stale[name])
+
+        change: dict[str, any] = {}
+
+        # A command the relay has not seen.
+        command: dict[str, any] = drone.command()
+        if sync.versions.get(name) != command["version"]:
+            change.update(command)
+
+        # Sent once, like `/drone/should_takeoff` and `/drone/should_land`.
+        if drone.should_takeoff:
+            drone.should_takeoff = False
+            change["takeoff"] = True
+
+        if drone.should_land:
+            drone.should_land = False
+            change["land"] = True
+
+        if change:
+            changes[name] = change
+
+    response: dict[str, any] = { "drones": changes, "membership": relay.membership, "time": time.time() }
+
+    # The relay has not seen the newest membership.
+    if sync.membership != relay.membership:
+        response["members"] = list(relay.drones)
+
+    return response
 
 @relay_router.get('/cmd_queue')
-def handle(drone: DroneModel):
+async def handle(drone: DroneModel, version: int | None = None, wait: float = CMD_QUEUE_LONG_POLL_TIMEOUT):
     """Returns the command queue of a drone linked to the relay.
 
+    With `version` it is a long-poll: the request is held until the command queue is newer than that version,
+    or `wait` seconds have passed. It waits on the event loop, so it holds no worker thread. Relays behind
+    proxies that do not allow the WebSocket `/commands` use it instead of polling over and over.
+
     Arguments:
         drone (DroneModel): A data model representing the drone making the request.
+        version (int | None): A query parameter with the last version of the command queue the relay saw.
+            Answers at once if it is left out.
+        wait (float): A query parameter with the most seconds to hold the request. At most
+            `CMD_QUEUE_LONG_POLL_TIMEOUT`.
 
     Raises:
         HTTPException(status_code=400): If the drone's parent (relay) does not exist or is not online.
         HTTPException(status_code=409): If the drone does not exist in the relay drones list.
 
     Returns:
-        JSON containing the drone's command queue.
+        JSON containing the drone's command queue, its version, and when the backend got it.
     
     Example:
-        >>> { "message": "[0,0,0,0]" }
+        >>> { "message": "[0,0,0,0]", "version": 41, "issued": 1718000000.25 }
     """
     # Check if relay (drone.parent) is a valid/active relay.
     if drone.parent not in active_relays.keys():
@@ -170,21 +300,40 @@ def handle(drone: DroneModel):
     # Find that drone object now
     drone: object = relay.drones[drone.name]
 
-    return { "message": drone.cmd_queue }
+    # Wait for a newer command, if the relay has seen this one.
+    if version is not None:
+        await drone.wait_for_cmd_queue(version, max(0, min(wait, CMD_QUEUE_LONG_POLL_TIMEOUT)))
+
+    command: dict[str, any] = drone.command()
+
+    # A relay that polls does not say how old its commands are, so count how old they are when handed over.
+    if version is not None and version != command["version"]:
+        drone.command_age.add((time.time() - command["issued"]) * 1000)
+
+    return { "message": command["rc"], "version": command["version"], "issued": command["issued"] }
 
 @relay_router.get("/new_drone")
-def handle(drone: DroneModel):
+def handle(drone: DroneModel, mux: bool = False, fec: int = 0):
     """Add a new drone to an existing relay. Returns an available video port for video streaming.
 
     Arguments:
         drone (DroneModel): A DroneModel representing a drone.
+        mux (bool): A query parameter. If `True` the relay sends the video to the multiplexed ingest port,
+            with the returned stream id in the header of every datagram (see `video_header.py`).
+        fec (int): A query parameter. If not 0 the relay sends a parity datagram after every `fec` video
+            datagrams, and the backend rebuilds single lost datagrams from it (see `fec.py`). Only when multiplexed.
 
     Raises:
         HTTPException(status_code=400): If the relay name does not exist or is not online.
+        HTTPException(status_code=400): If `fec` is not from 0 to `MAX_GROUP_SIZE`.
 
     Returns:
-        JSON containing the video port number for the drone's video stream.
+        JSON containing the video port number for the drone's video stream, its stream id
+        (`null` if the drone has a video port of its own), and the token the relay sends with `RTS`
+        to become the publisher (see `drone_video_stream.py`).
 
+    Example:
+        >>> { "video_port": 52221, "stream_id": 2914087253, "publisher_token": "Xk3v9QbF2mT0cHq7LwR1sA" }
     """
     # Check if drones parent (relay) is not online/exist.
     if drone.parent not in active_relays.keys():
@@ -192,30 +341,69 @@ def handle(drone: DroneModel):
             detail=f"{drone.parent} does not exist or is not online",
             status_code=status.HTTP_400_BAD_REQUEST
         )
+
+    # Check that the parity groups are ones the backend can decode.
+    if not 0 <= fec <= MAX_GROUP_SIZE:
+        raise HTTPException(
+            detail=f"fec must be from 0 to {MAX_GROUP_SIZE}",
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
     
+    # Find that relay object now.
+    relay: Relay = active_relays[drone.parent]
+    session_key: tuple[str, str] = (relay.name, drone.name)
+
     # Check if drone name already exist in the relay drones list
-    if drone.name in active_relays[drone.parent].drones:
+    if drone.name in relay.drones:
+        existing: object = relay.drones[drone.name]
+        session: DroneVideoStream | None = active_sessions.get(session_key)
+
+        # The relay reconnected. Give it the session it had, if it asks for the same kind of video.
+        if (
+            session is not None
+            and (existing.stream_id is not None) == mux
+            and (session.fec.group_size if session.fec is not None else 0) == (fec if mux else 0)
+            and session_manager.reclaim(session_key) is session
+        ):
+            print(f"Relaybox reconnected, {drone.name} reclaimed its video session")
+            return { "video_port": existing.port, "stream_id": existing.stream_id, "publisher_token": existing.publisher_token }
+
         # Remove Exisiting Drone From the System
         print("Removing Existing Drone From System because of relaybox reconnect")
-        try:
-            disconnect_drone(relay, drone.name)
-        except Exception:
-            print("Exception")
-            active_relays[drone.parent].drones.pop(drone.name) #Manually remove drone from list as it has been disconnected
-        
-    # Find that relay object now.
-    relay: Relay = active_relays[drone.parent]
+        disconnect_drone(relay, drone.name)
 
     # Add new drone to relay and get available port
-    port: int = relay.add_drone(drone.name)
+    port: int = relay.add_drone(drone.name, multiplexed=mux)
+    stream_id: int | None = relay.drones[drone.name].stream_id
+    publisher_token: str = relay.drones[drone.name].publisher_token
+
+    # Create a Server instance which handles the video connection.
+    # Multiplexed streams are forwarded by the worker processes, if there are any.
+    engine: object | None = get_video_workers() if VIDEO_WORKERS and stream_id is not None else None
+    video_feed_instance: DroneVideoStream = session_manager.open(
+        session_key,
+        lambda: DroneVideoStream(
+            port,
+            engine=engine,
+            stream_id=stream_id,
+            fec_group_size=fec if stream_id is not None else 0,
+            relay_bucket=relay_bucket(relay.name),
+            publisher_token=publisher_token
+        )
+    )
 
-    # Create a Server instance which handles the video connection
-    video_feed_instance: DroneVideoStream = DroneVideoStream(port)
+    # Record the drone's video to disk, if that is turned on.
+    if VIDEO_RECORDING:
+        video_feed_instance.start_recording(recording_directory(relay.name, drone.name))
 
-    #Add object and port to dictionary
-    active_sessions[port]: dict[int, object] = video_feed_instance
+    # Package it as HLS for browser players, if that is turned on. See `/drone/hls` in `frontend_routes.py`.
+    if VIDEO_HLS:
+        video_feed_instance.start_hls(
+            recording_directory(relay.name, drone.name, root=VIDEO_HLS_DIRECTORY),
+            uri_prefix=f"hls?{urlencode({ 'relay': relay.name, 'drone': drone.name })}&file="
+        )
 
-    return { "video_port": port }
+    return { "video_port": port, "stream_id": stream_id, "publisher_token": publisher_token }
 
 @relay_router.post("/drones")
 def handle(relay: RelayHandshakeModel):
@@ -383,6 +571,9 @@ def handle(drone: DroneModel):
     # The drone is now longer airborn.
     drone.airborn: bool = False
 
+    # A landing pushed over `/commands` is pending until now.
+    drone.should_land = False
+
     return { "message": "OK"}
 
 @relay_router.get('/drone/should_takeoff')
@@ -470,6 +661,12 @@ def handle(drone: DroneModel):
 
     # The drone is now airborn.
     drone.airborn: bool = True
+
+    # A takeoff pushed over `/commands` is pending until now.
+    drone.should_takeoff = False
+
+    # Hover until the user sends a command, instead of flying by the last one of the previous flight.
+    drone.reset_cmd_queue()
     
     # This is a return statement. This return statements returns a message. This message is a dict in a format of JSON. The JSON format is a one key-val pair. The key is "message". The val is "OK". This is again a return statement. Please understand that this returns a statement.👌
     return { "message": "OK" }
@@ -509,7 +706,72 @@ def handle(drone: DroneModel):
     disconnect_drone(relay, drone.name)
 
     return { "message": "OK" }
-    
+
+
+@relay_router.websocket("/commands")
+async def handle(websocket: WebSocket, token: str | None = None):
+    """A WebSocket that pushes the takeoffs, landings and rc commands of a relay's drones to it.
+
+    See `command_channel.py` for the messages. The relay sends nothing on it. While it is open, the relay does
+    not have to poll `/cmd_queue`, `/drone/should_land` and `/drone/should_takeoff`, which stay for relays
+    without it.
+
+    Args:
+        websocket (WebSocket): The WebSocket of the relay.
+        token (str | None): A query parameter with the access token from `/handshake` (`Bearer xxx` or just
+            `xxx`). The `Authorization` header is used if it is left out.
+
+    Note:
+        The WebSocket is closed with code 1008 if the relay is not authorized, and 1011 if it has not handshaked.
+    """
+    # Authorize the relay like `middleware.py` does. The middleware only handles HTTP.
+    access_token: str | None = token or websocket.headers.get('authorization')
+    if access_token is not None and access_token.startswith("Bearer"):
+        access_token = access_token.split("Bearer ")[-1]
+
+    payload: object = decode_access_token(access_token) if access_token else None
+    if not isinstance(payload, dict) or payload.get('sub') is None:
+        await websocket.close(code=1008)
+        return
+
+    # The access token is for the relay with this name.
+    relay_name: str = payload['sub']
+    if relay_name not in active_relays:
+        await websocket.close(code=1011)
+        return
+
+    await websocket.accept()
+    channel: RelayChannel = RelayChannel(websocket)
+    command_channels.connect(relay_name, channel)
+    print(f"Relaybox {relay_name} opened its command channel")
+
+    # Send what was set while the relay polled, so it is not missed.
+    for drone in list(active_relays[relay_name].drones.values()):
+        if drone.should_takeoff:
+            channel.send({ "drone": drone.name, "type": TAKEOFF })
+        if drone.should_land:
+            channel.send({ "drone": drone.name, "type": LAND })
+        if drone.airborn:
+            command: dict[str, any] = drone.command()
+            channel.send({ "drone": drone.name, "type": RC, "cmd": command["rc"], "version": command["version"],
+                           "issued": command["issued"] })
+
+    async def receive() -> None:
+        while True:
+            await websocket.receive_text()
+
+    # Until the relay disconnects, or sending to it fails.
+    tasks: list[asyncio.Task] = [asyncio.ensure_future(channel.run()), asyncio.ensure_future(receive())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+
+    finally:
+        command_channels.disconnect(relay_name, channel)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        print(f"Relaybox {relay_name} closed its command channel")
+
 def timeout_check(relay: Relay) -> None:
     """Periodically checks whether a relay has timed out and removes all drones connected to the relay.
 
@@ -551,28 +813,13 @@ def disconnect_drone(relay: Relay, drone_name: str) -> dict:
     Returns:
         A dict containing a message confirming the removal of the drone.
     """
-    # Find the specific port belonging to a drone.
-    PORT: int = relay.drones[drone_name].port
-
-    #Find the specific server object in session dictionary: {'port': objectId}.
-    drone_video_stream: DroneVideoStream = active_sessions[PORT]
-
-    #Close Socket in the server session
-    try:
-        print(f"Closing Socket belonging to {drone_video_stream}\n")
-        drone_video_stream.active = False #Stop all continued processing
-        drone_video_stream.socket.close() #Close the socket and handle exceptions in object
-    except:
-        print("Could not close socket in Video Server Instance")
-
-    #Delete Server Session Object
-    del drone_video_stream
-
-    #Remove session from dictionary
-    active_sessions.pop(PORT)
+    # Close the drone's video session, if it still has one (it may have been reaped).
+    SESSION: tuple[str, str] = (relay.name, drone_name)
+    print(f"Closing the video session of {SESSION}\n")
+    session_manager.close(SESSION)
     print(f"Active Relays: {active_relays.keys()} \nActive Sessions: {active_sessions.keys()}\n")
     
     # Delete the drone object on relay drones
-    del relay.drones[drone_name]
+    relay.remove_drone(drone_name)
 
     return { "message": f"Deleted {drone_name} on {relay.name}"}
@@ -0,0 +1,162 @@
+'''Still images of the drones' video, for overviews and inspection reports.
+
+The last keyframe of every stream is kept by its `GopCache` (see `gop_cache.py`). A snapshot is that
+keyframe with the SPS and PPS in front of it, so any H.264 decoder can decode one picture from it, straight
+from memory without joining the stream.
+
+If OpenCV is installed, a snapshot can also be decoded into a JPEG. Decoding is slow and holds the GIL, so
+it is done in a worker process, never in the API process. A snapshot is only decoded once per keyframe:
+requests for the same keyframe wait for the same decode, so many dashboards polling one drone cost one
+decode per keyframe.
+
+Classes:
+    SnapshotCache: The last snapshot of every stream, and its JPEG.
+
+Functions:
+    decode_jpeg: Decodes a snapshot into a JPEG with OpenCV. Runs in the worker process.
+'''
+
+# Default Python
+import concurrent.futures, importlib.util, multiprocessing, os, tempfile, threading, weakref
+
+from h264 import AccessUnit
+
+# If OpenCV is installed. It is only imported in the worker process.
+OPENCV_AVAILABLE: bool = importlib.util.find_spec('cv2') is not None
+
+# The most seconds a request waits for a JPEG.
+_DECODE_TIMEOUT: float = 5
+
+
+def decode_jpeg(bundle: bytes) -> bytes | None:
+    """Decodes a snapshot into a JPEG with OpenCV. Runs in the worker process.
+
+    Args:
+        bundle (bytes): The keyframe with the SPS and PPS in front of it, in Annex B format.
+
+    Returns:
+        bytes | None: The JPEG, or `None` if the keyframe could not be decoded.
+    """
+    import cv2
+
+    # OpenCV only decodes video from files.
+    descriptor, path = tempfile.mkstemp(suffix='.h264')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(bundle)
+
+        capture = cv2.VideoCapture(path)
+        success, image = capture.read()
+        capture.release()
+
+    finally:
+        os.remove(path)
+
+    if not success:
+        return None
+
+    success, jpeg = cv2.imencode('.jpg', image)
+    return jpeg.tobytes() if success else None
+
+
+class _Snapshot:
+    """The snapshot of one keyframe, and its JPEG once it is decoded."""
+    __slots__ = ('keyframe', 'bundle', 'jpeg')
+
+    def __init__(self, keyframe: AccessUnit, bundle: bytes) -> None:
+        self.keyframe: AccessUnit = keyframe
+        self.bundle: bytes = bundle
+        self.jpeg: concurrent.futures.Future | None = None
+
+
+class SnapshotCache:
+    """The last snapshot of every stream, and its JPEG.
+
+    Attributes:
+        decodes (int): JPEGs decoded. At most one per keyframe of every stream.
+    """
+
+    def __init__(self) -> None:
+        self.decodes: int = 0
+
+        # By stream, so the snapshot of a stream is forgotten with the stream.
+        self._snapshots: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._lock: threading.Lock = threading.Lock()
+        self._executor: concurrent.futures.ProcessPoolExecutor | None = None
+
+    def snapshot(self, stream: object) -> _Snapshot | None:
+        """Returns the snapshot of the last keyframe of a stream, or `None` if no keyframe has arrived.
+
+        Args:
+            stream (DroneVideoStream): The stream.
+        """
+        keyframe: AccessUnit | None = stream.gop_cache.keyframe
+        if keyframe is None:
+            return None
+
+        with self._lock:
+            snapshot: _Snapshot | None = self._snapshots.get(stream)
+            if snapshot is None or snapshot.keyframe is not keyframe:
+                snapshot = _Snapshot(keyframe, stream.gop_cache.keyframe_bundle())
+                self._snapshots[stream] = snapshot
+            return snapshot
+
+    def bundle(self, stream: object) -> tuple[float, bytes] | None:
+        """Returns the last keyframe of a stream, with the SPS and PPS in front of it.
+
+        Args:
+            stream (DroneVideoStream): The stream.
+
+        Returns:
+            tuple[float, bytes] | None: When the keyframe arrived (seconds since 1970) and the snapshot in
+                Annex B format, or `None` if no keyframe has arrived.
+        """
+        snapshot: _Snapshot | None = self.snapshot(stream)
+        if snapshot is None:
+            return None
+        return snapshot.keyframe.arrival, snapshot.bundle
+
+    def jpeg(self, stream: object, timeout: float = _DECODE_TIMEOUT) -> tuple[float, bytes | None] | None:
+        """Returns the last keyframe of a stream as a JPEG. Only decoded once per keyframe.
+
+        Args:
+            stream (DroneVideoStream): The stream.
+            timeout (float): The most seconds to wait for the decode.
+
+        Returns:
+            tuple[float, bytes | None] | None: When the keyframe arrived and the JPEG (`None` if it could not
+                be decoded), or `None` if no keyframe has arrived.
+
+        Raises:
+            RuntimeError: If OpenCV is not installed.
+            TimeoutError: If the decode took longer than `timeout`.
+        """
+        if not OPENCV_AVAILABLE:
+            raise RuntimeError("OpenCV is not installed")
+
+        snapshot: _Snapshot | None = self.snapshot(stream)
+        if snapshot is None:
+            return None
+
+        with self._lock:
+            if snapshot.jpeg is None:
+                if self._executor is None:
+                    # Spawned, so the worker does not inherit the sockets and threads of the API process.
+                    self._executor = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=1, mp_context=multiprocessing.get_context('spawn')
+                    )
+                snapshot.jpeg = self._executor.submit(decode_jpeg, snapshot.bundle)
+                self.decodes += 1
+            future: concurrent.futures.Future = snapshot.jpeg
+
+        return snapshot.keyframe.arrival, future.result(timeout)
+
+    def stop(self) -> None:
+        """Stop the worker process."""
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+# The cache of the API process.
+snapshot_cache: SnapshotCache = SnapshotCache()
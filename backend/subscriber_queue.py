@@ -0,0 +1,250 @@
+'''A queue with a latency budget for each viewer of a drone video stream.
+
+Video is sent to a viewer as soon as it arrives. If the viewer cannot take it right now (the socket's send
+buffer is full), it waits in the viewer's `SubscriberQueue` instead of being dropped at random, which would
+leave holes in the middle of frames. The queue is flushed as soon as the viewer can take more.
+
+A viewer that falls behind must not fall further and further behind, so the queue has a latency budget.
+When the oldest waiting datagram is older than the budget (or the queue is full), whole frames are dropped:
+    1. Frames that no other frame is predicted from (non-reference frames). Nothing else breaks.
+    2. If that is not enough, everything up to the next keyframe. The picture freezes until then,
+       instead of showing garbage.
+
+Other viewers of the stream are never held up, since each viewer has its own queue.
+
+Classes:
+    SubscriberQueue: The queue of one viewer.
+
+Functions:
+    datagram_sender: Returns a function that sends a datagram to a viewer without blocking.
+    starts_decoding: Returns `True` if a viewer can start decoding at a frame.
+'''
+
+# Default Python
+import time
+from collections import deque
+from typing import Callable
+
+from h264 import AccessUnit, NAL_SPS
+
+from config import VIDEO_LATENCY_BUDGET, VIDEO_SUBSCRIBER_QUEUE_DEPTH
+
+# The non-reference frames that were dropped and are remembered, so the rest of them is dropped as well. The
+# parser puts together at most two frames at a time, so only the last ones dropped can still grow.
+_MAX_DROPPED_FRAMES: int = 4
+
+
+def datagram_sender(transport: object, addr: tuple[str, int]) -> Callable[[bytes | memoryview], bool]:
+    """Returns a function that sends a datagram to `addr` on `transport` without blocking.
+
+    Args:
+        transport (object): The transport of the video socket.
+        addr (tuple[str, int]): The IP address and port number of the viewer.
+
+    Returns:
+        Callable[[bytes | memoryview], bool]: Returns `False` if the datagram was not sent because the
+            socket cannot take more right now.
+    """
+    # `DatagramSocketTransport` and `BatchedDatagramTransport` from the video engine.
+    try_sendto = getattr(transport, 'try_sendto', None)
+    if try_sendto is not None:
+        return lambda data: try_sendto(data, addr)
+
+    # asyncio's transport keeps what the socket does not take in a buffer of its own.
+    # Only send when that buffer is empty, so the datagram waits in our queue instead.
+    if hasattr(transport, 'get_write_buffer_size'):
+        def send(data: bytes | memoryview) -> bool:
+            if transport.get_write_buffer_size():
+                return False
+            transport.sendto(data, addr)
+            return True
+        return send
+
+    def send(data: bytes | memoryview) -> bool:
+        transport.sendto(data, addr)
+        return True
+    return send
+
+
+def starts_decoding(frame: AccessUnit | None) -> bool:
+    """Returns `True` if a viewer can start decoding at this frame."""
+    return frame is not None and (frame.keyframe or NAL_SPS in frame.nal_types)
+
+
+class SubscriberQueue:
+    """The datagrams waiting to be sent to one viewer, with the frame each belongs to.
+
+    Attributes:
+        send (Callable[[bytes | memoryview], bool]): Sends a datagram. See `datagram_sender()`.
+        ready (Callable[[], bool] | None): Returns `False` while the viewer is still busy with the last datagram,
+            for viewers that take one at a time. Datagrams wait until then without counting as send failures.
+        since (float): When the viewer subscribed (seconds since 1970).
+        latency_budget (float): The most seconds a datagram may wait before frames are dropped.
+        max_depth (int): The most datagrams that may wait before frames are dropped.
+        sent (int): Datagrams sent.
+        dropped_frames (int): Frames (or parts of frames) that were dropped.
+        dropped_datagrams (int): Datagrams that were dropped.
+        max_queue_depth (int): The most datagrams that have been waiting at once.
+        send_failures (int): Times the viewer could not take a datagram, so it had to wait.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[bytes | memoryview], bool],
+        latency_budget: float = VIDEO_LATENCY_BUDGET,
+        max_depth: int = VIDEO_SUBSCRIBER_QUEUE_DEPTH,
+        ready: Callable[[], bool] | None = None
+    ) -> None:
+        self.send: Callable[[bytes | memoryview], bool] = send
+        self.ready: Callable[[], bool] | None = ready
+        self.since: float = time.time()
+        self.latency_budget: float = latency_budget
+        self.max_depth: int = max_depth
+        self.sent: int = 0
+        self.dropped_frames: int = 0
+        self.dropped_datagrams: int = 0
+        self.max_queue_depth: int = 0
+        self.send_failures: int = 0
+
+        # `(datagram, frame, when it was queued)`, oldest first.
+        self._items: deque[tuple[bytes, AccessUnit | None, float]] = deque()
+
+        # Set when everything up to the next keyframe was dropped, and it has not arrived yet.
+        # The last frame that was dropped may be a keyframe too. The rest of it is dropped as well.
+        self._waiting_for_keyframe: bool = False
+        self._dropped_frame: AccessUnit | None = None
+
+        # The non-reference frames dropped while they may still grow, oldest first. The rest of them is dropped too.
+        self._dropped_frames: dict[AccessUnit, None] = {}
+
+        # The frame of the last datagram that was sent. Its other datagrams are not dropped for being a
+        # non-reference frame, since the viewer would get only part of it.
+        self._sent_frame: AccessUnit | None = None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def push(self, data: bytes | memoryview, frame: AccessUnit | None = None) -> None:
+        """Send a datagram, or queue it if the viewer cannot take it right now.
+
+        Args:
+            data (bytes | memoryview): The datagram. Only copied if it has to wait.
+            frame (AccessUnit | None): The frame the datagram belongs to. `None` is never dropped
+                for being a non-reference frame.
+        """
+        if frame is not None and frame in self._dropped_frames:
+            self.dropped_datagrams += 1
+            return
+
+        if self._waiting_for_keyframe:
+            if frame is self._dropped_frame or not starts_decoding(frame):
+                self.dropped_datagrams += 1
+                return
+            self._waiting_for_keyframe = False
+            self._dropped_frame = None
+
+        # The fast path. Nothing is waiting, so the datagram can go right away.
+        if not self._items and (self.ready is None or self.ready()):
+            if self.send(data):
+                self.sent += 1
+                self._sent_frame = frame
+                return
+            self.send_failures += 1
+
+        self._items.append((bytes(data), frame, time.monotonic()))
+        if len(self._items) > self.max_queue_depth:
+            self.max_queue_depth = len(self._items)
+
+        self._trim()
+
+    def flush(self) -> bool:
+        """Send what is waiting, as far as the viewer can take it.
+
+        Returns:
+            bool: `True` if nothing is waiting anymore.
+        """
+        items = self._items
+        ready = self.ready
+        while items and (ready is None or ready()):
+            if not self.send(items[0][0]):
+                self.send_failures += 1
+                break
+            self._sent_frame = items.popleft()[1]
+            self.sent += 1
+
+        self._trim()
+        return not self._items
+
+    def _trim(self) -> None:
+        """Drop whole frames if the oldest datagram is over the latency budget, or the queue is full."""
+        items = self._items
+        if not items:
+            return
+
+        now: float = time.monotonic()
+        if len(items) <= self.max_depth and now - items[0][2] <= self.latency_budget:
+            return
+
+        # 1. Non-reference frames. No other frame needs them. Not the one the viewer already has a part of.
+        kept: deque[tuple[bytes, AccessUnit | None, float]] = deque()
+        dropped: set[int] = set()
+        sent_frame: AccessUnit | None = self._sent_frame
+        dropped_frames: dict[AccessUnit, None] = self._dropped_frames
+        for item in items:
+            frame = item[1]
+            if frame is not None and frame is not sent_frame and not frame.reference and not starts_decoding(frame):
+                if id(frame) not in dropped:
+                    dropped.add(id(frame))
+                    dropped_frames[frame] = None
+            else:
+                kept.append(item)
+
+        # Remember the frames, so the datagrams of them that have not arrived yet are dropped as well.
+        while len(dropped_frames) > _MAX_DROPPED_FRAMES:
+            del dropped_frames[next(iter(dropped_frames))]
+
+        self.dropped_datagrams += len(items) - len(kept)
+        items = self._items = kept
+
+        if not items or (len(items) <= self.max_depth and now - items[0][2] <= self.latency_budget):
+            self.dropped_frames += len(dropped)
+            return
+
+        # 2. Everything up to the next keyframe. The oldest frame is too old, even if it is a keyframe.
+        start: int | None = None
+        previous: AccessUnit | None = items[0][1]
+        for index in range(1, len(items)):
+            frame = items[index][1]
+            if frame is not previous and starts_decoding(frame):
+                start = index
+                break
+            previous = frame
+
+        if start is None:
+            start = len(items)
+            self._waiting_for_keyframe = True
+            self._dropped_frame = items[-1][1]
+
+        for _ in range(start):
+            _, frame, _ = items.popleft()
+            if frame is not None:
+                dropped.add(id(frame))
+            self.dropped_datagrams += 1
+
+        self.dropped_frames += len(dropped)
+
+    def stats(self) -> dict[str, int | float]:
+        """Returns the counters of the queue.
+
+        Example:
+            >>> { "queue_depth": 0, "max_queue_depth": 12, "sent": 9120, "send_failures": 5, "dropped_frames": 3,
+            ...   "dropped_datagrams": 14 }
+        """
+        return {
+            "queue_depth": len(self._items),
+            "max_queue_depth": self.max_queue_depth,
+            "sent": self.sent,
+            "send_failures": self.send_failures,
+            "dropped_frames": self.dropped_frames,
+            "dropped_datagrams": self.dropped_datagrams,
+        }
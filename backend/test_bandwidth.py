@@ -0,0 +1,94 @@
+'''A test file for the bandwidth limits on video sent to viewers.
+
+This file tests that a `TokenBucket` fills at its rate up to its burst, and that a `DroneVideoStream` drops
+whole frames when one of its buckets is empty: a non-reference frame alone, a reference frame with everything
+up to the next keyframe.
+'''
+
+import random
+
+import pytest
+
+from bandwidth import TokenBucket, relay_bucket
+from drone_video_stream import DroneVideoStream
+from video_engine import VideoEngine
+
+from benchmarks.h264_parser import nal_unit
+
+VIDEO_PORT = 45224
+RELAY = ('127.0.0.1', 50000)
+VIEWER = ('127.0.0.1', 50001)
+
+
+def test_refill():
+    bucket = TokenBucket(1000, 500)
+    assert bucket.tokens == 500
+
+    bucket.tokens = -200
+    assert bucket.refill(bucket._refilled + 0.1)
+    assert not bucket.refill(bucket._refilled + 0.2)
+    assert bucket.tokens == pytest.approx(100)
+    assert not bucket.refill(bucket._refilled + 10) and bucket.tokens == 500
+    assert TokenBucket(1000, 500).stats()['fill'] == 1
+
+    # No limit.
+    bucket.set_limit(0)
+    bucket.tokens = -200
+    assert not bucket.refill(bucket._refilled + 0.1)
+    assert bucket.stats()['fill'] is None
+
+    with pytest.raises(ValueError):
+        bucket.set_limit(-1)
+
+
+def test_relay_bucket_is_kept_by_name():
+    assert relay_bucket('relay_bandwidth') is relay_bucket('relay_bandwidth')
+
+
+def test_whole_frames_are_dropped():
+    rng = random.Random(0)
+    keyframe = nal_unit(0x67, 0x64, 12, rng) + nal_unit(0x68, 0xEE, 4, rng) + nal_unit(0x65, 0x88, 1000, rng)
+    reference = nal_unit(0x41, 0x9A, 1000, rng)
+    non_reference = nal_unit(0x01, 0x9A, 1000, rng)
+
+    engine = VideoEngine()
+    bucket = TokenBucket(1000, 1500)
+    stream = DroneVideoStream(VIDEO_PORT, engine=engine, relay_bucket=bucket)
+    received = []
+    try:
+        stream.publisher = RELAY
+        stream.add_subscriber(VIEWER)
+        stream.subscribers[VIEWER].send = lambda data: received.append(bytes(data)) or True
+
+        def send(frame: bytes, tokens: float | None = None) -> None:
+            if tokens is not None:
+                bucket.tokens = tokens
+            # Two datagrams per frame. Only the first one starts a frame.
+            stream.datagram_received(frame[:500], RELAY)
+            stream.datagram_received(frame[500:], RELAY)
+
+        # The first two frames fit the burst, and the second one takes the bucket into debt.
+        send(keyframe)
+        send(reference)
+        assert b''.join(received) == keyframe + reference
+        assert bucket.tokens < 0
+
+        # A non-reference frame is dropped alone.
+        send(non_reference)
+        send(reference, tokens=1500)
+        assert b''.join(received) == keyframe + reference + reference
+
+        # A reference frame is dropped with everything up to the next keyframe.
+        send(reference, tokens=-1)
+        send(reference, tokens=1500)
+        send(non_reference)
+        send(keyframe)
+        assert b''.join(received) == keyframe + reference + reference + keyframe
+
+        assert stream.policed_frames == 4
+        assert bucket.dropped_frames == 2
+        assert stream.stats()['bandwidth']['policed_frames'] == 4
+
+    finally:
+        stream.close()
+        engine.stop()
@@ -0,0 +1,46 @@
+'''A test file for the batched UDP transport.
+
+This file tests that `BatchedDatagramTransport.try_sendto()` refuses datagrams the socket's send buffer has no
+room for, so they wait in the viewer's queue instead of being dropped by `sendmmsg()`, and lets them through
+again once the queued datagrams are sent.
+'''
+
+import socket
+
+import pytest
+
+import batched_udp
+from buffer_pool import BufferPool
+
+pytestmark = pytest.mark.skipif(not batched_udp.available(), reason="needs recvmmsg and sendmmsg (Linux)")
+
+
+def test_try_sendto_refuses_when_the_send_buffer_is_full():
+    viewer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    viewer.bind(('127.0.0.1', 0))
+    viewer.settimeout(1)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    sock.setblocking(False)
+    transport = batched_udp.BatchedDatagramTransport(sock, BufferPool(2048, 4))
+
+    # More than the send buffer takes, before anything is sent.
+    datagram = b'\x01' * 1460
+    accepted = 0
+    while transport.try_sendto(datagram, viewer.getsockname()):
+        accepted += 1
+        assert accepted < 100
+    assert accepted >= 1
+
+    # Everything that was let through is sent.
+    transport.flush()
+    for _ in range(accepted):
+        assert viewer.recv(2048) == datagram
+    assert transport.sender.dropped == 0
+
+    # The loopback took it all, so there is room again.
+    assert transport.try_sendto(datagram, viewer.getsockname())
+
+    transport.close()
+    viewer.close()
@@ -0,0 +1,92 @@
+'''A test file for pushing commands to the relayboxes.
+
+This file tests that `CommandChannels` sends the commands of a drone to its relaybox right away, from the
+threads of the routes, that only the newest rc command of a drone is sent when they pile up, and that a
+relaybox without a channel is left to poll.
+'''
+
+import asyncio, threading
+
+from command_channel import LAND, RC, TAKEOFF, CommandChannels, RelayChannel
+
+
+class FakeWebSocket:
+    def __init__(self, delay: float = 0) -> None:
+        self.messages = []
+        self.delay = delay
+
+    async def send_json(self, message: dict) -> None:
+        await asyncio.sleep(self.delay)
+        self.messages.append(message)
+
+
+def test_push_from_another_thread():
+    channels = CommandChannels()
+    assert not channels.push('relay', 'drone_001', TAKEOFF)
+
+    async def run() -> list[dict]:
+        websocket = FakeWebSocket()
+        channel = RelayChannel(websocket)
+        channels.connect('relay', channel)
+        task = asyncio.ensure_future(channel.run())
+
+        # The routes run in a thread pool.
+        def route() -> None:
+            assert channels.push('relay', 'drone_001', TAKEOFF)
+            assert channels.push('relay', 'drone_001', LAND)
+        thread = threading.Thread(target=route)
+        thread.start()
+        thread.join()
+
+        await asyncio.sleep(0.05)
+        task.cancel()
+        return websocket.messages
+
+    messages = asyncio.run(run())
+    assert messages == [{ "drone": "drone_001", "type": TAKEOFF }, { "drone": "drone_001", "type": LAND }]
+
+
+def test_only_the_newest_rc_command():
+    channels = CommandChannels()
+
+    async def run() -> tuple[list[dict], RelayChannel]:
+        websocket = FakeWebSocket(delay=0.05)
+        channel = RelayChannel(websocket)
+        channels.connect('relay', channel)
+        task = asyncio.ensure_future(channel.run())
+
+        # The first is being sent while the rest arrive. Only the newest of those is sent after it.
+        for cmd in ([10, 0, 0, 0], [20, 0, 0, 0], [30, 0, 0, 0], [40, 0, 0, 0]):
+            channels.push('relay', 'drone_001', RC, cmd=cmd)
+            channels.push('relay', 'drone_002', RC, cmd=cmd[::-1])
+            await asyncio.sleep(0.01)
+
+        await asyncio.sleep(0.3)
+        task.cancel()
+        return websocket.messages, channel
+
+    messages, channel = asyncio.run(run())
+    assert [message["cmd"] for message in messages if message["drone"] == "drone_001"] == [
+        [10, 0, 0, 0], [40, 0, 0, 0]
+    ]
+    assert [message["cmd"] for message in messages if message["drone"] == "drone_002"][-1] == [0, 0, 0, 40]
+    assert channel.sent == len(messages) and channel.skipped == 8 - len(messages)
+
+
+def test_reconnect_replaces_the_channel():
+    channels = CommandChannels()
+
+    async def run() -> None:
+        old = RelayChannel(FakeWebSocket())
+        new = RelayChannel(FakeWebSocket())
+        channels.connect('relay', old)
+        channels.connect('relay', new)
+
+        # The old one closing after the relaybox reconnected leaves the new one.
+        channels.disconnect('relay', old)
+        assert channels.channels['relay'] is new
+
+        channels.disconnect('relay', new)
+        assert not channels.push('relay', 'drone_001', LAND)
+
+    asyncio.run(run())
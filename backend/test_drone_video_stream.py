@@ -0,0 +1,259 @@
+'''A test file for the publisher/subscriber video stream.
+
+This file tests `DroneVideoStream` over UDP on localhost: that a relay can publish, only with the
+publisher token if the stream has one, that viewers need a valid ticket to subscribe, that every
+subscriber gets the video and that the per-stream cap on subscribers is enforced, for every way the
+engine can read its sockets. It also tests that streams sharing the multiplexed ingest port are told
+apart by the header of the relay's datagrams, also when the ingest port is sharded over worker
+processes, and that a stream can be closed from any thread.
+'''
+
+import asyncio, socket
+
+import pytest
+
+from buffer_pool import BufferPool
+from drone_video_stream import DroneVideoStream
+from video_engine import VideoEngine
+from video_header import VIDEO_HEADER, pack_header
+from video_workers import VideoWorkerPool
+
+VIDEO_PORT = 45222
+
+
+def new_peer() -> socket.socket:
+    peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    peer.bind(('127.0.0.1', 0))
+    peer.settimeout(1)
+    return peer
+
+
+# Run with `recvmmsg`/`sendmmsg`, with `recvfrom_into` and with asyncio's `DatagramProtocol`.
+@pytest.mark.parametrize('batched_io, buffer_pool_slabs', [(True, 64), (False, 64), (False, 0)])
+def test_fan_out_to_every_subscriber(batched_io, buffer_pool_slabs):
+    engine = VideoEngine(batched_io=batched_io, buffer_pool_slabs=buffer_pool_slabs)
+    stream = DroneVideoStream(VIDEO_PORT, engine=engine, max_subscribers=2)
+    address = ('127.0.0.1', VIDEO_PORT)
+
+    try:
+        # The relay becomes the publisher.
+        relay = new_peer()
+        relay.sendto(b'RTS', address)
+        assert relay.recv(32) == b'hello drone'
+
+        # Two viewers subscribe with their own ticket.
+        viewers = [new_peer(), new_peer()]
+        for viewer in viewers:
+            viewer.sendto(f'SUB {stream.issue_ticket()}'.encode('utf-8'), address)
+            assert viewer.recv(32) == b'hello drone'
+
+        # A third viewer is over the cap.
+        third = new_peer()
+        third.sendto(f'SUB {stream.issue_ticket()}'.encode('utf-8'), address)
+        assert third.recv(32) == b'FULL'
+
+        # Every subscriber gets the video.
+        relay.sendto(b'frame', address)
+        for viewer in viewers:
+            assert viewer.recv(32) == b'frame'
+
+        # An unsubscribed viewer no longer does.
+        viewers[0].sendto(b'UNSUB', address)
+        relay.sendto(b'another frame', address)
+        assert viewers[1].recv(32) == b'another frame'
+        assert len(stream.subscribers) == 1
+
+    finally:
+        engine.stop()
+
+
+def test_subscribe_with_invalid_ticket():
+    engine = VideoEngine()
+    stream = DroneVideoStream(VIDEO_PORT, engine=engine)
+    address = ('127.0.0.1', VIDEO_PORT)
+
+    try:
+        viewer = new_peer()
+        viewer.sendto(b'SUB not_a_ticket', address)
+
+        # Rejected viewers get no answer.
+        try:
+            viewer.recv(32)
+            assert False, 'A viewer with an invalid ticket was answered'
+        except socket.timeout:
+            pass
+
+        assert len(stream.subscribers) == 0
+
+    finally:
+        engine.stop()
+
+
+def with_header(stream_id: int, sequence: int, data: bytes) -> bytes:
+    buffer = bytearray(VIDEO_HEADER.size)
+    pack_header(buffer, stream_id, sequence)
+    return bytes(buffer) + data
+
+
+@pytest.mark.parametrize('batched_io, buffer_pool_slabs', [(True, 64), (False, 64), (False, 0)])
+def test_multiplexed_ingest_port(batched_io, buffer_pool_slabs):
+    engine = VideoEngine(batched_io=batched_io, buffer_pool_slabs=buffer_pool_slabs)
+    streams = [DroneVideoStream(VIDEO_PORT, engine=engine, stream_id=stream_id) for stream_id in (1, 2)]
+    address = ('127.0.0.1', VIDEO_PORT)
+
+    try:
+        # One relay socket and one viewer per stream, all on the same port.
+        relays = [new_peer(), new_peer()]
+        viewers = [new_peer(), new_peer()]
+        for stream, relay, viewer in zip(streams, relays, viewers):
+            relay.sendto(with_header(stream.stream_id, 0, b'RTS'), address)
+            assert relay.recv(32) == b'hello drone'
+
+            viewer.sendto(f'SUB {stream.issue_ticket()}'.encode('utf-8'), address)
+            assert viewer.recv(32) == b'hello drone'
+
+        # Each viewer only gets the video of its own stream, without the header.
+        relays[0].sendto(with_header(1, 1, b'frame one'), address)
+        relays[1].sendto(with_header(2, 1, b'frame two'), address)
+        assert viewers[0].recv(32) == b'frame one'
+        assert viewers[1].recv(32) == b'frame two'
+
+        # Datagrams for an unknown stream are dropped.
+        relays[0].sendto(with_header(3, 2, b'lost'), address)
+        viewers[0].sendto(b'UNSUB', address)
+        relays[1].sendto(with_header(2, 2, b'another frame'), address)
+        assert viewers[1].recv(32) == b'another frame'
+        assert len(streams[0].subscribers) == 0
+
+        # The sequence numbers of the video are counted, without the `RTS` before it.
+        assert streams[1].transport_metrics.received == 2 and streams[1].transport_metrics.lost == 0
+
+        # Swapped datagrams are put back in order.
+        relays[1].sendto(with_header(2, 4, b'second'), address)
+        relays[1].sendto(with_header(2, 3, b'first'), address)
+        assert viewers[1].recv(32) == b'first'
+        assert viewers[1].recv(32) == b'second'
+
+        # Closing one stream leaves the shared port open for the other.
+        streams[0].close()
+        relays[1].sendto(with_header(2, 5, b'still open'), address)
+        assert viewers[1].recv(32) == b'still open'
+
+    finally:
+        engine.stop()
+
+
+def test_close_from_another_thread():
+    engine = VideoEngine()
+    stream = DroneVideoStream(VIDEO_PORT, engine=engine)
+    address = ('127.0.0.1', VIDEO_PORT)
+
+    async def on_engine(function):
+        return function()
+
+    try:
+        viewer = new_peer()
+        viewer.sendto(f'SUB {stream.issue_ticket()}'.encode('utf-8'), address)
+        assert viewer.recv(32) == b'hello drone'
+
+        handle = asyncio.run_coroutine_threadsafe(
+            on_engine(lambda: engine.loop.call_later(60, stream._flush)), engine.loop
+        ).result()
+        stream._flush_handle = handle
+
+        # The subscribers and timers are let go of on the engine's loop, not on this thread.
+        stream.close()
+        asyncio.run_coroutine_threadsafe(on_engine(lambda: None), engine.loop).result()
+        assert stream.subscribers == {}
+        assert handle.cancelled() and stream._flush_handle is None
+
+    finally:
+        engine.stop()
+
+
+def test_publisher_token():
+    engine = VideoEngine()
+    stream = DroneVideoStream(VIDEO_PORT, engine=engine, stream_id=1, publisher_token='secret')
+    address = ('127.0.0.1', VIDEO_PORT)
+
+    try:
+        # Without the token, or with a wrong one, a relay gets no answer and does not become the publisher.
+        intruder = new_peer()
+        intruder.settimeout(0.2)
+        for message in (b'RTS', b'RTS guess'):
+            intruder.sendto(with_header(1, 0, message), address)
+            with pytest.raises(socket.timeout):
+                intruder.recv(32)
+        assert stream.publisher is None
+
+        relay = new_peer()
+        relay.sendto(with_header(1, 0, b'RTS secret'), address)
+        assert relay.recv(32) == b'hello drone'
+        assert stream.publisher == relay.getsockname()
+
+        # A resent `RTS` is answered again, and is not video.
+        relay.sendto(with_header(1, 0, b'RTS secret'), address)
+        assert relay.recv(32) == b'hello drone'
+        assert stream.metrics.packets == 0
+
+    finally:
+        engine.stop()
+
+
+def test_sharded_ingest_port():
+    workers = VideoWorkerPool(workers=2, port=VIDEO_PORT)
+    stream = DroneVideoStream(VIDEO_PORT, engine=workers, stream_id=1, publisher_token='secret')
+    address = ('127.0.0.1', VIDEO_PORT)
+
+    # The workers are separate processes that need a moment to start. Resend until they answer.
+    def handshake(peer: socket.socket, message: bytes) -> bytes:
+        for _ in range(50):
+            peer.sendto(message, address)
+            try:
+                return peer.recv(32)
+            except socket.timeout:
+                continue
+
+    try:
+        relay = new_peer()
+        relay.settimeout(0.2)
+        assert handshake(relay, with_header(1, 0, b'RTS secret')) == b'hello drone'
+
+        # The ticket is checked by the API process, whichever worker gets the viewer.
+        viewer = new_peer()
+        viewer.settimeout(0.2)
+        assert handshake(viewer, f'SUB {stream.issue_ticket()}'.encode('utf-8')) == b'hello drone'
+        assert viewer.getsockname() in stream.subscribers
+
+        # The worker that has the relay learns about the viewer from the API process, soon after the reply.
+        received = None
+        for sequence in range(1, 50):
+            relay.sendto(with_header(1, sequence, b'frame'), address)
+            try:
+                received = viewer.recv(32)
+                break
+            except socket.timeout:
+                continue
+        assert received == b'frame'
+
+    finally:
+        stream.close()
+        workers.stop()
+
+
+def test_buffer_pool_counters():
+    pool = BufferPool(slab_size=2048, capacity=2)
+
+    slabs = [pool.acquire(), pool.acquire()]
+    assert pool.high_water_mark == 2
+
+    # The pool is empty. We still get a slab, but it is counted.
+    temporary = pool.acquire()
+    assert not temporary.pooled
+    assert pool.exhausted == 1
+
+    for slab in slabs + [temporary]:
+        pool.release(slab)
+
+    assert pool.in_use == 0
+    assert pool.high_water_mark == 2
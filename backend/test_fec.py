@@ -0,0 +1,115 @@
+'''A test file for forward error correction with XOR parity.
+
+This file tests that a `FecDecoder` rebuilds any one lost datagram of a group from the parity datagrams of a
+`ParityEncoder`, also when the payloads have different lengths or end in zeros, and that it gives up when
+more than one is lost. It also tests that a multiplexed stream sends a rebuilt datagram to its viewers in
+its place.
+'''
+
+import random, socket
+
+import pytest
+
+from drone_video_stream import DroneVideoStream
+from fec import FecDecoder, ParityEncoder
+from video_engine import VideoEngine
+from video_header import VIDEO_HEADER, pack_header, unpack_header
+
+VIDEO_PORT = 45223
+
+
+def new_payloads(count: int, seed: int = 0) -> list[bytes]:
+    rng = random.Random(seed)
+    payloads = [rng.randbytes(rng.choice((1460, 1460, 700, 3))) for _ in range(count)]
+    payloads[1] += b'\x00\x00'
+    return payloads
+
+
+def encode(payloads: list[bytes], group_size: int, first: int = 0, stream_id: int = 7) -> dict[int, bytes]:
+    """The parity datagrams of the payloads, by the sequence number they are sent after."""
+    encoder = ParityEncoder(group_size)
+    parity = {}
+    for index, payload in enumerate(payloads):
+        datagram = encoder.add(stream_id, first + index, payload)
+        if datagram is not None:
+            parity[first + index] = datagram
+    return parity
+
+
+@pytest.mark.parametrize('lost', range(5))
+def test_recover_any_one(lost):
+    payloads = new_payloads(5)
+    parity = encode(payloads, 5, first=10)
+    recovered = []
+    decoder = FecDecoder(5, lambda sequence, data: recovered.append((sequence, data)))
+
+    for index, payload in enumerate(payloads):
+        if index != lost:
+            decoder.add(10 + index, payload)
+
+    flags, lengths, stream_id, first = unpack_header(parity[14])
+    assert stream_id == 7 and first == 10
+    decoder.add_parity(first, lengths, parity[14][VIDEO_HEADER.size:])
+
+    assert recovered == [(10 + lost, payloads[lost])]
+    assert decoder.stats() == { "group_size": 5, "parity": 1, "recovered": 1, "unrecoverable": 0 }
+
+
+def test_more_than_one_lost():
+    payloads = new_payloads(8)
+    parity = encode(payloads, 4)
+    recovered = []
+    decoder = FecDecoder(4, lambda sequence, data: recovered.append(sequence))
+
+    # One lost in the first group, two in the second, and nothing lost in a third.
+    for sequence in (0, 1, 3, 4, 7):
+        decoder.add(sequence, payloads[sequence])
+    for sequence in (3, 7):
+        _, lengths, _, first = unpack_header(parity[sequence])
+        decoder.add_parity(first, lengths, parity[sequence][VIDEO_HEADER.size:])
+
+    assert recovered == [2]
+    assert decoder.recovered == 1 and decoder.unrecoverable == 1
+
+
+def test_group_size():
+    with pytest.raises(ValueError):
+        ParityEncoder(0)
+    with pytest.raises(ValueError):
+        FecDecoder(65, print)
+
+
+def test_stream_recovers_lost_datagram():
+    engine = VideoEngine()
+    stream = DroneVideoStream(VIDEO_PORT, engine=engine, stream_id=1, fec_group_size=4)
+    address = ('127.0.0.1', VIDEO_PORT)
+
+    try:
+        relay = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        viewer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for peer in (relay, viewer):
+            peer.bind(('127.0.0.1', 0))
+            peer.settimeout(1)
+
+        header = bytearray(VIDEO_HEADER.size)
+        pack_header(header, 1, 0)
+        relay.sendto(bytes(header) + b'RTS', address)
+        assert relay.recv(32) == b'hello drone'
+        viewer.sendto(f'SUB {stream.issue_ticket()}'.encode('utf-8'), address)
+        assert viewer.recv(32) == b'hello drone'
+
+        # The third datagram is lost, and rebuilt from the parity.
+        payloads = [b'one', b'two', b'three', b'four']
+        parity = encode(payloads, 4, stream_id=1)[3]
+        for sequence, payload in enumerate(payloads):
+            if sequence != 2:
+                pack_header(header, 1, sequence)
+                relay.sendto(bytes(header) + payload, address)
+        relay.sendto(parity, address)
+
+        assert [viewer.recv(32) for _ in payloads] == payloads
+        assert stream.stats()['fec']['recovered'] == 1
+
+    finally:
+        stream.close()
+        engine.stop()
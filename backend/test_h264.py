@@ -0,0 +1,125 @@
+'''A test file for the H.264 Annex B parser.
+
+This file tests that `AnnexBParser` finds every frame of a stream and its NAL unit types, however the
+stream is cut into datagrams, including when start codes are split over two datagrams, and that the frames
+stay whole when the datagrams are views of a buffer that is reused. It also tests that the `GopCache`
+replays a stream from its last keyframe, and that it stays within its size.
+'''
+
+import random
+
+import pytest
+
+from gop_cache import GopCache
+from h264 import AnnexBParser, NAL_IDR, NAL_PPS, NAL_SLICE, NAL_SPS
+
+
+def nal_unit(header: int, first: int, size: int, rng: random.Random) -> bytes:
+    # No zero bytes in the payload, so it can never contain a start code.
+    return b'\x00\x00\x00\x01' + bytes([header, first]) + bytes(rng.randrange(1, 256) for _ in range(size))
+
+
+def new_stream(frames: int, seed: int = 0) -> list[bytes]:
+    rng = random.Random(seed)
+    stream = []
+    for index in range(frames):
+        if index % 10 == 0:
+            # SPS, PPS and an IDR frame in two slices. Only the first slice starts with `first_mb_in_slice` 0.
+            stream.append(
+                nal_unit(0x67, 0x64, 8, rng) + nal_unit(0x68, 0xEE, 3, rng) +
+                nal_unit(0x65, 0x88, 300, rng) + nal_unit(0x65, 0x21, 300, rng)
+            )
+        elif index % 2:
+            # A non-reference frame (`nal_ref_idc` 0).
+            stream.append(nal_unit(0x01, 0x9A, rng.randrange(20, 200), rng))
+        else:
+            stream.append(nal_unit(0x41, 0x9A, rng.randrange(20, 200), rng))
+    return stream
+
+
+# Sizes that split start codes and NAL headers at every offset, and the size of a Tello datagram.
+@pytest.mark.parametrize('size', [5, 6, 7, 8, 9, 13, 29, 1460])
+def test_frames_across_datagrams(size):
+    frames = new_stream(31)
+    data = b''.join(frames)
+
+    parser = AnnexBParser()
+    found = []
+    parser.listeners.append(lambda frame: found.append((frame.data(), frame.keyframe, frame.reference, frame.nal_types)))
+
+    for offset in range(0, len(data), size):
+        parser.feed(memoryview(data)[offset:offset + size])
+
+    # The last frame is only complete once the next one begins.
+    assert [frame[0] for frame in found] == frames[:-1]
+
+    assert found[0][1] and found[0][3] == [NAL_SPS, NAL_PPS, NAL_IDR, NAL_IDR]
+    assert found[1][3] == [NAL_SLICE] and not found[1][2]
+    assert found[2][2] and not found[2][1]
+    assert parser.keyframes == 3
+
+
+def test_frames_outlive_pooled_datagrams():
+    frames = new_stream(31)
+    data = b''.join(frames)
+
+    parser = AnnexBParser()
+    found = []
+    parser.listeners.append(found.append)
+
+    # Every datagram is received into the same slab, like `BufferPool` reuses its slabs.
+    slab = bytearray(1460)
+    for offset in range(0, len(data), 1460):
+        datagram = data[offset:offset + 1460]
+        slab[:len(datagram)] = datagram
+        parser.feed(memoryview(slab)[:len(datagram)])
+
+    assert [frame.data() for frame in found] == frames[:-1]
+    assert [b''.join(frame.chunks) for frame in found] == frames[:-1]
+    assert b''.join(parser.partial.chunks) == frames[-1]
+
+
+def test_joined_in_the_middle():
+    data = b''.join(new_stream(12))
+
+    parser = AnnexBParser()
+    found = []
+    parser.listeners.append(lambda frame: found.append(frame.nal_types))
+
+    # The first frame is incomplete, but still has NAL units, so it is reported.
+    parser.feed(data[7:1000])
+    parser.feed(data[1000:])
+
+    assert found[0] == [NAL_PPS, NAL_IDR, NAL_IDR]
+    assert len(found) == 11
+
+
+def test_gop_cache_replays_from_last_keyframe():
+    frames = new_stream(15)
+    data = b''.join(frames)
+
+    parser = AnnexBParser()
+    cache = GopCache(max_bytes=1024 * 1024)
+    parser.listeners.append(cache.add)
+    for offset in range(0, len(data), 1460):
+        parser.feed(data[offset:offset + 1460])
+
+    # The keyframe (frame 10) and everything after it, including what has arrived of the last frame.
+    assert b''.join(cache.replay(parser.partial)) == b''.join(frames[10:])
+    assert cache.sps is not None and cache.pps is not None
+    assert cache.stats()['frames'] == 4
+
+
+def test_gop_cache_overflow():
+    frames = new_stream(15)
+
+    parser = AnnexBParser()
+    cache = GopCache(max_bytes=700)
+    parser.listeners.append(cache.add)
+    for frame in frames:
+        parser.feed(frame)
+
+    # The GOP did not fit. Nothing is replayed until the next keyframe.
+    assert cache.overflows == 2
+    assert cache.replay(parser.partial) == []
+    assert cache.stats()['bytes'] <= 700
@@ -0,0 +1,85 @@
+'''A test file for packaging drone video as HLS.
+
+This file tests that the MPEG-TS segments of `HlsPackager` are valid transport stream packets, that the
+video can be taken out of them again with the PTS of its arrival time, and that the live playlist only
+has the last segments while the VOD playlist has all of them.
+'''
+
+import os
+
+from hls import CLOCK, PACKET_SIZE, PAT_PID, PMT_PID, VIDEO_PID, HlsPackager, _crc32
+from test_h264 import new_stream
+from test_recorder import parse
+
+
+def demux(data: bytes) -> tuple[list[bytes], list[int]]:
+    """Returns the PES payloads and PTS of the video PID, and checks every packet on the way."""
+    assert len(data) % PACKET_SIZE == 0
+
+    payloads, times, counters = [], [], {}
+    for position in range(0, len(data), PACKET_SIZE):
+        packet = data[position:position + PACKET_SIZE]
+        assert packet[0] == 0x47
+
+        pid = (packet[1] & 0x1F) << 8 | packet[2]
+        start = packet[1] & 0x40
+        counter = packet[3] & 0x0F
+        if pid in counters:
+            assert counter == (counters[pid] + 1) & 0x0F
+        counters[pid] = counter
+
+        if pid in (PAT_PID, PMT_PID):
+            length = (packet[6] & 0x0F) << 8 | packet[7]
+            assert _crc32(packet[5:8 + length]) == 0
+            continue
+
+        assert pid == VIDEO_PID
+        payload = packet[4:]
+        if packet[3] & 0x20:
+            payload = payload[1 + payload[0]:]
+
+        if start:
+            assert payload[:4] == b'\x00\x00\x01\xE0'
+            pts = payload[9:14]
+            times.append(
+                (pts[0] & 0x0E) << 29 | pts[1] << 22 | (pts[2] & 0xFE) << 14 | pts[3] << 7 | pts[4] >> 1
+            )
+            payloads.append(payload[9 + 5:])
+        else:
+            payloads[-1] += payload
+
+    return payloads, times
+
+
+def test_segments_and_playlists(tmp_path):
+    frames = new_stream(61)
+    packager = HlsPackager(str(tmp_path), uri_prefix='hls?file=', segment_seconds=0.3, live_segments=2)
+
+    # The stream is joined in the middle of a GOP. Packaging starts at the next keyframe.
+    for frame in parse(frames[5:]):
+        packager.add(frame)
+    packager.close()
+
+    # One segment per keyframe, since a GOP is longer than 0.3 seconds.
+    segments = sorted(name for name in os.listdir(tmp_path) if name.endswith('.ts'))
+    assert segments == [f'segment_{number:05}.ts' for number in range(5)]
+
+    for number, name in enumerate(segments):
+        with open(tmp_path / name, 'rb') as segment:
+            payloads, times = demux(segment.read())
+
+        # One PES packet per frame, the PTS 1/30 second apart as they arrived, from 1 second at the first.
+        first = 10 + number * 10
+        assert payloads == frames[first:first + 10]
+        assert times == [CLOCK + round((index - 10) * CLOCK / 30) for index in range(first, first + 10)]
+
+    with open(tmp_path / 'vod.m3u8') as playlist:
+        vod = playlist.read()
+    assert vod.count('#EXTINF:0.333,') == 5
+    assert '#EXT-X-PLAYLIST-TYPE:VOD' in vod and vod.endswith('#EXT-X-ENDLIST\n')
+    assert 'hls?file=segment_00000.ts' in vod
+
+    with open(tmp_path / 'live.m3u8') as playlist:
+        live = playlist.read()
+    assert '#EXT-X-MEDIA-SEQUENCE:3' in live
+    assert live.count('#EXTINF') == 2 and 'hls?file=segment_00004.ts' in live
@@ -0,0 +1,87 @@
+'''A test file for playing back recorded drone video.
+
+This file tests that seeking in a recording finds the last keyframe at or before a time, across segments,
+also in the segment being recorded, and in the segment before one without keyframes. It also tests that HTTP
+`Range` headers are parsed like browsers send them.
+'''
+
+import os, time
+
+import pytest
+
+from playback import Segment, list_segments, parse_range, seek_recording
+from recorder import Recorder
+from test_h264 import new_stream
+from test_recorder import parse
+
+
+def test_seek_across_segments(tmp_path):
+    frames = new_stream(31)
+    recorder = Recorder(str(tmp_path), segment_bytes=1)
+    for frame in parse(frames):
+        recorder.add(frame)
+    recorder.close()
+
+    # One segment per keyframe, at 1000 s, 1000.33 s and 1000.67 s. The last frame is never complete.
+    names = list_segments(str(tmp_path))
+    assert len(names) == 3
+
+    assert seek_recording(str(tmp_path), 999)[0] == names[0]
+    assert seek_recording(str(tmp_path), 1000.2)[0] == names[0]
+    assert seek_recording(str(tmp_path), 1000.5)[:2] == (names[1], 1000 + 10 / 30)
+    assert seek_recording(str(tmp_path), 2000)[:2] == (names[2], 1000 + 20 / 30)
+
+    name, _, offset = seek_recording(str(tmp_path), 1000.5)
+    with Segment(os.path.join(tmp_path, name)) as segment:
+        assert segment.data[offset:] == b''.join(frames[10:20])
+
+    assert seek_recording(str(tmp_path / 'nothing'), 1000) is None
+
+
+def test_seek_while_recording(tmp_path):
+    frames = new_stream(25)
+    recorder = Recorder(str(tmp_path), segment_bytes=1)
+    parsed = parse(frames)
+    for frame in parsed:
+        recorder.add(frame)
+
+    # The segment of the last keyframe is still open.
+    deadline = time.monotonic() + 5
+    while recorder.stats()['bytes_written'] < sum(frame.size for frame in parsed) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    name, arrival, offset = seek_recording(str(tmp_path), 2000)
+    assert arrival == 1000 + 20 / 30
+    with Segment(os.path.join(tmp_path, name)) as segment:
+        assert segment.data[offset:offset + len(frames[20])] == frames[20]
+
+    recorder.close()
+
+
+def test_seek_skips_segments_without_keyframes(tmp_path):
+    frames = new_stream(21)
+    recorder = Recorder(str(tmp_path), segment_bytes=1)
+    for frame in parse(frames):
+        recorder.add(frame)
+    recorder.close()
+    names = list_segments(str(tmp_path))
+
+    # A segment that was just started, and one without an index.
+    for name, index in (('20240521-101502.250', b''), ('20240521-101503.250', None)):
+        (tmp_path / (name + '.h264')).write_bytes(b'')
+        if index is not None:
+            (tmp_path / (name + '.idx')).write_bytes(index)
+
+    assert seek_recording(str(tmp_path), 2000000000)[:2] == (names[-1], 1000 + 10 / 30)
+
+
+def test_parse_range():
+    assert parse_range(None, 1000) is None
+    assert parse_range('bytes=100-', 1000) == (100, 999)
+    assert parse_range('bytes=0-499', 1000) == (0, 499)
+    assert parse_range('bytes=900-5000', 1000) == (900, 999)
+    assert parse_range('bytes=-300', 1000) == (700, 999)
+
+    for header in ('bytes=1000-', 'bytes=5-4', 'bytes=-', 'lines=0-1', 'bytes=0-1,5-6'):
+        with pytest.raises(ValueError):
+            parse_range(header, 1000)
@@ -0,0 +1,65 @@
+'''A test file for recording drone video to disk.
+
+This file tests that a `Recorder` writes the frames of a stream into segments that each start at a keyframe,
+with an index entry for every keyframe, and that it drops video up to the next keyframe when its queue is full.
+'''
+
+import os, time
+
+from h264 import AnnexBParser
+from recorder import INDEX_ENTRY, Recorder
+from test_h264 import new_stream
+
+
+def parse(frames: list[bytes]) -> list:
+    parser = AnnexBParser()
+    found = []
+    parser.listeners.append(found.append)
+    for index, frame in enumerate(frames):
+        parser.feed(frame, arrival=1000.0 + index / 30)
+    return found
+
+
+def test_segments_and_index(tmp_path):
+    frames = new_stream(41)
+    recorder = Recorder(str(tmp_path), segment_bytes=1, segment_seconds=3600)
+
+    # The stream is joined in the middle of a GOP. The recording starts at the next keyframe.
+    for frame in parse(frames[5:]):
+        recorder.add(frame)
+    recorder.close()
+
+    # A new segment at every keyframe, since every segment is full after one byte.
+    names = sorted(os.listdir(tmp_path))
+    assert [name.split('.')[-1] for name in names] == ['h264', 'idx'] * 3
+    assert recorder.stats()['segments'] == 3
+    assert recorder.stats()['dropped_bytes'] == 0
+
+    for number, name in enumerate(names[::2]):
+        with open(tmp_path / name, 'rb') as segment:
+            assert segment.read() == b''.join(frames[10 + number * 10:20 + number * 10])
+
+        with open(tmp_path / name.replace('.h264', '.idx'), 'rb') as index:
+            arrival, offset = INDEX_ENTRY.unpack(index.read())
+        assert offset == 0
+        assert abs(arrival - (1000.0 + (5 + number * 10) / 30)) < 1e-9
+
+
+def test_drops_up_to_the_next_keyframe(tmp_path):
+    frames = parse(new_stream(21))
+    recorder = Recorder(str(tmp_path), max_queue_bytes=frames[0].size + frames[1].size)
+
+    # Only the keyframe and the frame after it fit in the queue, while the writer thread cannot take them.
+    with recorder._condition:
+        for frame in frames[:10]:
+            recorder.add(frame)
+
+    # Once the disk has caught up, the recording goes on at the next keyframe.
+    while recorder.stats()['queue_bytes']:
+        time.sleep(0.01)
+    recorder.add(frames[10])
+    recorder.close()
+
+    assert recorder.stats()['dropped_frames'] == 8
+    assert recorder.stats()['dropped_bytes'] == sum(frame.size for frame in frames[2:10])
+    assert recorder.stats()['bytes_written'] == frames[0].size + frames[1].size + frames[10].size
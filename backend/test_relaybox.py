@@ -0,0 +1,121 @@
+'''A test file for the command queue of a drone, and the drones of a relay.
+
+This file tests that every new command gets a new version, and that a long-poll waiting for a new command
+wakes when the command is set from another thread, answers at once if it is behind, and gives up after its
+timeout. It tests that the newest command of a client wins when its requests overtake each other, and that the
+ages of the commands are counted. It also tests that the membership of a relay changes when a drone is added
+or removed.
+'''
+
+import asyncio, threading, time
+
+from command_age import CommandAge
+from relaybox import Drone, Relay
+
+
+def test_versions():
+    drone = Drone("drone_001")
+    another = Drone("drone_002")
+    assert drone.cmd_version != another.cmd_version
+
+    version = drone.cmd_version
+    drone.set_cmd_queue([0, 10, 0, 0])
+    assert drone.cmd_queue == [0, 10, 0, 0] and drone.cmd_version > version
+
+
+def test_newest_command_wins():
+    drone = Drone("drone_001")
+    assert drone.set_cmd_queue([0, 10, 0, 0], "browser", 2000)
+    version, issued = drone.cmd_version, drone.cmd_issued
+
+    # Sent before the one that is set, so it is dropped.
+    assert not drone.set_cmd_queue([0, 0, 0, 0], "browser", 1500)
+    assert not drone.set_cmd_queue([0, 0, 0, 0], "browser", 2000)
+    assert drone.command() == { "rc": [0, 10, 0, 0], "version": version, "issued": issued }
+
+    # Another client, with a clock far behind, and one without a client are not compared with it.
+    assert drone.set_cmd_queue([0, 20, 0, 0], "controller", 500)
+    assert drone.set_cmd_queue([0, 0, 0, 0])
+    assert drone.set_cmd_queue([0, 30, 0, 0], "browser", 3000)
+    assert drone.command()["rc"] == [0, 30, 0, 0] and drone.cmd_version > version and drone.cmd_issued >= issued
+
+    # A clock that was set back further than a request can be overtaken.
+    assert drone.set_cmd_queue([0, 40, 0, 0], "browser", 1000)
+    assert not drone.set_cmd_queue([0, 0, 0, 0], "browser", 900)
+
+    # A new flight forgets the times.
+    drone.reset_cmd_queue()
+    assert drone.cmd_queue == [0, 0, 0, 0]
+    assert drone.set_cmd_queue([0, 50, 0, 0], "browser", 500)
+
+
+def test_command_age():
+    age = CommandAge()
+    assert age.stats() == { "last_ms": None, "mean_ms": 0, "max_ms": 0, "commands": 0, "stale": 0 }
+
+    age.add(10)
+    age.add(42)
+    age.add(26)
+    age.add_stale(2)
+    assert age.stats() == { "last_ms": 26, "mean_ms": 12.9, "max_ms": 42, "commands": 3, "stale": 2 }
+
+
+def test_long_poll():
+    drone = Drone("drone_001")
+
+    async def run() -> None:
+        # Behind, so it answers at once.
+        version = drone.cmd_version
+        drone.set_cmd_queue([0, 10, 0, 0])
+        started = time.monotonic()
+        await drone.wait_for_cmd_queue(version, 5)
+        assert time.monotonic() - started < 0.1
+
+        # Nothing changes, so it waits for the timeout.
+        started = time.monotonic()
+        await drone.wait_for_cmd_queue(drone.cmd_version, 0.1)
+        assert time.monotonic() - started >= 0.1
+
+        # A user sets a new command from a route's thread. Every long-poll waiting for it wakes.
+        version = drone.cmd_version
+        waiting = [asyncio.ensure_future(drone.wait_for_cmd_queue(version, 5)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+
+        started = time.monotonic()
+        threading.Timer(0.05, drone.set_cmd_queue, args=([20, 0, 0, 0],)).start()
+        await asyncio.gather(*waiting)
+        assert time.monotonic() - started < 1
+        assert drone.cmd_queue == [20, 0, 0, 0] and drone.cmd_version != version
+
+    asyncio.run(run())
+
+
+def test_membership():
+    active_relays = {}
+    relay = Relay("relay_0001", active_relays)
+    active_relays[relay.name] = relay
+
+    membership = relay.membership
+    relay.add_drone("drone_001")
+    relay.add_drone("drone_002", multiplexed=True)
+    assert relay.membership == membership + 2
+
+    relay.remove_drone("drone_001")
+    assert list(relay.drones) == ["drone_002"] and relay.membership == membership + 3
+
+
+def test_stream_ids():
+    active_relays = {}
+    relay = Relay("relay_0001", active_relays)
+    active_relays[relay.name] = relay
+
+    for number in range(100):
+        relay.add_drone(f"drone_{number:03}", multiplexed=True)
+
+    # Random, so they cannot be guessed, but never 0 and never the same twice.
+    stream_ids = {drone.stream_id for drone in relay.drones.values()}
+    assert len(stream_ids) == 100
+    assert all(0 < stream_id < 2**32 for stream_id in stream_ids)
+
+    # Every drone has a publisher token of its own.
+    assert len({drone.publisher_token for drone in relay.drones.values()}) == 100
@@ -0,0 +1,92 @@
+'''A test file for the buffer that puts the datagrams from a relay back in order.
+
+This file tests that `ReorderBuffer` passes on datagrams in order without copying them, puts swapped datagrams
+back in order, gives up on missing datagrams after its deadline or when its ring is full, drops datagrams
+that arrive too late, and keeps working when the sequence numbers wrap (with any depth) or the relay starts
+over.
+'''
+
+from reorder_buffer import ReorderBuffer
+
+
+def new_buffer(depth: int = 8, deadline: float = 0.015) -> tuple[ReorderBuffer, list]:
+    emitted = []
+    return ReorderBuffer(emitted.append, depth, deadline), emitted
+
+
+def push(buffer: ReorderBuffer, sequences: list[int], now: float = 0) -> None:
+    for sequence in sequences:
+        buffer.push(sequence, memoryview(b'%d' % sequence), now)
+
+
+def test_in_order_is_not_copied():
+    buffer, emitted = new_buffer()
+    data = memoryview(b'frame')
+    buffer.push(7, data, 0)
+    assert emitted == [data] and emitted[0] is data
+
+
+def test_swapped_datagrams():
+    buffer, emitted = new_buffer()
+    push(buffer, [0, 1, 3, 4, 2, 5])
+    assert [bytes(data) for data in emitted] == [b'0', b'1', b'2', b'3', b'4', b'5']
+    assert buffer.reordered == 2 and buffer.max_buffered == 2 and buffer.buffered == 0
+    assert buffer.skipped == 0 and buffer.late == 0
+
+
+def test_deadline():
+    buffer, emitted = new_buffer(deadline=0.015)
+    push(buffer, [0, 2, 3], now=0)
+    assert len(emitted) == 1
+
+    # 1 never arrives. After the deadline the buffer gives up on it, and 1 is too late when it does arrive.
+    buffer.expire(0.010)
+    assert len(emitted) == 1
+    buffer.expire(0.016)
+    assert [bytes(data) for data in emitted] == [b'0', b'2', b'3']
+    assert buffer.skipped == 1
+
+    push(buffer, [1, 4], now=0.020)
+    assert [bytes(data) for data in emitted] == [b'0', b'2', b'3', b'4']
+    assert buffer.late == 1
+
+
+def test_full_ring():
+    buffer, emitted = new_buffer(depth=4)
+    push(buffer, [0, 2, 3, 4])
+    assert len(emitted) == 1
+
+    # 5 does not fit in the ring while it waits for 1, so the buffer gives up on 1.
+    push(buffer, [5])
+    assert [bytes(data) for data in emitted] == [b'0', b'2', b'3', b'4', b'5']
+    assert buffer.skipped == 1 and buffer.buffered == 0
+
+    # After a jump past the ring, the datagram still waits for the ones just before it.
+    push(buffer, [20])
+    assert buffer.skipped == 12 and buffer.buffered == 1
+    buffer.expire(1)
+    assert bytes(emitted[-1]) == b'20' and buffer.skipped == 15
+
+
+def test_wrap_and_relay_starting_over():
+    buffer, emitted = new_buffer()
+    push(buffer, [0xFFFFFFFE, 0, 0xFFFFFFFF, 1])
+    assert [bytes(data) for data in emitted] == [b'%d' % sequence for sequence in (0xFFFFFFFE, 0xFFFFFFFF, 0, 1)]
+
+    # The relay started over. What waited is passed on first.
+    push(buffer, [3, 1000000, 1000001])
+    assert [bytes(data) for data in emitted[4:]] == [b'3', b'1000000', b'1000001']
+    assert buffer.resets == 1
+
+
+def test_wrap_with_any_depth():
+    # 2^32 is not a multiple of 10, so the slots do not line up across the wrap unless the sequence numbers wrap.
+    buffer, emitted = new_buffer(depth=10)
+    push(buffer, [0xFFFFFFFE, 1, 2])
+    buffer.expire(1)
+    assert buffer.skipped == 2
+
+    # In order again after the gap.
+    push(buffer, [3, 4], now=1)
+    assert [bytes(data) for data in emitted] == [b'%d' % sequence for sequence in (0xFFFFFFFE, 1, 2, 3, 4)]
+    assert buffer.late == 0
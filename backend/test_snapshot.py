@@ -0,0 +1,58 @@
+'''A test file for snapshots of drone video.
+
+This file tests that the snapshot of a stream is its last keyframe with the SPS and PPS in front of it,
+that it is only built once per keyframe, and that a JPEG is decoded once per keyframe if OpenCV is installed.
+'''
+
+import pytest
+
+from gop_cache import GopCache
+from snapshot import OPENCV_AVAILABLE, SnapshotCache
+from test_h264 import nal_unit, new_stream
+from test_recorder import parse
+
+
+class Stream:
+    def __init__(self, max_bytes: int = 1024 * 1024) -> None:
+        self.gop_cache = GopCache(max_bytes)
+
+
+# With the cache off, the last keyframe is still kept.
+@pytest.mark.parametrize('max_bytes', [0, 1024 * 1024])
+def test_last_keyframe(max_bytes):
+    frames = new_stream(16)
+    stream = Stream(max_bytes)
+    cache = SnapshotCache()
+    assert cache.bundle(stream) is None
+
+    for frame in parse(frames):
+        stream.gop_cache.add(frame)
+
+    arrival, bundle = cache.bundle(stream)
+    assert bundle == frames[10] and arrival == 1000 + 10 / 30
+
+    # The same keyframe is not joined again.
+    assert cache.bundle(stream)[1] is bundle
+
+
+def test_parameter_sets_sent_before_the_keyframe():
+    import random
+    rng = random.Random(0)
+    sps, pps = nal_unit(0x67, 0x64, 8, rng), nal_unit(0x68, 0xEE, 3, rng)
+    idr = nal_unit(0x65, 0x88, 300, rng)
+
+    # The parameter sets arrive on their own, before the keyframe.
+    stream = Stream()
+    for frame in parse([nal_unit(0x41, 0x9A, 50, rng), sps + pps, idr, nal_unit(0x41, 0x9A, 50, rng)]):
+        stream.gop_cache.add(frame)
+
+    assert SnapshotCache().bundle(stream)[1] == sps + pps + idr
+
+
+def test_jpeg_without_opencv():
+    if OPENCV_AVAILABLE:
+        pytest.skip("OpenCV is installed")
+
+    stream = Stream()
+    with pytest.raises(RuntimeError):
+        SnapshotCache().jpeg(stream)
@@ -0,0 +1,150 @@
+'''A test file for the per-viewer video queue.
+
+This file tests that a `SubscriberQueue` sends right away while the viewer keeps up, and that a viewer who
+falls behind loses whole non-reference frames first, and then everything up to the next keyframe. A frame
+is dropped as a whole, also the parts of it that arrive later, and a non-reference frame is kept once the
+viewer has part of it.
+'''
+
+import time
+
+from h264 import AccessUnit, NAL_IDR, NAL_SLICE, NAL_SPS
+from subscriber_queue import SubscriberQueue
+
+
+def new_frame(reference: bool = True, keyframe: bool = False) -> AccessUnit:
+    frame = AccessUnit(time.time())
+    frame.reference = reference or keyframe
+    frame.keyframe = keyframe
+    frame.nal_types = [NAL_SPS, NAL_IDR] if keyframe else [NAL_SLICE]
+    return frame
+
+
+class Viewer:
+    def __init__(self) -> None:
+        self.received = []
+        self.blocked = False
+
+    def send(self, data) -> bool:
+        if self.blocked:
+            return False
+        self.received.append(bytes(data))
+        return True
+
+
+def test_sends_right_away():
+    viewer = Viewer()
+    queue = SubscriberQueue(viewer.send)
+
+    queue.push(memoryview(b'one'), new_frame())
+    assert viewer.received == [b'one']
+    assert len(queue) == 0
+
+
+def test_waits_while_the_viewer_is_blocked():
+    viewer = Viewer()
+    queue = SubscriberQueue(viewer.send)
+
+    viewer.blocked = True
+    queue.push(b'one', new_frame())
+    queue.push(b'two', new_frame())
+    assert len(queue) == 2
+
+    viewer.blocked = False
+    assert queue.flush()
+    assert viewer.received == [b'one', b'two']
+    assert queue.stats()['max_queue_depth'] == 2
+
+    # Only the first datagram was tried while the viewer was blocked. The second waited behind it.
+    assert queue.stats()['send_failures'] == 1
+
+
+def test_drops_non_reference_frames_first():
+    viewer = Viewer()
+    queue = SubscriberQueue(viewer.send, max_depth=4)
+    viewer.blocked = True
+
+    reference, disposable = new_frame(), new_frame(reference=False)
+    for data, frame in [(b'r1', reference), (b'r2', reference), (b'd1', disposable), (b'd2', disposable), (b'r3', new_frame())]:
+        queue.push(data, frame)
+
+    # The queue went over its depth, and the non-reference frame was enough.
+    assert queue.dropped_frames == 1
+    assert queue.dropped_datagrams == 2
+
+    viewer.blocked = False
+    queue.flush()
+    assert viewer.received == [b'r1', b'r2', b'r3']
+
+
+def test_drops_the_rest_of_a_dropped_frame():
+    viewer = Viewer()
+    queue = SubscriberQueue(viewer.send, max_depth=3)
+    viewer.blocked = True
+
+    reference, disposable = new_frame(), new_frame(reference=False)
+    for data, frame in [(b'r1', reference), (b'd1', disposable), (b'd2', disposable), (b'r2', reference)]:
+        queue.push(data, frame)
+    assert queue.dropped_frames == 1
+
+    # The rest of the dropped frame arrives after the queue was trimmed. It is dropped too.
+    queue.push(b'd3', disposable)
+
+    viewer.blocked = False
+    queue.flush()
+    assert viewer.received == [b'r1', b'r2']
+    assert queue.dropped_datagrams == 3
+
+
+def test_keeps_a_partly_sent_frame():
+    viewer = Viewer()
+    queue = SubscriberQueue(viewer.send, max_depth=3)
+
+    # The viewer gets the first part of a non-reference frame, then falls behind.
+    partly_sent, disposable = new_frame(reference=False), new_frame(reference=False)
+    queue.push(b'p1', partly_sent)
+    viewer.blocked = True
+    for data, frame in [(b'p2', partly_sent), (b'd1', disposable), (b'r1', new_frame()), (b'r2', new_frame())]:
+        queue.push(data, frame)
+
+    # Only the other non-reference frame is dropped. The viewer gets all of the one it has a part of.
+    assert queue.dropped_frames == 1
+
+    viewer.blocked = False
+    queue.flush()
+    assert viewer.received == [b'p1', b'p2', b'r1', b'r2']
+
+
+def test_drops_up_to_the_next_keyframe():
+    viewer = Viewer()
+    queue = SubscriberQueue(viewer.send, latency_budget=0.01)
+    viewer.blocked = True
+
+    queue.push(b'p1', new_frame())
+    queue.push(b'p2', new_frame())
+    time.sleep(0.02)
+
+    keyframe = new_frame(keyframe=True)
+    queue.push(b'i1', keyframe)
+    assert queue.dropped_frames == 2
+
+    viewer.blocked = False
+    queue.flush()
+    assert viewer.received == [b'i1']
+
+
+def test_waits_for_the_next_keyframe():
+    viewer = Viewer()
+    queue = SubscriberQueue(viewer.send, latency_budget=0.01)
+    viewer.blocked = True
+
+    queue.push(b'p1', new_frame())
+    time.sleep(0.02)
+    queue.push(b'p2', new_frame())
+
+    # Nothing worth keeping. Frames are dropped until a keyframe arrives.
+    assert len(queue) == 0
+    viewer.blocked = False
+    queue.push(b'p3', new_frame())
+    queue.push(b'i1', new_frame(keyframe=True))
+    assert viewer.received == [b'i1']
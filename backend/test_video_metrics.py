@@ -0,0 +1,95 @@
+'''A test file for the quality of service metrics of a video stream.
+
+This file tests that `StreamMetrics` counts the packet, byte and frame rates of a stream over its window,
+the datagrams of every frame, and only reports jitter when the frames arrive unevenly. It also tests that
+`TransportMetrics` finds lost and late datagrams from their sequence numbers, also when they wrap, and how the
+delay changes from their send times.
+'''
+
+import random, time
+
+from h264 import AccessUnit
+
+from video_metrics import StreamMetrics, TransportMetrics
+
+
+def send(metrics: StreamMetrics, start: float, seconds: int, jitter: float = 0, seed: int = 0) -> None:
+    """30 frames per second of 4 datagrams of 1000 bytes each, like `DroneVideoStream` counts them."""
+    rng = random.Random(seed)
+    for index in range(seconds * 30):
+        # A frame is handed over when the first datagram of the next one arrives.
+        metrics.packets += 1
+        metrics.bytes += 1000
+        if index:
+            metrics.frame(AccessUnit(start + (index - 1) / 30 + rng.uniform(0, jitter)))
+        metrics.packets += 3
+        metrics.bytes += 3000
+
+
+def test_rates_and_bursts():
+    metrics = StreamMetrics(window=1)
+    send(metrics, time.time() - 3, 3)
+    stats = metrics.stats()
+
+    assert stats['packets'] == 360 and stats['bytes'] == 360000 and stats['frames'] == 89
+    assert abs(stats['packets_per_second'] - 120) < 5
+    assert abs(stats['bytes_per_second'] - 120000) < 5000
+    assert abs(stats['frames_per_second'] - 30) < 2
+
+    # Every frame but the first came in 4 datagrams, 33 ms after the one before it.
+    assert stats['burst_sizes'] == { '4': 88 }
+    assert stats['intervals'] == { '32ms': 88 }
+    assert stats['jitter_ms'] < 0.1
+
+
+def test_jitter():
+    metrics = StreamMetrics(window=1)
+    send(metrics, time.time() - 3, 3, jitter=0.010)
+    assert 1 < metrics.stats()['jitter_ms'] < 10
+
+
+def test_rates_go_to_zero_when_the_stream_stops():
+    metrics = StreamMetrics(window=1)
+    send(metrics, time.time() - 10, 3)
+    assert metrics.stats()['packets_per_second'] == 0
+
+
+def test_loss_and_reordering():
+    transport = TransportMetrics(window=1)
+    start = time.time() - 3
+
+    # Sequence numbers that wrap. 4 is lost, and 7 arrives 2 late.
+    offsets = [0, 1, 2, 3, 5, 6, 8, 9, 7] + list(range(10, 120))
+    for offset in offsets:
+        transport.received_datagram((0xFFFFFFFE + offset) & 0xFFFFFFFF, None, start + offset / 100)
+    transport.received_datagram(0xFFFFFFFE + 120 - 2 ** 32, None, start + 2)
+    stats = transport.stats()
+
+    assert stats['received'] == len(offsets) + 1
+    assert stats['late'] == 1 and stats['lost'] == 1 and stats['resets'] == 0
+    assert stats['max_reorder_depth'] == 2
+    assert stats['delay_ms'] is None
+
+
+def test_relay_starting_over():
+    transport = TransportMetrics()
+    for sequence in (1000000, 1000001, 0, 1, 3):
+        transport.received_datagram(sequence, None, time.time())
+    assert transport.resets == 1 and transport.lost == 1
+
+
+def test_growing_delay():
+    transport = TransportMetrics(window=1)
+    start = time.time() - 4
+    clock_offset = 12345.678
+
+    # 100 datagrams per second, that queue 10 ms more every second, from a relay with another clock.
+    for index in range(400):
+        sent = start + index / 100
+        arrival = sent + 0.020 + 0.010 * index / 100
+        transport.received_datagram(index, int((sent + clock_offset) * 1000), arrival)
+    stats = transport.stats()
+
+    assert stats['lost'] == 0 and stats['loss_rate'] == 0
+    assert 5 < stats['delay_trend_ms_per_second'] < 15
+    assert 15 < stats['delay_ms'] < 40
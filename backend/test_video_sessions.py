@@ -0,0 +1,143 @@
+'''A test file for the lifecycle of video sessions.
+
+This file tests that `SessionManager` follows a session from allocated to streaming and idle, reaps sessions
+without traffic with one timer on the engine loop, lets a reconnecting relay reclaim its session, and that
+opening and closing 10000 sessions leaves no threads or file descriptors behind.
+'''
+
+import asyncio, os, socket, threading, time
+
+from drone_video_stream import DroneVideoStream
+from video_engine import VideoEngine
+from video_sessions import ALLOCATED, CLOSED, IDLE, PUBLISHER_JOINED, STREAMING, SessionManager
+
+VIDEO_PORT = 45232
+
+
+def new_peer() -> socket.socket:
+    peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    peer.bind(('127.0.0.1', 0))
+    peer.settimeout(1)
+    return peer
+
+
+def wait_for(condition, timeout: float = 2) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def settle(engine: VideoEngine) -> None:
+    """Let the engine loop finish closing sockets."""
+    for _ in range(2):
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0), engine.loop).result()
+
+
+def test_states_and_reaping():
+    engine = VideoEngine()
+    manager = SessionManager(idle_after=0.1, timeout=0.3, interval=0.02, engine=engine)
+    key = ('relay', 'drone')
+    address = ('127.0.0.1', VIDEO_PORT)
+
+    try:
+        stream = manager.open(key, lambda: DroneVideoStream(VIDEO_PORT, engine=engine))
+        assert manager.state(key) == ALLOCATED and manager.sessions[key] is stream
+
+        relay = new_peer()
+        relay.sendto(b'RTS', address)
+        assert relay.recv(32) == b'hello drone'
+        assert wait_for(lambda: manager.state(key) == PUBLISHER_JOINED)
+
+        relay.sendto(b'frame', address)
+        assert wait_for(lambda: manager.state(key) == STREAMING)
+
+        # No more video. The session goes idle, and is reaped after the timeout.
+        assert wait_for(lambda: manager.state(key) == IDLE)
+        assert wait_for(lambda: manager.state(key) == CLOSED)
+        assert key not in manager.sessions and not stream.active
+        assert manager.reaped == 1 and manager.closed == 1
+
+        # Its port is free again.
+        settle(engine)
+        stream = manager.open(key, lambda: DroneVideoStream(VIDEO_PORT, engine=engine))
+        assert manager.stats()["states"] == {ALLOCATED: 1}
+
+    finally:
+        manager.stop()
+        engine.stop()
+
+
+def test_reclaim():
+    engine = VideoEngine()
+    manager = SessionManager(idle_after=1, timeout=10, interval=0.02, engine=engine)
+    key = ('relay', 'drone')
+    address = ('127.0.0.1', VIDEO_PORT)
+
+    try:
+        stream = manager.open(key, lambda: DroneVideoStream(VIDEO_PORT, engine=engine))
+        old_relay = new_peer()
+        old_relay.sendto(b'RTS', address)
+        assert old_relay.recv(32) == b'hello drone'
+
+        viewer = new_peer()
+        viewer.sendto(f'SUB {stream.issue_ticket()}'.encode('utf-8'), address)
+        assert viewer.recv(32) == b'hello drone'
+
+        # The relay reconnects from a new address, and keeps the session and its viewers.
+        assert manager.reclaim(key) is stream
+        assert manager.state(key) == ALLOCATED and stream.publisher is None
+
+        new_relay = new_peer()
+        new_relay.sendto(b'RTS', address)
+        assert new_relay.recv(32) == b'hello drone'
+        new_relay.sendto(b'frame', address)
+        assert viewer.recv(32) == b'frame'
+        assert manager.reclaimed == 1 and manager.opened == 1
+
+        assert manager.reclaim(('relay', 'another drone')) is None
+
+    finally:
+        manager.stop()
+        engine.stop()
+
+
+def test_soak_leaves_nothing_behind():
+    engine = VideoEngine()
+    manager = SessionManager(timeout=60, interval=0.5, engine=engine)
+
+    try:
+        # Warm up, so the engine, the timer and their sockets exist before counting.
+        manager.open(('relay', 'warm-up'), lambda: DroneVideoStream(VIDEO_PORT + 1, engine=engine))
+        manager.open(('relay', 'warm-up ingest'), lambda: DroneVideoStream(VIDEO_PORT, engine=engine, stream_id=0))
+        manager.close(('relay', 'warm-up'))
+        manager.close(('relay', 'warm-up ingest'))
+        settle(engine)
+        threads = threading.active_count()
+        descriptors = len(os.listdir('/proc/self/fd'))
+
+        # 10000 sessions, 100 at a time, half on ports of their own and half on the ingest port.
+        for round in range(100):
+            keys = []
+            for index in range(100):
+                key = ('relay', f'drone-{round}-{index}')
+                if index % 2:
+                    manager.open(key, lambda index=index: DroneVideoStream(VIDEO_PORT + 1 + index, engine=engine))
+                else:
+                    manager.open(key, lambda index=index: DroneVideoStream(VIDEO_PORT, engine=engine, stream_id=index))
+                keys.append(key)
+
+            for key in keys:
+                assert manager.close(key)
+            settle(engine)
+
+        assert manager.opened == 10002 and manager.closed == 10002 and not manager.sessions
+        assert not engine.sessions and not engine.streams
+        assert threading.active_count() <= threads
+        assert len(os.listdir('/proc/self/fd')) <= descriptors + 1
+
+    finally:
+        manager.stop()
+        engine.stop()
@@ -0,0 +1,94 @@
+'''A test file for sending drone video over a WebSocket.
+
+This file tests that a `WebSocketViewer` sends whole frames with their length in front of them, starting at
+the last keyframe (or the next one, if none has arrived yet), and that it stops when it is told to.
+'''
+
+import asyncio, struct
+
+from drone_video_stream import DroneVideoStream
+from test_h264 import new_stream
+from video_engine import VideoEngine
+from video_websocket import WebSocketViewer
+
+VIDEO_PORT = 45223
+
+
+class FakeWebSocket:
+    def __init__(self) -> None:
+        self.messages = []
+
+    async def send_bytes(self, data: bytes) -> None:
+        self.messages.append(data)
+
+
+def test_frames_from_the_last_keyframe():
+    frames = new_stream(15)
+    engine = VideoEngine()
+    stream = DroneVideoStream(VIDEO_PORT, engine=engine)
+
+    async def feed(data: list[bytes]) -> None:
+        async def on_engine() -> None:
+            for frame in data:
+                stream.parser.feed(frame)
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(on_engine(), engine.loop))
+
+    async def watch() -> list[bytes]:
+        # Joins after the first keyframe, in the middle of the second GOP.
+        await feed(frames[:12])
+        websocket = FakeWebSocket()
+        viewer = WebSocketViewer(websocket, stream)
+        await viewer.start()
+
+        await feed(frames[12:])
+        await asyncio.sleep(0.1)
+        await viewer.stop()
+
+        # Nothing is sent after `stop()`.
+        await feed(frames[:2])
+        await asyncio.sleep(0.1)
+        return websocket.messages
+
+    try:
+        messages = asyncio.run(watch())
+    finally:
+        stream.close()
+        engine.stop()
+
+    for message in messages:
+        assert struct.unpack('!I', message[:4])[0] == len(message) - 4
+
+    # The last frame is only complete once the next one begins.
+    assert [message[4:] for message in messages] == frames[10:14]
+
+
+def test_frames_from_the_next_keyframe():
+    frames = new_stream(15)
+    engine = VideoEngine()
+    stream = DroneVideoStream(VIDEO_PORT, engine=engine)
+
+    async def watch() -> tuple[list[bytes], int]:
+        # Joins before any keyframe has arrived.
+        websocket = FakeWebSocket()
+        viewer = WebSocketViewer(websocket, stream)
+        await viewer.start()
+
+        async def on_engine() -> None:
+            for frame in frames[5:]:
+                stream.parser.feed(frame)
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(on_engine(), engine.loop))
+        await asyncio.sleep(0.1)
+        await viewer.stop()
+
+        # Frames that waited for the last one to be written are not send failures.
+        return websocket.messages, viewer.queue.send_failures
+
+    try:
+        messages, send_failures = asyncio.run(watch())
+    finally:
+        stream.close()
+        engine.stop()
+
+    # The frames before the keyframe are never sent, since they cannot be decoded.
+    assert [message[4:] for message in messages] == frames[10:14]
+    assert send_failures == 0
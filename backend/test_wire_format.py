@@ -0,0 +1,58 @@
+'''A FastAPI test file for MessagePack bodies on the relay routes.
+
+This file tests that a route of a router with `MessagePackRoute` reads a MessagePack body into its Pydantic
+model, answers in MessagePack when asked to, and still reads and answers JSON like before.
+'''
+
+import pytest
+
+# We are using the `TestClient` from FastAPI.
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+
+from models import RelaySyncModel
+from wire_format import MSGPACK, MessagePackRoute, NegotiatedResponse
+
+msgpack = pytest.importorskip('msgpack')
+
+router = APIRouter(route_class=MessagePackRoute, default_response_class=NegotiatedResponse)
+
+
+@router.post("/sync")
+def handle(relay: RelaySyncModel):
+    return { "name": relay.name, "statuses": len(relay.statuses), "membership": relay.membership }
+
+
+app = FastAPI()
+app.include_router(router)
+client = TestClient(app)
+
+SYNC = { "name": "relay_0001", "statuses": { "drone_001": "bat:75;" }, "membership": 7 }
+
+
+def test_msgpack_in_and_out():
+    response = client.post(
+        "/sync",
+        content=msgpack.packb(SYNC),
+        headers={ "Content-Type": MSGPACK, "Accept": MSGPACK }
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith(MSGPACK)
+    assert msgpack.unpackb(response.content) == { "name": "relay_0001", "statuses": 1, "membership": 7 }
+
+
+def test_msgpack_in_json_out():
+    response = client.post("/sync", content=msgpack.packb(SYNC), headers={ "Content-Type": MSGPACK })
+    assert response.json() == { "name": "relay_0001", "statuses": 1, "membership": 7 }
+
+
+def test_json_like_before():
+    response = client.post("/sync", json=SYNC)
+    assert response.headers["content-type"].startswith("application/json")
+    assert response.json() == { "name": "relay_0001", "statuses": 1, "membership": 7 }
+
+
+def test_invalid_body():
+    # Validated like JSON, so a body without a name is a 422.
+    response = client.post("/sync", content=msgpack.packb({ "statuses": {} }), headers={ "Content-Type": MSGPACK })
+    assert response.status_code == 422
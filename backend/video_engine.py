@@ -0,0 +1,384 @@
+'''The event loop that forwards every drone video stream.
+
+This module defines the `VideoEngine` class. It runs one asyncio event loop in a single background
+thread and owns every UDP video socket on the backend. Each `DroneVideoStream` registers itself with
+the engine and the engine hands it the datagrams that arrive on its port. This replaces the old
+design where every drone had its own thread blocking in `socket.recvfrom()`.
+
+Datagrams are received into slabs from a shared `BufferPool` (see `buffer_pool.py`) and handed to the
+session as a `memoryview`. The slab is released as soon as the session has forwarded it.
+
+Sessions either have a video port of their own, or share the multiplexed ingest port (`VIDEO_INGEST_PORT`
+in `config.py`). On the ingest port every datagram from a relay starts with a header that carries the stream
+id of the session (see `video_header.py`), and the engine demultiplexes it with a dict lookup.
+
+There are three ways the engine reads a socket:
+    - Batched (`VIDEO_BATCHED_IO` in `config.py`): many datagrams per `recvmmsg()` into pool slabs, and what
+      the session forwarded is sent with `sendmmsg()`. See `batched_udp.py`. Falls back to pooled if not available.
+    - Pooled (the default): one `recvfrom_into()` per datagram into a pool slab.
+    - Unpooled (`VIDEO_BUFFER_POOL_SLABS = 0`): asyncio's `DatagramProtocol`, one new `bytes` per datagram.
+
+Classes:
+    VideoStreamProtocol: The asyncio datagram protocol that connects a socket to a video stream session.
+    DatagramSocketTransport: A transport for a non-blocking socket that the engine reads itself.
+    VideoEngine: Owns the event loop and all video sockets.
+
+Functions:
+    dispatch_control: Passes a viewer's `SUB` or `UNSUB` on the ingest port to the session it is for.
+    get_video_engine: Returns the shared `VideoEngine`, and creates it on first use.
+
+Example:
+    >>> engine = get_video_engine()
+    >>> stream = DroneVideoStream(52222) # Registers itself with the engine.
+    >>> stream.close() # Unregisters and closes the socket.
+'''
+
+# Default Python
+import asyncio, socket, threading
+from typing import Callable
+
+# Batched UDP system calls.
+import batched_udp
+
+# Preallocated receive buffers.
+from buffer_pool import BufferPool
+
+# The header of datagrams on the multiplexed ingest port.
+from video_header import FLAG_PARITY, FLAG_SEND_TIME, VIDEO_HEADER, unpack_header
+
+from config import (
+    VIDEO_BATCHED_IO,
+    VIDEO_BATCH_SIZE,
+    VIDEO_BUFFER_POOL_SLABS,
+    VIDEO_BUFFER_SIZE
+)
+
+
+def dispatch_control(streams: dict[int, object], data: bytes | memoryview, addr: tuple[str, int]) -> None:
+    """Pass a viewer's `SUB` or `UNSUB` on the ingest port to the session it is for.
+
+    The session is the one that issued the ticket, or that the viewer is subscribed to. This is a linear
+    search, but viewers only send these when they join or leave.
+
+    Args:
+        streams (dict[int, DroneVideoStream]): The sessions on the ingest port, by stream id.
+        data (bytes | memoryview): The datagram from the viewer.
+        addr (tuple[str, int]): The IP address and port number of the viewer.
+    """
+    if data[:4] == b'SUB ':
+        ticket: bytes = bytes(data[4:])
+        for session in list(streams.values()):
+            if addr in session.subscribers or session.has_ticket(ticket):
+                session.datagram_received(data, addr)
+                return
+
+    elif data == b'UNSUB':
+        for session in list(streams.values()):
+            if addr in session.subscribers:
+                session.unsubscribe(addr)
+
+
+class VideoStreamProtocol(asyncio.DatagramProtocol):
+    """Passes datagrams from a video socket on to a handler.
+
+    Attributes:
+        handler (Callable): Called with every datagram and its sender. Either `DroneVideoStream.datagram_received`
+            of the session that owns the socket, or the engine's demultiplexer for the ingest port.
+    """
+
+    def __init__(self, handler: Callable[[bytes, tuple[str, int]], None]) -> None:
+        self.handler: Callable[[bytes, tuple[str, int]], None] = handler
+
+    def datagram_received(self, data: bytes, addr: tuple[str, int]) -> None:
+        self.handler(data, addr)
+
+    def error_received(self, exc: Exception) -> None:
+        # UDP errors (like ICMP port unreachable) are reported here instead of raised on `sendto`.
+        print(f"Could not send data to client: {exc}")
+
+
+class DatagramSocketTransport:
+    """A transport for a non-blocking video socket that the `VideoEngine` reads itself.
+
+    Attributes:
+        socket (socket.socket): The non-blocking video socket.
+        dropped (int): Datagrams that were dropped because the socket's send buffer was full.
+    """
+
+    def __init__(self, sock: socket.socket) -> None:
+        self.socket: socket.socket = sock
+        self.dropped: int = 0
+
+    def sendto(self, data: bytes | memoryview, addr: tuple[str, int]) -> None:
+        # The send buffer is full. Drop the datagram instead of blocking the event loop, like UDP would.
+        if not self.try_sendto(data, addr):
+            self.dropped += 1
+
+    def try_sendto(self, data: bytes | memoryview, addr: tuple[str, int]) -> bool:
+        """Send a datagram. Returns `False` if the send buffer is full, so it can be sent again later."""
+        try:
+            self.socket.sendto(data, addr)
+
+        except BlockingIOError:
+            return False
+
+        # Not something that sending again will fix.
+        except OSError as error:
+            print(f"Could not send data to client: {error}")
+
+        return True
+
+    def close(self) -> None:
+        self.socket.close()
+
+
+class VideoEngine:
+    """Runs one event loop that forwards video for all drones.
+
+    The loop runs in a background thread, so the FastAPI routes (which run in a thread pool)
+    use `register()` and `unregister()` to hand sessions over to it.
+
+    Attributes:
+        loop (asyncio.AbstractEventLoop): The event loop that owns every video socket.
+        sessions (dict[int, DroneVideoStream]): The registered sessions with a video port of their own, by port.
+        streams (dict[int, DroneVideoStream]): The registered sessions on the ingest port, by stream id.
+        batched_io (bool): If datagrams are received and sent with `recvmmsg()` and `sendmmsg()`.
+        buffer_pool (BufferPool | None): The slabs datagrams are received into, shared by every socket.
+        reuse_port (bool): If the ingest port is bound with `SO_REUSEPORT`, so several worker processes can
+            share it. See `video_workers.py`.
+        on_control (Callable | None): If set, viewers' `SUB` and `UNSUB` on the ingest port are passed to it
+            instead of the sessions. Used by worker processes, where the API process checks the tickets.
+    """
+
+    def __init__(
+        self,
+        batched_io: bool = VIDEO_BATCHED_IO,
+        buffer_pool_slabs: int = VIDEO_BUFFER_POOL_SLABS,
+        reuse_port: bool = False,
+        on_control: Callable[[bytes | memoryview, tuple[str, int]], None] | None = None
+    ) -> None:
+        self.loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+        self.sessions: dict[int, object] = {}
+        self.streams: dict[int, object] = {}
+
+        # The transport of the multiplexed ingest port. Bound when the first session uses it.
+        self._ingest: object | None = None
+        self.reuse_port: bool = reuse_port
+        self.on_control: Callable[[bytes | memoryview, tuple[str, int]], None] | None = on_control
+
+        self.buffer_pool: BufferPool | None = None
+        if buffer_pool_slabs > 0:
+            self.buffer_pool = BufferPool(VIDEO_BUFFER_SIZE, buffer_pool_slabs)
+
+        # Fall back to one datagram per system call where batched I/O is not available.
+        if batched_io and (self.buffer_pool is None or not batched_udp.available()):
+            print("Batched UDP is not available. Using one system call per datagram.")
+            batched_io = False
+        self.batched_io: bool = batched_io
+
+        # One thread for all video streams, instead of one thread per video stream.
+        self._thread: threading.Thread = threading.Thread(
+            target=self._run,
+            name='VideoEngineThread',
+            daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def register(self, session: object) -> None:
+        """Bind the video port of a session and start forwarding its datagrams.
+
+        Args:
+            session (DroneVideoStream): The session to register.
+
+        Raises:
+            OSError: If the video port could not be bound.
+        """
+        # Block until the socket is bound, so the caller knows the port is ready.
+        asyncio.run_coroutine_threadsafe(self._open(session), self.loop).result()
+
+    def unregister(self, session: object) -> None:
+        """Close the socket of a session and stop forwarding its datagrams.
+
+        The session forgets its subscribers and stops its timers on the engine's loop (see
+        `DroneVideoStream.detach()`), so this can be called from any thread.
+
+        Args:
+            session (DroneVideoStream): The session to unregister.
+        """
+        self.loop.call_soon_threadsafe(self._close, session)
+
+    async def _open(self, session: object) -> None:
+        # A session on the multiplexed ingest port.
+        if session.stream_id is not None:
+            if self._ingest is None:
+                self._ingest = await self._bind(session.video_port, self._demultiplex, self.reuse_port)
+
+            session.transport = self._ingest
+            self.streams[session.stream_id] = session
+            return
+
+        session.transport = await self._bind(session.video_port, session.datagram_received)
+        self.sessions[session.video_port] = session
+
+    async def _bind(
+        self,
+        port: int,
+        handler: Callable[[bytes | memoryview, tuple[str, int]], None],
+        reuse_port: bool = False
+    ) -> object:
+        """Bind a video socket and call `handler` with every datagram it receives.
+
+        With `reuse_port` the socket is bound with `SO_REUSEPORT`, and the kernel spreads the senders
+        over every socket bound to the port.
+
+        Returns:
+            object: The transport of the socket.
+        """
+        if self.buffer_pool is None:
+            transport, _ = await self.loop.create_datagram_endpoint(
+                lambda: VideoStreamProtocol(handler),
+                local_addr=('0.0.0.0', port),
+                reuse_port=reuse_port or None
+            )
+            return transport
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # IPv4 with UDP
+        sock.setblocking(False)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('0.0.0.0', port))
+
+        if self.batched_io:
+            transport = batched_udp.BatchedDatagramTransport(sock, self.buffer_pool, VIDEO_BATCH_SIZE)
+            self.loop.add_reader(sock.fileno(), self._drain, handler, transport)
+        else:
+            transport = DatagramSocketTransport(sock)
+            self.loop.add_reader(sock.fileno(), self._read, handler, transport)
+
+        return transport
+
+    def _demultiplex(self, data: bytes | memoryview, addr: tuple[str, int]) -> None:
+        """Hand a datagram from the ingest port to the session it belongs to."""
+        header: tuple[int, int, int, int] | None = unpack_header(data)
+
+        # From a relay. The stream id in the header says which session it is for.
+        if header is not None:
+            flags, send_time, stream_id, sequence = header
+            session = self.streams.get(stream_id)
+            if session is not None and flags & FLAG_PARITY:
+                session.parity_received(data[VIDEO_HEADER.size:], addr, sequence, send_time)
+            elif session is not None:
+                session.datagram_received(
+                    data[VIDEO_HEADER.size:], addr, sequence, send_time if flags & FLAG_SEND_TIME else None
+                )
+            return
+
+        # From a viewer. Worker processes leave the tickets to the API process.
+        if self.on_control is not None:
+            if data[:4] == b'SUB ' or data == b'UNSUB':
+                self.on_control(data, addr)
+            return
+
+        dispatch_control(self.streams, data, addr)
+
+    def _read(self, handler: Callable[[memoryview, tuple[str, int]], None], transport: DatagramSocketTransport) -> None:
+        """Hand the waiting datagrams to a handler, one `recvfrom_into()` each."""
+        pool: BufferPool = self.buffer_pool
+
+        # At most one batch, so one busy socket cannot starve the others.
+        for _ in range(VIDEO_BATCH_SIZE):
+            slab = pool.acquire()
+            try:
+                size, addr = transport.socket.recvfrom_into(slab.buffer)
+                handler(slab.view[:size], addr)
+
+            # The socket is empty.
+            except (BlockingIOError, InterruptedError):
+                break
+
+            except OSError as error:
+                print(f"Could not retrieve message: {error}")
+                break
+
+            # The datagram has been sent. Reuse the slab.
+            finally:
+                pool.release(slab)
+
+    def _drain(self, handler: Callable[[memoryview, tuple[str, int]], None], transport: batched_udp.BatchedDatagramTransport) -> None:
+        """Hand the waiting datagrams to a handler, then send everything it forwarded in one go."""
+        try:
+            # At most a few batches, so one busy socket cannot starve the others.
+            for _ in range(4):
+                for data, addr in transport.receiver.recv():
+                    handler(data, addr)
+
+                # Send what was forwarded and recycle the slabs before receiving more.
+                transport.flush()
+
+                if transport.receiver.drained:
+                    break
+
+        except OSError as error:
+            print(f"Could not retrieve message: {error}")
+            transport.flush()
+
+    def _close(self, session: object) -> None:
+        session.detach()
+
+        # The ingest port is shared, so only forget the session.
+        if session.stream_id is not None:
+            if self.streams.get(session.stream_id) is session:
+                self.streams.pop(session.stream_id)
+            return
+
+        if self.sessions.get(session.video_port) is session:
+            self.sessions.pop(session.video_port)
+
+        if session.transport is not None:
+            self._close_transport(session.transport)
+
+    def _close_transport(self, transport: object) -> None:
+        if isinstance(transport, (DatagramSocketTransport, batched_udp.BatchedDatagramTransport)):
+            self.loop.remove_reader(transport.socket.fileno())
+
+        transport.close()
+
+    def stop(self) -> None:
+        """Close every session and stop the event loop."""
+        asyncio.run_coroutine_threadsafe(self._close_all(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+    async def _close_all(self) -> None:
+        for session in list(self.sessions.values()) + list(self.streams.values()):
+            self._close(session)
+
+        if self._ingest is not None:
+            self._close_transport(self._ingest)
+            self._ingest = None
+
+        # Give the transports one iteration of the loop to release their sockets.
+        await asyncio.sleep(0)
+
+
+# The shared engine. See `get_video_engine()`.
+_video_engine: VideoEngine | None = None
+_video_engine_lock: threading.Lock = threading.Lock()
+
+def get_video_engine() -> VideoEngine:
+    """Returns the shared `VideoEngine`. It is created (and its thread started) on first use.
+
+    Returns:
+        VideoEngine: The engine that forwards all video streams.
+    """
+    global _video_engine
+
+    with _video_engine_lock:
+        if _video_engine is None:
+            _video_engine = VideoEngine()
+
+    return _video_engine
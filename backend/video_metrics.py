@@ -0,0 +1,303 @@
+'''Quality of service metrics for a drone video stream.
+
+When an operator says the video is choppy, these show why: is the relay sending less (packet and byte
+rate), are frames arriving unevenly (jitter), in large bursts the network drops (burst sizes), or is a viewer
+not keeping up (send failures, see `SubscriberQueue`).
+
+Forwarding a datagram only costs two additions: the stream adds to `packets` and `bytes` itself. Everything
+else is done once per frame, when the parser hands it over (a frame is 5-30 datagrams), with no allocation
+and no loop over history:
+    - Rates are counted over a window of `VIDEO_METRICS_WINDOW` seconds, and reported for the last full window.
+    - A relay sends a frame as one burst of datagrams, so the burst size is the datagrams between the first
+      datagrams of two frames.
+    - Jitter is the smoothed deviation of the time between frames from its mean (like RFC 3550), in ms.
+    - Burst sizes and the times between frames are counted in histograms with power-of-two buckets.
+
+In multiplexed mode the header of every datagram from the relay has a sequence number and a send time (see
+`video_header.py`). `TransportMetrics` uses them to show what the network between the relay and the backend
+does to the video: how many datagrams it loses, how far out of order it delivers them, and whether the delay is
+growing (a queue is building up somewhere on the way) or shrinking.
+
+Classes:
+    StreamMetrics: The counters and histograms of one stream.
+    TransportMetrics: Loss, reordering and delay of the datagrams from the relay of one stream.
+'''
+
+# Default Python
+import time
+
+from h264 import AccessUnit
+
+from config import VIDEO_METRICS_WINDOW
+
+# Buckets of the histograms. Bucket `i` counts values from `2 ** (i - 1)` up to `2 ** i`, the last bucket the rest.
+_BURST_BUCKETS: int = 12
+_INTERVAL_BUCKETS: int = 16
+
+# A jump in sequence numbers larger than this is a relay that started over, not lost datagrams (like RFC 3550).
+_MAX_DROPOUT: int = 3000
+# A datagram further than this behind the newest one is a relay that started over, not a late datagram.
+_MAX_MISORDER: int = 100
+
+
+def _histogram(buckets: list[int], unit: str) -> dict[str, int]:
+    """The non-empty buckets of a histogram, by the smallest value in them."""
+    return {
+        f"{(1 << index) >> 1}{unit}": count for index, count in enumerate(buckets) if count
+    }
+
+
+class StreamMetrics:
+    """The counters and histograms of one stream.
+
+    Attributes:
+        window (float): The seconds rates are counted over.
+        packets (int): Datagrams from the relay. Added to by the stream for every datagram.
+        bytes (int): Bytes from the relay. Added to by the stream for every datagram.
+        frames (int): Frames found by the parser.
+        packet_rate (float): Datagrams per second in the last window.
+        byte_rate (float): Bytes per second in the last window.
+        frame_rate (float): Frames per second in the last window.
+        jitter (float): The smoothed deviation of the time between frames (seconds).
+        burst_sizes (list[int]): How many frames arrived in 1, 2-3, 4-7, ... datagrams.
+        intervals (list[int]): How many frames arrived 0, 1, 2-3, 4-7, ... milliseconds after the one before.
+    """
+
+    def __init__(self, window: float = VIDEO_METRICS_WINDOW) -> None:
+        self.window: float = window
+        self.packets: int = 0
+        self.bytes: int = 0
+        self.frames: int = 0
+        self.packet_rate: float = 0
+        self.byte_rate: float = 0
+        self.frame_rate: float = 0
+        self.jitter: float = 0
+        self.burst_sizes: list[int] = [0] * _BURST_BUCKETS
+        self.intervals: list[int] = [0] * _INTERVAL_BUCKETS
+
+        # The counters when the current window started.
+        self._window_start: float = time.time()
+        self._window_packets: int = 0
+        self._window_bytes: int = 0
+        self._window_frames: int = 0
+
+        # The last frame, the datagrams before it, and the mean time between frames.
+        self._last: float | None = None
+        self._last_packets: int = 0
+        self._interval: float | None = None
+
+    def frame(self, frame: AccessUnit) -> None:
+        """Count a frame. Use this as a frame listener of the stream."""
+        now: float = frame.arrival
+        self.frames += 1
+
+        packets: int = self.packets
+        last: float | None = self._last
+        if last is not None:
+            bucket: int = (packets - self._last_packets).bit_length()
+            self.burst_sizes[bucket if bucket < _BURST_BUCKETS else -1] += 1
+
+            between: float = now - last
+            bucket = int(between * 1000).bit_length()
+            self.intervals[bucket if bucket < _INTERVAL_BUCKETS else -1] += 1
+
+            # Jitter like RFC 3550, on the time between frames.
+            interval: float = self._interval + (between - self._interval) / 16 if self._interval is not None else between
+            self._interval = interval
+            self.jitter += (abs(between - interval) - self.jitter) / 16
+
+        else:
+            # Count rates from the first frame, not from when the stream was opened.
+            self._window_start = now
+            self._window_packets = packets
+            self._window_bytes = self.bytes
+            self._window_frames = self.frames
+
+        self._last = now
+        self._last_packets = packets
+
+        if now - self._window_start >= self.window:
+            self._roll(now)
+
+    def _roll(self, now: float) -> None:
+        """Finish the current window and start the next."""
+        elapsed: float = now - self._window_start
+        self.packet_rate = (self.packets - self._window_packets) / elapsed
+        self.byte_rate = (self.bytes - self._window_bytes) / elapsed
+        self.frame_rate = (self.frames - self._window_frames) / elapsed
+        self._window_start = now
+        self._window_packets = self.packets
+        self._window_bytes = self.bytes
+        self._window_frames = self.frames
+
+    def stats(self) -> dict[str, int | float | dict[str, int]]:
+        """Returns the metrics of the stream.
+
+        Example:
+            >>> { "packets": 81234, "bytes": 103467120, "frames": 9000, "packets_per_second": 270.2,
+            ...   "bytes_per_second": 344210.5, "frames_per_second": 30.0, "jitter_ms": 2.1,
+            ...   "burst_sizes": { "8": 8210, "16": 790 }, "intervals": { "16ms": 71000, "32ms": 9000 } }
+        """
+        # No frame has arrived for a whole window, so the last window is out of date.
+        if time.time() - self._window_start >= 2 * self.window:
+            self.packet_rate = self.byte_rate = self.frame_rate = 0
+
+        return {
+            "packets": self.packets,
+            "bytes": self.bytes,
+            "frames": self.frames,
+            "packets_per_second": round(self.packet_rate, 1),
+            "bytes_per_second": round(self.byte_rate, 1),
+            "frames_per_second": round(self.frame_rate, 1),
+            "jitter_ms": round(self.jitter * 1000, 2),
+            "burst_sizes": _histogram(self.burst_sizes, ""),
+            "intervals": _histogram(self.intervals, "ms"),
+        }
+
+
+class TransportMetrics:
+    """Loss, reordering and delay of the datagrams from the relay of one stream.
+
+    Lost datagrams are the gaps in the sequence numbers. A datagram that arrives after one with a higher
+    sequence number is late: it was counted as lost, so it is taken off again, and how far behind it was is its
+    reorder depth. Duplicates count as late datagrams.
+
+    The delay is when a datagram arrived minus when the relay sent it. The clocks are not the same, so it is
+    reported relative to the smallest delay seen, which is the delay of an empty network path. That is the time
+    datagrams spend queued on the way. The trend is how fast it changed between the last two windows.
+
+    Attributes:
+        window (float): The seconds loss and the delay trend are counted over.
+        received (int): Datagrams from the relay.
+        lost (int): Datagrams that never arrived.
+        late (int): Datagrams that arrived after a datagram with a higher sequence number.
+        max_reorder_depth (int): The most sequence numbers a late datagram was behind.
+        resets (int): Times the relay started its sequence numbers over.
+        loss_rate (float): Lost datagrams out of the datagrams sent in the last window.
+        reorder_depth (int): The most sequence numbers a late datagram was behind in the last window.
+        delay (float): The smoothed queueing delay (seconds).
+        delay_trend (float): How much the queueing delay grew per second in the last window. Negative if it shrank.
+    """
+
+    def __init__(self, window: float = VIDEO_METRICS_WINDOW) -> None:
+        self.window: float = window
+        self.received: int = 0
+        self.lost: int = 0
+        self.late: int = 0
+        self.max_reorder_depth: int = 0
+        self.resets: int = 0
+        self.loss_rate: float = 0
+        self.reorder_depth: int = 0
+        self.delay: float = 0
+        self.delay_trend: float = 0
+
+        # The newest sequence number.
+        self._highest: int | None = None
+
+        # The first delay, which the others are measured from (ms, so they wrap with the send time), and the
+        # smallest delay since.
+        self._base: int | None = None
+        self._min_delay: int = 0
+
+        # The counters and the sum of the delays in the current window, and the mean delay of the last window.
+        self._window_start: float = time.time()
+        self._window_received: int = 0
+        self._window_lost: int = 0
+        self._window_depth: int = 0
+        self._window_delay: float = 0
+        self._window_delays: int = 0
+        self._last_delay: float | None = None
+
+    def received_datagram(self, sequence: int, send_time: int | None, now: float) -> None:
+        """Count a datagram from the relay.
+
+        Args:
+            sequence (int): The sequence number from its header.
+            send_time (int | None): The send time from its header (ms modulo 2^16), or `None` if it has none.
+            now (float): When it arrived (seconds since 1970).
+        """
+        self.received += 1
+        self._window_received += 1
+
+        highest: int | None = self._highest
+        if highest is None:
+            # Count from the first datagram, not from when the stream was opened.
+            self._highest = sequence
+            self._window_start = now
+        else:
+            # How far ahead of the newest datagram it is, from -2^31 to 2^31, so it wraps with the sequence number.
+            ahead: int = ((sequence - highest + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+            if 0 < ahead <= _MAX_DROPOUT:
+                self._highest = sequence
+                if ahead > 1:
+                    self.lost += ahead - 1
+                    self._window_lost += ahead - 1
+
+            elif -_MAX_MISORDER <= ahead <= 0:
+                # Late. It was counted as lost when the datagrams after it arrived.
+                self.late += 1
+                self.lost -= 1
+                self._window_lost -= 1
+                if -ahead > self._window_depth:
+                    self._window_depth = -ahead
+
+            else:
+                self._highest = sequence
+                self.resets += 1
+
+        if send_time is not None:
+            # In ms modulo 2^16, like the send time, from -2^15 to 2^15 relative to the first delay.
+            delay: int = ((int(now * 1000) - send_time - (self._base or 0) + 0x8000) & 0xFFFF) - 0x8000
+            if self._base is None:
+                self._base = delay
+                delay = 0
+            if delay < self._min_delay:
+                self._min_delay = delay
+            self._window_delay += delay
+            self._window_delays += 1
+
+        if now - self._window_start >= self.window:
+            self._roll(now)
+
+    def _roll(self, now: float) -> None:
+        """Finish the current window and start the next."""
+        elapsed: float = now - self._window_start
+        sent: int = self._window_received + self._window_lost
+        self.loss_rate = max(self._window_lost, 0) / sent if sent > 0 else 0
+        self.reorder_depth = self._window_depth
+        if self._window_depth > self.max_reorder_depth:
+            self.max_reorder_depth = self._window_depth
+
+        if self._window_delays:
+            mean: float = self._window_delay / self._window_delays / 1000
+            if self._last_delay is not None:
+                self.delay_trend = (mean - self._last_delay) / elapsed
+            self._last_delay = mean
+            self.delay = mean - self._min_delay / 1000
+
+        self._window_start = now
+        self._window_received = self._window_lost = self._window_depth = self._window_delays = 0
+        self._window_delay = 0
+
+    def stats(self) -> dict[str, int | float | None]:
+        """Returns the metrics of the datagrams from the relay.
+
+        Example:
+            >>> { "received": 81234, "lost": 12, "late": 3, "resets": 0, "loss_rate": 0.0037,
+            ...   "reorder_depth": 2, "max_reorder_depth": 5, "delay_ms": 14.2, "delay_trend_ms_per_second": 3.5 }
+        """
+        # Nothing has arrived for a whole window, so the last window is out of date.
+        if time.time() - self._window_start >= 2 * self.window:
+            self.loss_rate = self.reorder_depth = 0
+
+        return {
+            "received": self.received,
+            "lost": self.lost,
+            "late": self.late,
+            "resets": self.resets,
+            "loss_rate": round(self.loss_rate, 4),
+            "reorder_depth": self.reorder_depth,
+            "max_reorder_depth": max(self.max_reorder_depth, self._window_depth),
+            "delay_ms": round(self.delay * 1000, 1) if self._last_delay is not None else None,
+            "delay_trend_ms_per_second": round(self.delay_trend * 1000, 1) if self._last_delay is not None else None,
+        }
@@ -0,0 +1,254 @@
+'''The lifecycle of every drone video session, in one place.
+
+Every `DroneVideoStream` is opened and closed through the `SessionManager`, which keeps track of what state it
+is in:
+    - allocated: It has a video port (or a stream id on the ingest port), but no relay has joined yet.
+    - publisher-joined: The relay has sent `RTS`, but no video yet.
+    - streaming: Video has arrived in the last `VIDEO_SESSION_IDLE` seconds.
+    - idle: Video stopped arriving. It starts streaming again if the relay sends more.
+    - closed: It was closed, and its socket released.
+
+A session that has had no traffic for `VIDEO_SESSION_TIMEOUT` seconds is reaped: closed, like a drone that
+disconnected. This is checked for every session by one timer on the `VideoEngine` loop, every
+`VIDEO_SESSION_CHECK_INTERVAL` seconds, not by a thread for each session. The traffic of a session is its
+`metrics.packets`, so checking it costs nothing on the video path.
+
+A relay that reconnects asks for the video of its drones again. If a drone still has an open session, the
+relay can reclaim it with `reclaim()`, and keeps its port, stream id and viewers, instead of the session
+being closed and a new one opened.
+
+Note:
+    Sessions forwarded by worker processes (`VIDEO_WORKERS`) get no video in this process, so their traffic
+    cannot be seen here. They are never reaped, only closed when their drone disconnects.
+
+Classes:
+    SessionManager: Opens, tracks, reclaims and reaps video sessions.
+
+Attributes:
+    session_manager (SessionManager): The manager of the API process.
+'''
+
+# Default Python
+import asyncio, threading, time
+from typing import Callable
+
+from video_engine import VideoEngine, get_video_engine
+
+from config import VIDEO_SESSION_CHECK_INTERVAL, VIDEO_SESSION_IDLE, VIDEO_SESSION_TIMEOUT
+
+# The states of a session.
+ALLOCATED: str = "allocated"
+PUBLISHER_JOINED: str = "publisher-joined"
+STREAMING: str = "streaming"
+IDLE: str = "idle"
+CLOSED: str = "closed"
+
+# A session is known by `(relay name, drone name)`.
+SessionKey = tuple[str, str]
+
+
+class _Session:
+    """The state of one session, and when it last had traffic."""
+    __slots__ = ('stream', 'state', 'packets', 'active')
+
+    def __init__(self, stream: object, now: float) -> None:
+        self.stream: object = stream
+        self.state: str = ALLOCATED
+        self.packets: int = 0
+        self.active: float = now
+
+
+class SessionManager:
+    """Opens, tracks, reclaims and reaps video sessions.
+
+    Attributes:
+        sessions (dict[SessionKey, DroneVideoStream]): The open sessions, by `(relay name, drone name)`.
+        idle_after (float): Seconds without video before a streaming session is idle.
+        timeout (float): Seconds without traffic before a session is reaped.
+        interval (float): Seconds between checks of every session.
+        opened (int): Sessions opened.
+        reclaimed (int): Times a reconnecting relay reclaimed a session.
+        reaped (int): Sessions closed because they had no traffic.
+        closed (int): Sessions closed, reaped or not.
+    """
+
+    def __init__(
+        self,
+        idle_after: float = VIDEO_SESSION_IDLE,
+        timeout: float = VIDEO_SESSION_TIMEOUT,
+        interval: float = VIDEO_SESSION_CHECK_INTERVAL,
+        engine: VideoEngine | None = None
+    ) -> None:
+        self.sessions: dict[SessionKey, object] = {}
+        self.idle_after: float = idle_after
+        self.timeout: float = timeout
+        self.interval: float = interval
+        self.opened: int = 0
+        self.reclaimed: int = 0
+        self.reaped: int = 0
+        self.closed: int = 0
+
+        self._records: dict[SessionKey, _Session] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+        # The loop the checks run on, and the timer of the next check. Started with the first session.
+        self._engine: VideoEngine | None = engine
+        self._started: bool = False
+        self._stopped: bool = False
+        self._timer: asyncio.TimerHandle | None = None
+
+    def open(self, key: SessionKey, new_stream: Callable[[], object]) -> object:
+        """Open a session. An open session with the same key is closed first.
+
+        Args:
+            key (SessionKey): `(relay name, drone name)`.
+            new_stream (Callable[[], DroneVideoStream]): Makes the stream of the session.
+
+        Returns:
+            DroneVideoStream: The stream of the new session.
+        """
+        self.close(key)
+
+        stream: object = new_stream()
+        with self._lock:
+            self.sessions[key] = stream
+            self._records[key] = _Session(stream, time.monotonic())
+            self.opened += 1
+
+        self._start()
+        return stream
+
+    def reclaim(self, key: SessionKey) -> object | None:
+        """Give an open session to a relay that reconnected.
+
+        The session keeps its port, stream id and viewers. The relay becomes the publisher again when it sends
+        `RTS`. Until then the session counts as allocated, so it is reaped if the relay never does.
+
+        Args:
+            key (SessionKey): `(relay name, drone name)`.
+
+        Returns:
+            DroneVideoStream | None: The stream of the session, or `None` if it has none.
+        """
+        with self._lock:
+            record: _Session | None = self._records.get(key)
+            if record is None:
+                return None
+
+            record.state = ALLOCATED
+            record.active = time.monotonic()
+            record.stream.publisher = None
+            self.reclaimed += 1
+            return record.stream
+
+    def close(self, key: SessionKey, stream: object | None = None) -> bool:
+        """Close a session and release its socket.
+
+        Args:
+            key (SessionKey): `(relay name, drone name)`.
+            stream (DroneVideoStream | None): Only close the session if this is still its stream.
+
+        Returns:
+            bool: `True` if there was a session to close.
+        """
+        with self._lock:
+            record: _Session | None = self._records.get(key)
+            if record is None or (stream is not None and record.stream is not stream):
+                return False
+
+            del self._records[key]
+            del self.sessions[key]
+            record.state = CLOSED
+            self.closed += 1
+
+        record.stream.close()
+        return True
+
+    def state(self, key: SessionKey) -> str:
+        """Returns the state of a session. `closed` if it has none."""
+        record: _Session | None = self._records.get(key)
+        return record.state if record is not None else CLOSED
+
+    def _start(self) -> None:
+        """Start checking the sessions, if that has not started yet."""
+        with self._lock:
+            if self._started or self._stopped:
+                return
+            if self._engine is None:
+                self._engine = get_video_engine()
+            self._started = True
+
+        self._engine.loop.call_soon_threadsafe(self._check)
+
+    def _check(self) -> None:
+        """Update the state of every session, and reap those without traffic. Runs on the engine loop."""
+        if self._stopped:
+            return
+
+        now: float = time.monotonic()
+        reap: list[tuple[SessionKey, object]] = []
+        for key, record in list(self._records.items()):
+            stream: object = record.stream
+
+            # Sessions forwarded by worker processes get no video here.
+            if not isinstance(stream.engine, VideoEngine):
+                continue
+
+            packets: int = stream.metrics.packets
+            if packets != record.packets:
+                record.packets = packets
+                record.active = now
+                record.state = STREAMING
+
+            elif record.state == ALLOCATED and stream.publisher is not None:
+                record.active = now
+                record.state = PUBLISHER_JOINED
+
+            elif record.state == STREAMING and now - record.active >= self.idle_after:
+                record.state = IDLE
+
+            if now - record.active >= self.timeout:
+                reap.append((key, stream))
+
+        # Closing waits for the recorder and packager to finish writing, so it is not done on the loop.
+        for key, stream in reap:
+            self._engine.loop.run_in_executor(None, self._reap, key, stream)
+
+        self._timer = self._engine.loop.call_later(self.interval, self._check)
+
+    def _reap(self, key: SessionKey, stream: object) -> None:
+        """Close a session without traffic, unless it was closed or reopened since it was checked."""
+        if self.close(key, stream):
+            self.reaped += 1
+            print(f"Video session {key} had no traffic for {self.timeout} seconds, and was closed.")
+
+    def stop(self) -> None:
+        """Stop checking the sessions, and close every one."""
+        self._stopped = True
+        if self._timer is not None:
+            self._engine.loop.call_soon_threadsafe(self._timer.cancel)
+
+        for key in list(self._records):
+            self.close(key)
+
+    def stats(self) -> dict[str, int | dict[str, int]]:
+        """Returns how many sessions are in every state, and the counters of the manager.
+
+        Example:
+            >>> { "states": { "streaming": 12, "idle": 1 }, "opened": 40, "reclaimed": 3, "reaped": 2,
+            ...   "closed": 27 }
+        """
+        states: dict[str, int] = {}
+        for record in list(self._records.values()):
+            states[record.state] = states.get(record.state, 0) + 1
+
+        return {
+            "states": states,
+            "opened": self.opened,
+            "reclaimed": self.reclaimed,
+            "reaped": self.reaped,
+            "closed": self.closed,
+        }
+
+
+session_manager: SessionManager = SessionManager()
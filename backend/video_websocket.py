@@ -0,0 +1,122 @@
+'''Send a drone's video to a browser over a WebSocket.
+
+Browsers cannot receive UDP, so the frontend watches a drone over the WebSocket route
+`/v1/api/frontend/drone/video/{relay}/{drone}` (see `frontend_routes.py`). Every binary message is one
+H.264 access unit (one frame) in Annex B format, with a 4 byte header in front of it:
+
+    | length (4, big-endian) | access unit ... |
+
+The first message starts at a keyframe, with the SPS and PPS in front of it, so the browser can start
+decoding right away (for example with WebCodecs' `VideoDecoder`). If the GOP cache has no keyframe yet, the
+live frames are held back until the next one arrives.
+
+Frames are handed over from the `VideoEngine` thread to the event loop of the WebSocket. Each socket has a
+`SubscriberQueue` of at most `VIDEO_WEBSOCKET_MAX_FRAMES` frames with the same latency budget as UDP viewers,
+so a slow tab loses frames (non-reference frames first) instead of holding memory for the whole stream.
+
+Classes:
+    WebSocketViewer: Sends the frames of one `DroneVideoStream` to one WebSocket.
+'''
+
+# Default Python
+import asyncio, struct
+
+from h264 import AccessUnit, NAL_SPS
+
+# Lets slow viewers fall behind without holding up the others.
+from subscriber_queue import SubscriberQueue, starts_decoding
+
+from config import VIDEO_WEBSOCKET_MAX_FRAMES
+
+LENGTH: struct.Struct = struct.Struct('!I')
+
+
+class WebSocketViewer:
+    """Sends the frames of one `DroneVideoStream` to one WebSocket.
+
+    Attributes:
+        websocket (WebSocket): The accepted WebSocket of the viewer.
+        stream (DroneVideoStream): The video stream being watched.
+        queue (SubscriberQueue): The frames waiting to be sent.
+    """
+
+    def __init__(self, websocket: object, stream: object) -> None:
+        self.websocket: object = websocket
+        self.stream: object = stream
+        self.queue: SubscriberQueue = SubscriberQueue(
+            self._send, max_depth=VIDEO_WEBSOCKET_MAX_FRAMES, ready=lambda: not self._sending
+        )
+
+        # The event loop of the WebSocket. Frames arrive on the `VideoEngine` thread.
+        self._loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+
+        # Only one message is written to the WebSocket at a time. The rest wait in `queue`.
+        self._sending: bool = False
+        self._closed: bool = False
+
+        # Set while nothing has been sent that the browser can start decoding at. Only used on the engine thread.
+        self._waiting_for_keyframe: bool = False
+
+    async def start(self) -> None:
+        """Send the frames since the last keyframe, then every new frame."""
+        def attach() -> list[bytes]:
+            # On the engine thread, so no frame is missed or sent twice between the two.
+            frames: list[bytes] = self.stream.gop_cache.replay_frames()
+            self._waiting_for_keyframe = not frames
+            self.stream.add_frame_listener(self._on_frame)
+            return frames
+
+        for data in await self._on_engine(attach):
+            self.queue.push(LENGTH.pack(len(data)) + data)
+
+    async def stop(self) -> None:
+        """Stop sending frames."""
+        self._closed = True
+        await self._on_engine(lambda: self.stream.remove_frame_listener(self._on_frame))
+
+    async def _on_engine(self, function: object) -> object:
+        async def call() -> object:
+            return function()
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(call(), self.stream.engine.loop))
+
+    def _on_frame(self, frame: AccessUnit) -> None:
+        # Called on the `VideoEngine` thread. Joining the frame is left to the WebSocket's thread.
+        prefix: bytes = b''
+        if self._waiting_for_keyframe:
+            if not starts_decoding(frame):
+                return
+            self._waiting_for_keyframe = False
+
+            # The SPS and PPS the keyframe is decoded with, unless it has them.
+            gop_cache = self.stream.gop_cache
+            if NAL_SPS not in frame.nal_types and gop_cache.sps is not None and gop_cache.pps is not None:
+                prefix = gop_cache.sps + gop_cache.pps
+
+        self._loop.call_soon_threadsafe(self._push, frame, prefix)
+
+    def _push(self, frame: AccessUnit, prefix: bytes = b'') -> None:
+        if not self._closed:
+            self.queue.push(LENGTH.pack(len(prefix) + frame.size) + prefix + frame.data(), frame)
+
+    def _send(self, data: bytes) -> bool:
+        if self._sending or self._closed:
+            return False
+
+        self._sending = True
+        self._loop.create_task(self._write(data))
+        return True
+
+    async def _write(self, data: bytes) -> None:
+        try:
+            await self.websocket.send_bytes(data)
+
+        # The viewer is gone. The route notices and calls `stop()`.
+        except Exception:
+            self.queue.send_failures += 1
+            self._closed = True
+
+        finally:
+            self._sending = False
+
+        if not self._closed:
+            self.queue.flush()
@@ -0,0 +1,264 @@
+'''Shard the multiplexed video ingest port over several worker processes.
+
+All video forwarding normally runs on the `VideoEngine` thread inside the uvicorn process, so one
+interpreter (and its GIL) bounds it. With `VIDEO_WORKERS` set in `config.py`, every worker process runs
+its own `VideoEngine` and binds the ingest port with `SO_REUSEPORT`. The kernel then spreads the senders
+over the workers by hashing their address, so every datagram from one relay socket goes to the same worker.
+
+A relay socket can land on any worker, so every worker knows every session and every subscriber. The API
+process stays the single place that knows the tickets:
+    - `DroneVideoStream`s in the API process register with the `VideoWorkerPool` instead of a `VideoEngine`.
+      The pool tells every worker to open (or close) a session with the same stream id.
+    - Workers pass viewers' `SUB` and `UNSUB` to the API process. The pool hands them to the session like
+      the engine would, and tells every worker about the subscribers that were added or removed.
+    - Replies to a viewer (`hello drone` or `FULL`) are sent by the worker that received its datagram,
+      from the shared port.
+    - Video from a relay never leaves the worker that received it. The relay that sent `RTS` is made the
+      publisher on every worker though, because the kernel moves senders when workers join or leave.
+
+Only sessions on the ingest port are sharded. Drones with a video port of their own stay on the
+`VideoEngine` of the API process.
+
+The video of a sharded session never reaches the API process, so it is only forwarded to UDP viewers.
+Everything that listens to the frames of the session there (WebSocket viewers, recording, HLS, snapshots,
+stats and the bandwidth buckets) gets nothing. The WebSocket route turns viewers of such sessions away.
+
+Classes:
+    VideoWorkerPool: Starts the worker processes and keeps their sessions and subscribers in sync.
+
+Functions:
+    get_video_workers: Returns the shared `VideoWorkerPool`, and creates it on first use.
+
+Example:
+    >>> workers = VideoWorkerPool(workers=4)
+    >>> stream = DroneVideoStream(VIDEO_INGEST_PORT, engine=workers, stream_id=1) # Opened on every worker.
+    >>> stream.issue_ticket() # Checked by the API process when a worker receives `SUB <ticket>`.
+    >>> stream.close()
+'''
+
+# Default Python
+import multiprocessing, threading
+
+from video_engine import VideoEngine, dispatch_control
+
+from config import VIDEO_INGEST_PORT, VIDEO_WORKERS
+
+
+def _worker_main(index: int, port: int, commands: multiprocessing.Queue, events: multiprocessing.Queue) -> None:
+    """The main function of a worker process. Runs until it gets `('stop',)`.
+
+    Args:
+        index (int): The number of the worker.
+        port (int): The ingest port.
+        commands (multiprocessing.Queue): Commands from the API process.
+        events (multiprocessing.Queue): Viewers' control messages and new publishers for the API process.
+    """
+    # Imported here, so the worker does not need anything from the API process but this module.
+    from drone_video_stream import DroneVideoStream
+
+    class WorkerVideoStream(DroneVideoStream):
+        # Tell the API process, so it can make the relay the publisher on every worker.
+        def publish(self, addr: tuple[str, int]) -> None:
+            super().publish(addr)
+            events.put(('publish', index, self.stream_id, addr))
+
+    engine = VideoEngine(
+        reuse_port=True,
+        on_control=lambda data, addr: events.put(('control', index, bytes(data), addr))
+    )
+    sessions: dict[int, DroneVideoStream] = {}
+
+    # Sessions are changed on the engine's loop, never while it is forwarding to them.
+    def publish(stream_id: int, addr: tuple[str, int]) -> None:
+        if stream_id in sessions:
+            sessions[stream_id].publisher = addr
+
+    def subscribe(stream_id: int, addr: tuple[str, int]) -> None:
+        if stream_id in sessions:
+            sessions[stream_id].add_subscriber(addr)
+
+            # Only the worker that receives the relay has frames in its GOP cache.
+            sessions[stream_id].send_gop(addr)
+
+    def unsubscribe(stream_id: int, addr: tuple[str, int]) -> None:
+        if stream_id in sessions:
+            sessions[stream_id].subscribers.pop(addr, None)
+
+    def send(data: bytes, addr: tuple[str, int]) -> None:
+        if engine._ingest is not None:
+            engine._ingest.sendto(data, addr)
+
+    while True:
+        command: tuple = commands.get()
+
+        if command[0] == 'open':
+            sessions[command[1]] = WorkerVideoStream(
+                port, engine=engine, stream_id=command[1], fec_group_size=command[2], publisher_token=command[3]
+            )
+
+        elif command[0] == 'close':
+            session = sessions.pop(command[1], None)
+            if session is not None:
+                session.close()
+
+        elif command[0] == 'publish':
+            engine.loop.call_soon_threadsafe(publish, command[1], command[2])
+
+        elif command[0] == 'subscribe':
+            engine.loop.call_soon_threadsafe(subscribe, command[1], command[2])
+
+        elif command[0] == 'unsubscribe':
+            engine.loop.call_soon_threadsafe(unsubscribe, command[1], command[2])
+
+        elif command[0] == 'send':
+            engine.loop.call_soon_threadsafe(send, command[1], command[2])
+
+        elif command[0] == 'stop':
+            break
+
+    engine.stop()
+
+
+class VideoWorkerPool:
+    """Worker processes that share the ingest port with `SO_REUSEPORT`.
+
+    To a `DroneVideoStream` in the API process the pool looks like a `VideoEngine`: it has `register()` and
+    `unregister()`, and it is the session's transport, so replies the session sends go back to a worker.
+
+    Attributes:
+        port (int): The ingest port.
+        streams (dict[int, DroneVideoStream]): The registered sessions in the API process, by stream id.
+        processes (list[multiprocessing.Process]): The worker processes.
+    """
+
+    def __init__(self, workers: int = VIDEO_WORKERS, port: int = VIDEO_INGEST_PORT) -> None:
+        self.port: int = port
+        self.streams: dict[int, object] = {}
+
+        # `spawn`, because forking the API process would copy its threads' locks in whatever state they are.
+        context = multiprocessing.get_context('spawn')
+        self._commands: list[multiprocessing.Queue] = [context.Queue() for _ in range(workers)]
+        self._events: multiprocessing.Queue = context.Queue()
+
+        self.processes: list[multiprocessing.Process] = [
+            context.Process(
+                target=_worker_main,
+                args=(index, port, self._commands[index], self._events),
+                name=f'VideoWorker-{index}',
+                daemon=True
+            )
+            for index in range(workers)
+        ]
+        for process in self.processes:
+            process.start()
+
+        # The worker whose viewer the session is answering. See `sendto()`.
+        self._reply_worker: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+        # One thread handles every control message from the workers.
+        self._thread: threading.Thread = threading.Thread(
+            target=self._handle_events,
+            name='VideoWorkerEvents',
+            daemon=True
+        )
+        self._thread.start()
+
+    def _broadcast(self, command: tuple) -> None:
+        for commands in self._commands:
+            commands.put(command)
+
+    def register(self, session: object) -> None:
+        """Open a session on every worker.
+
+        Args:
+            session (DroneVideoStream): The session to register. Must have a `stream_id`.
+
+        Raises:
+            ValueError: If the session has a video port of its own.
+        """
+        if session.stream_id is None:
+            raise ValueError("Only sessions on the ingest port can be sharded over worker processes.")
+
+        session.transport = self
+        with self._lock:
+            self.streams[session.stream_id] = session
+            self._broadcast((
+                'open', session.stream_id, session.fec.group_size if session.fec is not None else 0, session.publisher_token
+            ))
+
+    def unregister(self, session: object) -> None:
+        """Close a session on every worker.
+
+        Args:
+            session (DroneVideoStream): The session to unregister.
+        """
+        with self._lock:
+            # Under the lock, so the subscribers do not change while a viewer's control message is handled.
+            session.detach()
+            if self.streams.get(session.stream_id) is session:
+                self.streams.pop(session.stream_id)
+            self._broadcast(('close', session.stream_id))
+
+    def sendto(self, data: bytes, addr: tuple[str, int]) -> None:
+        """Send a reply to a viewer, from the worker that received the viewer's datagram."""
+        self._commands[self._reply_worker].put(('send', bytes(data), addr))
+
+    def _handle_events(self) -> None:
+        while True:
+            event: tuple = self._events.get()
+            if event[0] == 'stop':
+                break
+
+            with self._lock:
+                if event[0] == 'publish':
+                    self._publish(*event[1:])
+                else:
+                    self._control(*event[1:])
+
+    def _publish(self, worker: int, stream_id: int, addr: tuple[str, int]) -> None:
+        """Make a relay the publisher on every worker, not just the one that received its `RTS`."""
+        session = self.streams.get(stream_id)
+        if session is None or session.publisher == addr:
+            return
+
+        session.publisher = addr
+        for index, commands in enumerate(self._commands):
+            if index != worker:
+                commands.put(('publish', stream_id, addr))
+
+    def _control(self, worker: int, data: bytes, addr: tuple[str, int]) -> None:
+        """Hand a viewer's control message to its session, and tell every worker what changed."""
+        before: dict[int, set[tuple[str, int]]] = {
+            stream_id: set(session.subscribers) for stream_id, session in self.streams.items()
+        }
+
+        self._reply_worker = worker
+        dispatch_control(self.streams, data, addr)
+
+        for stream_id, session in self.streams.items():
+            subscribers: set[tuple[str, int]] = set(session.subscribers)
+            for added in subscribers - before.get(stream_id, set()):
+                self._broadcast(('subscribe', stream_id, added))
+            for removed in before.get(stream_id, set()) - subscribers:
+                self._broadcast(('unsubscribe', stream_id, removed))
+
+    def stop(self) -> None:
+        """Stop every worker process."""
+        self._broadcast(('stop',))
+        self._events.put(('stop',))
+        for process in self.processes:
+            process.join(timeout=5)
+        self._thread.join()
+
+
+_workers: VideoWorkerPool | None = None
+_workers_lock: threading.Lock = threading.Lock()
+
+def get_video_workers() -> VideoWorkerPool:
+    """Returns the shared `VideoWorkerPool` with `VIDEO_WORKERS` workers, and creates it on first use."""
+    global _workers
+    with _workers_lock:
+        if _workers is None:
+            _workers = VideoWorkerPool()
+        return _workers
@@ -0,0 +1,88 @@
+'''MessagePack request and response bodies for the relay routes.
+
+The relays call `/sync`, `/heartbeat`, `/cmd_queue` and `/drone/status_information` many times a second, so
+their bodies are encoded and decoded all the time. A relay that sends `Content-Type: application/msgpack`
+has its body decoded with MessagePack, straight into the route's Pydantic model, as if it was JSON. A relay
+that sends `Accept: application/msgpack` gets its answer encoded with MessagePack. Everything else is JSON,
+like before, so old relays and the REST clients keep working.
+
+See `benchmarks/wire_format.py` for what it saves.
+
+Classes:
+    NegotiatedResponse: A JSON response, or a MessagePack one if the request accepts it.
+    MessagePackRoute: A route that can read and write MessagePack bodies.
+
+Note:
+    MessagePack needs the `msgpack` package. Without it, every body is JSON.
+'''
+
+# Default Python
+from contextvars import ContextVar
+from typing import Any, Callable, Coroutine
+
+# FastAPI
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+
+# Optional. Without it every body is JSON.
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK: str = "application/msgpack"
+
+# If the request being answered accepts MessagePack. Set for every request by `MessagePackRoute`.
+_accepts_msgpack: ContextVar[bool] = ContextVar('_accepts_msgpack', default=False)
+
+
+class _MessagePackRequest(Request):
+    """A request with a MessagePack body, which FastAPI reads as if it was JSON."""
+
+    async def json(self) -> Any:
+        if not hasattr(self, '_json'):
+            self._json = msgpack.unpackb(await self.body())
+        return self._json
+
+
+class NegotiatedResponse(JSONResponse):
+    """A JSON response, or a MessagePack one if the request accepts it."""
+
+    def render(self, content: Any) -> bytes:
+        if _accepts_msgpack.get():
+            # Set before the headers are, so it is also the `Content-Type`.
+            self.media_type = MSGPACK
+            return msgpack.packb(content)
+
+        return super().render(content)
+
+
+class MessagePackRoute(APIRoute):
+    """A route that can read and write MessagePack bodies.
+
+    Use it for every route of a router with `APIRouter(route_class=MessagePackRoute,
+    default_response_class=NegotiatedResponse)`.
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        handler: Callable[[Request], Coroutine[Any, Any, Response]] = super().get_route_handler()
+        if msgpack is None:
+            return handler
+
+        async def route_handler(request: Request) -> Response:
+            if request.headers.get('content-type', '').startswith(MSGPACK):
+                # FastAPI only reads bodies it thinks are JSON with `json()`, so say it is.
+                scope: dict = dict(request.scope)
+                scope['headers'] = [
+                    (key, value) for key, value in request.scope['headers'] if key != b'content-type'
+                ] + [(b'content-type', b'application/json')]
+                request = _MessagePackRequest(scope, request.receive)
+
+            token = _accepts_msgpack.set(MSGPACK in request.headers.get('accept', ''))
+            try:
+                return await handler(request)
+            finally:
+                _accepts_msgpack.reset(token)
+
+        return route_handler
@@ -1,6 +1,8 @@
 import subprocess
 import socket
 import threading
+import uuid
+from time import time
 
 from pynput import keyboard
 import requests
@@ -33,6 +35,9 @@ class Controller:
 
         self.status = None  # Will be a string when updated
 
+        # Sent with every command, so the backend orders them by this controller's clock only.
+        self.client = uuid.uuid4().hex
+
         # Controller/Key Mapping Variables
 
         self.for_back_velocity = 0
@@ -80,10 +85,21 @@ class Controller:
         count = 0
         connection = None
 
+        # Get a ticket to subscribe to the drone's video stream.
+        query = {'name': self.drone, 'parent': self.relay}
+        response = requests.post(
+            f'{BACKEND_URL}/drone/video/subscribe', json=query, auth=self.HTTPAuthentication)
+
+        if not response.ok:
+            log.critical(f'Could not get a video ticket: {response.status_code}')
+            return
+
+        subscribe_message = f"SUB {response.json().get('ticket')}".encode('utf-8')
+
         # Await Backend Verification
         while not verified:
             try:
-                announcement_socket.send(b'Hello backend!')
+                announcement_socket.send(subscribe_message)
 
             except socket.error as exception:
                 log.error(f'Could not send RTS: {exception}')
@@ -99,6 +115,10 @@ class Controller:
                 log.critical("Could Not Verify With Backend")
                 return
 
+            if connection == b'FULL':
+                log.critical("The drone already has the maximum number of viewers")
+                return
+
             if connection:
                 log.debug("Verification Complete")
                 verified = True
@@ -167,7 +187,8 @@ class Controller:
 
         # Send Command to Backend
         query = {'relay_name': self.relay, 'drone_name': self.drone, 'cmd': [
-            self.left_right_velocity, self.for_back_velocity, self.up_down_velocity, self.yaw_velocity]}
+            self.left_right_velocity, self.for_back_velocity, self.up_down_velocity, self.yaw_velocity],
+            'client': self.client, 'issued': time() * 1000}
         print(query)
         response = requests.post(
             f'{BACKEND_URL}/drone/new_command', json=query, auth=self.HTTPAuthentication)
@@ -3,13 +3,33 @@ import "./Navbar.css";
 import droneTakeoff from "../utilities/keyboardlistener";
 import "./DroneControlPanel.css";
 import config from "../../../config.json";
+import Cookies from "js-cookie";
+
+// Find the NAL units of the given type in an H.264 frame in Annex B format.
+function findNalUnit(frame, type) {
+  for (let i = 0; i + 3 < frame.length; i++) {
+    if (frame[i] === 0 && frame[i + 1] === 0 && frame[i + 2] === 1 && (frame[i + 3] & 0x1f) === type) {
+      return i + 3;
+    }
+  }
+  return -1;
+}
+
+// The WebCodecs codec string (for example "avc1.64001f") from the SPS of a keyframe.
+function codecFromSps(frame) {
+  const sps = findNalUnit(frame, 7);
+  if (sps === -1 || sps + 3 >= frame.length) {
+    return null;
+  }
+  const hex = (byte) => byte.toString(16).padStart(2, "0");
+  return `avc1.${hex(frame[sps + 1])}${hex(frame[sps + 2])}${hex(frame[sps + 3])}`;
+}
 
 function DroneControlPanel(props) {
   const [relay, drone] = props.connectDrone.split("-");
   const [showTakeoffBtn, setTakeoffBtn] = useState(true);
   const [showLandBtn, setLandBtn] = useState(false);
-  const [frame, setFrame] = useState('');
-  const socket = useRef(null);
+  const canvas = useRef(null);
 
   useEffect(() => {
     const interval = setInterval(() => {
@@ -24,24 +44,67 @@ function DroneControlPanel(props) {
       }
     }, 100);
 
-    socket.current = new WebSocket(`ws://${config.BASE_URL}/`);
-    socket.current.onmessage = (event) => {
-      setFrame(event.data);
-    };
-
     return () => {
       clearInterval(interval);
-      socket.current.close();
     }
   }, [relay, drone, props.relayData, setTakeoffBtn]);
 
+  // The video of the drone. Only reconnect when another drone is chosen.
+  useEffect(() => {
+    if (!relay || !drone) {
+      return;
+    }
+
+    const token = encodeURIComponent(Cookies.get("access_token") || "");
+    const socket = new WebSocket(`ws://${config.BASE_URL}/v1/api/frontend/drone/video/${relay}/${drone}?token=${token}`);
+    socket.binaryType = "arraybuffer";
+    let decoder = null;
+
+    socket.onmessage = (event) => {
+      // Every message is one H.264 frame in Annex B format, after its length (4 bytes).
+      const frame = new Uint8Array(event.data, 4);
+      const keyframe = findNalUnit(frame, 5) !== -1;
+
+      // The first frame is a keyframe with the SPS, which says how to decode the stream.
+      if (decoder === null) {
+        const codec = codecFromSps(frame);
+        if (codec === null) {
+          return;
+        }
+        decoder = new VideoDecoder({
+          output: (videoFrame) => {
+            if (canvas.current) {
+              canvas.current.width = videoFrame.displayWidth;
+              canvas.current.height = videoFrame.displayHeight;
+              canvas.current.getContext("2d").drawImage(videoFrame, 0, 0);
+            }
+            videoFrame.close();
+          },
+          error: (error) => console.error(error),
+        });
+        decoder.configure({ codec: codec, optimizeForLatency: true });
+      }
+
+      decoder.decode(new EncodedVideoChunk({
+        type: keyframe ? "key" : "delta",
+        timestamp: event.timeStamp * 1000,
+        data: frame,
+      }));
+    };
+
+    return () => {
+      socket.close();
+      if (decoder !== null && decoder.state !== "closed") {
+        decoder.close();
+      }
+    }
+  }, [relay, drone]);
+
   return (
     <>
       <div className="control-panel">
         <div className="video-feed-container">
-          <video className="video-feed">
-            <img src={`data:image/jpeg;base64,${frame}`} alt="Video Frame" />
-          </video>
+          <canvas className="video-feed" ref={canvas} />
         </div>
         <div className="controls-container">
           <div className="btn-container">
@@ -6,6 +6,11 @@ let up_down_velocity = 0;
 let yaw_velocity = 0;
 let vel_speed = 50;
 
+// When the last command was sent (ms). Grows with every command, so the backend can drop one that arrives
+// after a newer one. The backend only compares it with the commands of the same client, this page.
+let last_issued = 0;
+const client = Math.random().toString(36).slice(2);
+
 document.addEventListener("keyup", function (event) {
   if (
     Cookies.get("relayName") !== undefined &&
@@ -114,6 +119,8 @@ document.addEventListener("keydown", function (event) {
 });
 
 function sendCMDToBackend(cmd_velocity) {
+  last_issued = Math.max(Date.now(), last_issued + 1);
+
   fetch(`http://${config.BASE_URL}/v1/api/frontend/drone/new_command`, {
     method: "POST",
     headers: {
@@ -124,6 +131,8 @@ function sendCMDToBackend(cmd_velocity) {
       relay_name: Cookies.get("relayName"),
       drone_name: Cookies.get("droneName"),
       cmd: cmd_velocity,
+      client: client,
+      issued: last_issued,
     }),
   });
 }
@@ -0,0 +1,51 @@
+'''The time of the backend, to tell how old a command from it is.
+
+The backend stamps every rc command with the time it got it from the user (see `Drone.command()` in the
+backend). The clocks of the relaybox and the backend are not the same, so the relaybox estimates how far ahead
+the backend's clock is from the `time` in the answers to `/sync`, like NTP does: the backend read its clock
+about halfway between sending the request and getting the answer. The answer that took the shortest time of
+the last `SAMPLES` is the best estimate, since it was held up the least on the way.
+
+Classes:
+    BackendClock: The estimated time of the backend.
+'''
+
+import threading
+from collections import deque
+from time import time
+
+# The answers to estimate from. At `RELAY_SYNC_RATE` 20, the last 5 seconds.
+SAMPLES: int = 100
+
+
+class BackendClock:
+    """The estimated time of the backend.
+
+    Attributes:
+        offset (float): How many seconds the backend's clock is ahead of the relaybox's.
+    """
+
+    def __init__(self) -> None:
+        self.offset: float = 0
+
+        # (round trip, offset) of the last answers.
+        self.samples: deque[tuple[float, float]] = deque(maxlen=SAMPLES)
+        self.lock: threading.Lock = threading.Lock()
+
+    def sample(self, backend_time: float, sent: float, received: float) -> None:
+        """Estimate the offset again, with the time in an answer from the backend.
+
+        Arguments:
+            backend_time (float): The time of the backend in the answer.
+            sent (float): When the request was sent, by the relaybox's clock.
+            received (float): When the answer was received, by the relaybox's clock.
+        """
+        with self.lock:
+            self.samples.append((received - sent, backend_time - (sent + received) / 2))
+            self.offset = min(self.samples)[1]
+
+    def now(self) -> float | None:
+        """Returns the time of the backend (seconds since 1970), or `None` before the first answer."""
+        if not self.samples:
+            return None
+        return time() + self.offset
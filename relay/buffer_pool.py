@@ -0,0 +1,96 @@
+'''A bounded pool of preallocated buffers for receiving video datagrams.
+
+Receiving with `socket.recvfrom()` allocates a new `bytes` object for every datagram. Instead the video
+thread of every drone receives into a `Slab` from one shared pool with `recvfrom_into()`, sends it to the
+backend as a `memoryview` of the slab, and releases the slab back to the pool.
+
+Example:
+    >>> slab = video_buffer_pool.acquire()
+    >>> size, addr = sock.recvfrom_into(slab.buffer)
+    >>> sock.sendto(slab.view[:size], backend)
+    >>> video_buffer_pool.release(slab)
+'''
+import threading
+
+
+class Slab:
+    """A fixed-size buffer from a `BufferPool`.
+
+    Attributes:
+        buffer (bytearray): The buffer to receive into.
+        view (memoryview): A `memoryview` of `buffer`. Slice it to send a datagram without copying.
+        pooled (bool): `False` if the pool was exhausted and this slab was allocated just for this datagram.
+    """
+    __slots__ = ('buffer', 'view', 'pooled')
+
+    def __init__(self, size: int, pooled: bool = True) -> None:
+        self.buffer: bytearray = bytearray(size)
+        self.view: memoryview = memoryview(self.buffer)
+        self.pooled: bool = pooled
+
+
+class BufferPool:
+    """A bounded pool of `Slab`s that are allocated once and reused by every drone's video thread.
+
+    If every slab is in use, `acquire()` still returns a slab, but a temporary one that is not returned
+    to the pool. This is counted in `exhausted`.
+
+    Attributes:
+        slab_size (int): The size of every slab in bytes.
+        capacity (int): The number of slabs in the pool.
+        in_use (int): Slabs from the pool that are currently acquired.
+        high_water_mark (int): The most slabs that have been in use at the same time.
+        exhausted (int): How many times `acquire()` found the pool empty.
+    """
+
+    def __init__(self, slab_size: int = 2048, capacity: int = 64) -> None:
+        self.slab_size: int = slab_size
+        self.capacity: int = capacity
+        self.in_use: int = 0
+        self.high_water_mark: int = 0
+        self.exhausted: int = 0
+
+        # Preallocate every slab.
+        self._free: list[Slab] = [Slab(slab_size) for _ in range(capacity)]
+
+        # Every drone has its own video thread, so the counters are updated under a lock.
+        self._lock: threading.Lock = threading.Lock()
+
+    def acquire(self) -> Slab:
+        """Get a slab to receive into.
+
+        Returns:
+            Slab: A slab from the pool, or a temporary slab if the pool is exhausted.
+        """
+        with self._lock:
+            if not self._free:
+                self.exhausted += 1
+                return Slab(self.slab_size, pooled=False)
+
+            self.in_use += 1
+            self.high_water_mark = max(self.high_water_mark, self.in_use)
+            return self._free.pop()
+
+    def release(self, slab: Slab) -> None:
+        """Give a slab back to the pool once its datagram has been sent.
+
+        Args:
+            slab (Slab): A slab from `acquire()`.
+        """
+        # Temporary slabs are left to the garbage collector.
+        if not slab.pooled:
+            return
+
+        with self._lock:
+            self.in_use -= 1
+            self._free.append(slab)
+
+    def stats(self) -> dict[str, int]:
+        """Returns the counters of the pool."""
+        return {
+            'slab_size': self.slab_size,
+            'capacity': self.capacity,
+            'in_use': self.in_use,
+            'high_water_mark': self.high_water_mark,
+            'exhausted': self.exhausted,
+        }
@@ -1,2 +1,52 @@
 BACKEND_IP = 'localhost'
 BACKEND_URL = f'http://{BACKEND_IP}:8000/v1/api/relay'
+
+# Preallocated buffers shared by the video threads of every drone. See `buffer_pool.py`.
+VIDEO_BUFFER_POOL_SLABS = 64
+VIDEO_BUFFER_SIZE = 2048
+
+# Send the video of every drone to the backend's one multiplexed ingest port, with a header
+# that says which drone it is from (see `video_header.py`). `False` uses a video port per drone.
+VIDEO_MULTIPLEXED = True
+
+# Put when every video datagram was sent in its header, so the backend can tell if the delay on the way
+# grows. Only when multiplexed.
+VIDEO_SEND_TIME = True
+
+# Send a parity datagram after every `VIDEO_FEC_GROUP_SIZE` video datagrams, so the backend can rebuild one
+# lost datagram in every group (see `fec.py`). 0 turns it off. `VIDEO_FEC_GROUP_SIZES` sets it for single
+# drones by name, for example `{'drone 1': 10}` for a drone on a lossy 4G uplink. Only when multiplexed.
+VIDEO_FEC_GROUP_SIZE = 0
+VIDEO_FEC_GROUP_SIZES = {}
+
+# Keep a WebSocket open to the backend, which pushes the takeoffs, landings and rc commands of the drones
+# on it (see `Relaybox.command_channel()`). The drones poll the backend while it is closed, or if this is
+# `False`. Needs the `websocket-client` package.
+COMMAND_CHANNEL = True
+COMMAND_CHANNEL_URL = f'ws://{BACKEND_IP}:8000/v1/api/relay/commands'
+
+# Seconds between sending the newest pushed rc command to a drone again, so it does not land by itself.
+RC_RESEND_INTERVAL = 0.5
+
+# Seconds a flying drone keeps its rc command without hearing from the backend (a command, an answer to
+# `/sync` or `/cmd_queue`, or a pong on the command channel). After that it hovers until the link is back.
+RC_LINK_TIMEOUT = 2
+
+# Seconds the backend may hold a long-poll of `/cmd_queue` while the command channel is closed. The backend
+# answers sooner if the command changes, and holds it for at most its own `CMD_QUEUE_LONG_POLL_TIMEOUT`.
+CMD_QUEUE_LONG_POLL = 20
+
+# Sync every drone with the backend in one request to `/sync`, `RELAY_SYNC_RATE` times a second, instead of a
+# heartbeat and a status, takeoff, landing and command request stream per drone (see `Relaybox.sync()`).
+RELAY_SYNC = True
+RELAY_SYNC_RATE = 20
+
+# Send the requests to the backend that are made all the time with MessagePack bodies instead of JSON
+# (see `wire_format.py`). Needs the `msgpack` package.
+WIRE_FORMAT_MSGPACK = True
+
+# Seconds an rc command may be old, by the backend's clock (see `backend_clock.py`), when the relaybox gets it
+# or sends it to the drone again. An older one is dropped and the drone hovers instead, since the user may have
+# moved the sticks since. So a client holding a stick sends its command again faster than this. Only once the
+# relaybox has synced and knows the backend's clock.
+RC_COMMAND_DEADLINE = 0.5
@@ -3,19 +3,28 @@ import socket
 import threading
 from time import sleep, time
 import re
+import json
 from http import HTTPStatus
 
 import requests
 
+# Optional. Without it the drones poll the backend for their commands.
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
 from models.json_web_token.jwt_model import JWT
 from models.http_bearer import HTTPBearer
 
 
 from tello_edu_drone import TelloEDUDrone as Drone
+from backend_clock import BackendClock
+from wire_format import body, decode
 
 from logger_config import log
 
-from config import BACKEND_URL
+from config import BACKEND_URL, COMMAND_CHANNEL, COMMAND_CHANNEL_URL, RC_LINK_TIMEOUT, RELAY_SYNC, RELAY_SYNC_RATE
 
 
 class Relaybox:
@@ -49,6 +58,15 @@ class Relaybox:
             socket.AF_INET, socket.SOCK_DGRAM)
         self.response_socket.bind(('', 8889))
 
+        # Set while the command channel to the backend is open, so the drones do not poll for their commands.
+        self.commands_pushed: threading.Event = threading.Event()
+
+        # Set while `/sync` works, so the drones do not poll or post their status, and there is no heartbeat.
+        self.synced: threading.Event = threading.Event()
+
+        # The time of the backend, estimated from the answers to `/sync`, to tell how old a command is.
+        self.backend_clock: BackendClock = BackendClock()
+
     def authenticate_API(self) -> None:
         credentials: dict = {
             'name': self.name,
@@ -72,6 +90,9 @@ class Relaybox:
             # Now, retrieve the scheme and token.
             scheme, token = response.json().get('access_token').split()
 
+            # Kept as it is, for the `Authorization` header of the command channel.
+            self.access_token: str = f'{scheme} {token}'
+
             # Create and store the token as a JWT.
             self.JWT = JWT(token, scheme)
 
@@ -112,6 +133,24 @@ class Relaybox:
             name='HeartbeatThread'
         ).start()
 
+        # Start a new thread with the sync, which replaces the heartbeat while it works.
+        if RELAY_SYNC:
+            log.info("[THREAD] Starting sync...")
+            threading.Thread(
+                target=self.sync,
+                name='SyncThread'
+            ).start()
+
+        # Start a new thread with the command channel, if it can be used.
+        if COMMAND_CHANNEL and websocket is not None:
+            log.info("[THREAD] Opening command channel...")
+            threading.Thread(
+                target=self.command_channel,
+                name='CommandChannelThread'
+            ).start()
+        elif COMMAND_CHANNEL:
+            log.warning("websocket-client is not installed. The drones poll the backend for their commands.")
+
     def heartbeat(self, interval: int = 3) -> None:
         """Maintain a connection with the backend.
 
@@ -120,14 +159,19 @@ class Relaybox:
         It also updates the backend with new information about its connected Tello drones
         """
         while True:
+            # `sync()` refreshes the heartbeat while it works.
+            if self.synced.is_set():
+                sleep(interval)
+                continue
+
             try:
                 query = {'name': self.name}
-                response = requests.get(
+                response = decode(requests.get(
                     f'{BACKEND_URL}/heartbeat',
                     auth=self.HTTPAuthorization,
                     timeout=10,
-                    json=query
-                ).json()
+                    **body(query)
+                ))
 
             except requests.exceptions.Timeout:
                 log.error("Heartbeat timed out")
@@ -143,6 +187,166 @@ class Relaybox:
             )
             sleep(interval)
 
+    def sync(self) -> None:
+        """Sync every drone with the backend in one request, `RELAY_SYNC_RATE` times a second.
+
+        Uploads the newest status of every drone and refreshes the heartbeat. The backend answers with what
+        changed for the drones since the last sync: new rc commands, takeoffs and landings, which are handed to
+        the drones like pushed commands, and the drones it has if that changed. While it works, `synced` is
+        set, so the drones and the heartbeat leave the backend alone. If it fails they take over again.
+
+        It also uploads how old the rc commands of every drone were when they got them, and the time in the
+        answer keeps `backend_clock` right.
+        """
+        interval: float = 1 / RELAY_SYNC_RATE
+
+        # The versions of the command queues, and the membership, the relaybox has seen.
+        versions: dict[str, int] = {}
+        membership: int | None = None
+
+        while True:
+            started: float = time()
+
+            statuses: dict[str, str] = {}
+            ages: dict[str, list[float]] = {}
+            stale: dict[str, int] = {}
+            drones: dict[str, Drone] = {name: drone.get('objectId') for name, drone in list(self.drones.items())}
+            for name, drone in drones.items():
+                status: str | None = drone.take_status()
+                if status is not None:
+                    statuses[name] = status
+
+                drone_ages, drone_stale = drone.take_command_ages()
+                if drone_ages:
+                    ages[name] = drone_ages
+                if drone_stale:
+                    stale[name] = drone_stale
+
+            query = {
+                'name': self.name,
+                'statuses': statuses,
+                'versions': {name: version for name, version in versions.items() if name in drones},
+                'membership': membership,
+                'ages': ages,
+                'stale': stale
+            }
+
+            sent: float = time()
+            try:
+                response = requests.post(
+                    f'{BACKEND_URL}/sync',
+                    auth=self.HTTPAuthorization,
+                    timeout=2,
+                    **body(query)
+                )
+
+            except requests.exceptions.RequestException as exception:
+                log.error(f'Sync failed with exception: {exception}')
+                self.synced.clear()
+                sleep(1)
+                continue
+
+            if not response.ok:
+                log.error(f'Sync failed with code {response.status_code}')
+                self.synced.clear()
+                sleep(1)
+                continue
+
+            self.synced.set()
+            self.backend_reached()
+            changes: dict = decode(response)
+
+            # Before handing over the commands, so their age is by the newest estimate.
+            if 'time' in changes:
+                self.backend_clock.sample(changes['time'], sent, time())
+
+            for name, change in changes.get('drones', {}).items():
+                drone: Drone | None = drones.get(name)
+                if drone is None:
+                    continue
+
+                if 'version' in change:
+                    versions[name] = change['version']
+                    drone.on_command({
+                        'drone': name, 'type': 'rc', 'cmd': change['rc'], 'version': change['version'],
+                        'issued': change.get('issued')
+                    })
+                if change.get('takeoff'):
+                    drone.on_command({'drone': name, 'type': 'takeoff'})
+                if change.get('land'):
+                    drone.on_command({'drone': name, 'type': 'land'})
+
+            # Check if backend data is up to date with the data the relay has.
+            if 'members' in changes:
+                log.info(f'Sync | {self.name}: {changes["members"]} on the backend, {list(self.drones)} here')
+            membership = changes.get('membership')
+
+            sleep(max(0, interval - (time() - started)))
+
+    def backend_reached(self) -> None:
+        """Tell every drone that the link to the backend works, so they keep flying with their rc commands."""
+        for drone in list(self.drones.values()):
+            drone.get('objectId').backend_reached()
+
+    def command_channel(self) -> None:
+        """Receive the commands for the drones, pushed by the backend.
+
+        Keeps a WebSocket open to the backend's `/commands`, and hands every message on it to its drone.
+        While it is open, `commands_pushed` is set and the drones do not poll the backend. If it closes,
+        the drones poll again until it is opened again. While it is quiet it is pinged, so the drones know
+        the link works.
+
+        Notes:
+            See `command_channel.py` in the backend for the messages.
+        """
+        while True:
+            try:
+                connection = websocket.create_connection(
+                    COMMAND_CHANNEL_URL,
+                    header=[f'Authorization: {self.access_token}'],
+                    timeout=10
+                )
+
+            except (websocket.WebSocketException, OSError) as exception:
+                log.error(f'Unable to open the command channel with exception: {exception}')
+                sleep(5)
+                continue
+
+            log.info('Command channel open')
+            connection.settimeout(RC_LINK_TIMEOUT / 2)
+            self.commands_pushed.set()
+
+            try:
+                while True:
+                    try:
+                        opcode, data = connection.recv_data(control_frame=True)
+
+                    # Quiet for a while. Ping, so the pong tells the drones the link still works.
+                    except websocket.WebSocketTimeoutException:
+                        connection.ping()
+                        continue
+
+                    self.backend_reached()
+                    if opcode != websocket.ABNF.OPCODE_TEXT:
+                        continue
+
+                    message: dict = json.loads(data)
+
+                    # The drone may have disconnected since.
+                    drone: dict | None = self.drones.get(message.get('drone'))
+                    if drone is not None:
+                        drone.get('objectId').on_command(message)
+
+            except (websocket.WebSocketException, OSError, ValueError) as exception:
+                log.error(f'Command channel closed with exception: {exception}')
+
+            # The drones poll until it is open again.
+            finally:
+                self.commands_pushed.clear()
+                connection.close()
+
+            sleep(1)
+
     def scan_for_drone(self) -> None:
         """
         Scans the local network for drones and filters out unauthorized and
@@ -283,7 +487,10 @@ class Relaybox:
             parent=self.name,
             host_IP=host_IP,
             status_port=status_port,
-            response_socket=self.response_socket
+            response_socket=self.response_socket,
+            commands_pushed=self.commands_pushed,
+            synced=self.synced,
+            backend_time=self.backend_clock.now
         )
 
         # Append the new created drone to the relayboxs list of active drones.
@@ -307,7 +514,7 @@ class Relaybox:
         # Remove the status port so it can be re-used.
         self.used_status_ports.remove(object.status_port)
 
-        # Set to False to end the threads: video, status, rc and land. This has to be done before closing the sockets to avoid a socket error.
+        # Set to False to end the threads: video, status, rc, land and command queue. This has to be done before closing the sockets to avoid a socket error.
         object.drone_active: bool = False
 
         # Close the status and video socket to allow a new drone to use it.
@@ -1,12 +1,34 @@
 import socket
 import threading
-from time import sleep
-
-from config import BACKEND_URL
+from collections import deque
+from time import sleep, time
+from typing import Callable
+
+from config import (
+    BACKEND_URL,
+    CMD_QUEUE_LONG_POLL,
+    RC_COMMAND_DEADLINE,
+    RC_LINK_TIMEOUT,
+    RC_RESEND_INTERVAL,
+    VIDEO_BUFFER_POOL_SLABS,
+    VIDEO_BUFFER_SIZE,
+    VIDEO_FEC_GROUP_SIZE,
+    VIDEO_FEC_GROUP_SIZES,
+    VIDEO_MULTIPLEXED,
+    VIDEO_SEND_TIME
+)
 
 import requests
 from logger_config import log
 
+from buffer_pool import BufferPool, Slab
+from video_header import FLAG_SEND_TIME, VIDEO_HEADER, pack_header
+from fec import ParityEncoder
+from wire_format import body, decode
+
+# One pool of video buffers for every drone on the relaybox.
+video_buffer_pool: BufferPool = BufferPool(VIDEO_BUFFER_SIZE, VIDEO_BUFFER_POOL_SLABS)
+
 
 class TelloEDUDrone:
     """A model of a Tello drone
@@ -24,7 +46,10 @@ class TelloEDUDrone:
         parent: str,
         host_IP: str,
         status_port: int,
-        response_socket: socket.socket
+        response_socket: socket.socket,
+        commands_pushed: threading.Event | None = None,
+        synced: threading.Event | None = None,
+        backend_time: Callable[[], float | None] = lambda: None
     ) -> None:
         """Creates a drone based on a name, a parrent (relaybox), host_IP, status_port and a socket.
 
@@ -34,12 +59,30 @@ class TelloEDUDrone:
             host_IP (str): The IP of the drone.
             status_port (int): The port that the drone should send status messages to.
             response_socket (socket.socket): A socket for receiving a response when a command have been sent.
+            commands_pushed (threading.Event | None): Set while the relaybox's command channel is open, so the
+                drone gets its commands from `on_command()` instead of polling the backend.
+            synced (threading.Event | None): Set while the relaybox syncs with the backend, which uploads the
+                drone's status from `take_status()` and hands it its commands with `on_command()`.
+            backend_time (Callable[[], float | None]): Returns the time of the backend, to tell how old a command
+                is, or `None` while it is not known. Commands are not checked for their age until it is.
         """
         self.name: str = name
         self.host_IP: str = host_IP
         self.video_port: int | None = None
         self.status_port: int = status_port
 
+        # The stream id on the backend's multiplexed ingest port, or `None` if the drone has its own video port.
+        self.stream_id: int | None = None
+
+        # Sent with `RTS`, so the backend knows the video is from this relay. Given by `/new_drone`.
+        self.publisher_token: str | None = None
+
+        # The video datagrams per parity datagram, or 0 for none. Only when multiplexed.
+        self.fec_group_size: int = VIDEO_FEC_GROUP_SIZES.get(name, VIDEO_FEC_GROUP_SIZE)
+
+        # The local port the drone sends video to. The same as `video_port`, unless multiplexed.
+        self.local_video_port: int | None = None
+
         # The relaybox that the drone belongs to.
         self.parent: str = parent
 
@@ -68,6 +111,117 @@ class TelloEDUDrone:
 
         self.query = {'name': self.name, 'parent': self.parent}
 
+        # The commands pushed by the backend. See `on_command()`.
+        self.commands_pushed: threading.Event = commands_pushed or threading.Event()
+        self.synced: threading.Event = synced or threading.Event()
+        self.should_takeoff: threading.Event = threading.Event()
+        self.should_land: threading.Event = threading.Event()
+        self.rc_command: list[int] = [0, 0, 0, 0]
+        self.rc_changed: threading.Event = threading.Event()
+
+        # When the backend was last heard from, by the relaybox's clock. See `backend_reached()`.
+        self.backend_reached_at: float = time()
+
+        # The version and issue time (by the backend's clock) of the newest rc command. See `set_rc_command()`.
+        self.backend_time: Callable[[], float | None] = backend_time
+        self.rc_version: int | None = None
+        self.rc_issued: float | None = None
+
+        # How old (ms) the rc commands were, and how many were stale, since the relaybox's last sync. Only the
+        # newest ages are kept while it does not sync.
+        self.rc_ages: deque[float] = deque(maxlen=100)
+        self.rc_stale: int = 0
+        self.rc_lock: threading.Lock = threading.Lock()
+
+        # The newest status that has not been uploaded by the relaybox's sync.
+        self.status: str | None = None
+
+    def commands_delivered(self) -> bool:
+        """If the commands are pushed or synced by the relaybox, so the drone does not have to poll for them."""
+        return self.commands_pushed.is_set() or self.synced.is_set()
+
+    def take_status(self) -> str | None:
+        """Returns the newest status that has not been taken yet, or `None`."""
+        status, self.status = self.status, None
+        return status
+
+    def backend_reached(self) -> None:
+        """Note that the link to the backend works, so `rc_thread()` keeps flying with the rc command."""
+        self.backend_reached_at = time()
+
+    def set_rc_command(self, cmd: list[int], version: int | None = None, issued: float | None = None) -> None:
+        """Fly with a new rc command from the backend, unless a newer one came first.
+
+        The same command may come both pushed and synced, and a pushed one may overtake a long-polled one, so
+        a command with the version of the newest one, or issued before it, is dropped. A command older than
+        `RC_COMMAND_DEADLINE` is too late to fly: the drone hovers instead (see also `hover_if_stale()`).
+
+        Arguments:
+            cmd (list[int]): The rc command.
+            version (int | None): Its version, if the backend sent one.
+            issued (float | None): When the backend got it (seconds since 1970, by its clock), if it sent it.
+        """
+        with self.rc_lock:
+            if version is not None and version == self.rc_version:
+                return
+            if issued is not None and self.rc_issued is not None and issued < self.rc_issued:
+                log.debug(f'[{self.name}] Dropped rc command {version}, a newer one came first')
+                return
+
+            self.rc_version = version
+            self.rc_command = cmd
+            if issued is not None:
+                self.rc_issued = issued
+
+                now: float | None = self.backend_time()
+                if now is not None:
+                    self.rc_ages.append(round((now - issued) * 1000, 1))
+                    self.hover_if_stale(now)
+
+            self.rc_changed.set()
+
+    def hover_if_stale(self, now: float) -> None:
+        """Hover if the rc command is older than `RC_COMMAND_DEADLINE`. Call it holding `rc_lock`.
+
+        Arguments:
+            now (float): The time of the backend.
+        """
+        if self.rc_issued is None or self.rc_command == [0, 0, 0, 0]:
+            return
+
+        age: float = now - self.rc_issued
+        if age > RC_COMMAND_DEADLINE:
+            log.warning(f'[{self.name}] rc command {self.rc_version} is {age:.2f} s old, hovering instead')
+            self.rc_stale += 1
+            self.rc_command = [0, 0, 0, 0]
+
+    def take_command_ages(self) -> tuple[list[float], int]:
+        """Returns how old (ms) the rc commands were, and how many were stale, since this was last called."""
+        with self.rc_lock:
+            ages: list[float] = list(self.rc_ages)
+            self.rc_ages.clear()
+            stale, self.rc_stale = self.rc_stale, 0
+        return ages, stale
+
+    def on_command(self, message: dict) -> None:
+        """Handle a command pushed by the backend over the relaybox's command channel.
+
+        Arguments:
+            message (dict): The command, like `{'drone': 'drone_001', 'type': 'rc', 'cmd': [0, 0, 0, 0],
+                'version': 41, 'issued': 1718000000.25}`.
+        """
+        log.debug(f'[{self.name}] Pushed command: {message}')
+        self.backend_reached()
+
+        if message.get('type') == 'takeoff':
+            self.should_takeoff.set()
+
+        elif message.get('type') == 'land':
+            self.should_land.set()
+
+        elif message.get('type') == 'rc':
+            self.set_rc_command(message.get('cmd'), message.get('version'), message.get('issued'))
+
     def start(self) -> None:
         """Starts the necesary logic for the drone to connect to the backend and a client.
 
@@ -96,10 +250,10 @@ class TelloEDUDrone:
 
         if self.drone_active:
             log.debug(
-                f'[{self.name}] Telling drone to use port {self.video_port} for streamon...')
+                f'[{self.name}] Telling drone to use a port for streamon...')
             self.set_drone_ports()
             log.debug(
-                f"{self.name} used {self.video_port} port for streamon")
+                f"{self.name} used {self.local_video_port} port for streamon")
 
         # Ready To Stream (RTS) handshake with backend
         if self.drone_active:
@@ -119,7 +273,7 @@ class TelloEDUDrone:
 
         if self.drone_active:
             # Start Threads for each process
-            log.debug(f"[{self.name}]: Starting the 4 required threads.")
+            log.debug(f"[{self.name}]: Starting the 5 required threads.")
 
             threading.Thread(
                 name='VideoThread',
@@ -141,6 +295,11 @@ class TelloEDUDrone:
                 name='LandingThread'
             ).start()
 
+            threading.Thread(
+                target=self.cmd_queue_thread,
+                name='CommandQueueThread'
+            ).start()
+
             log.debug(f"[{self.name}]: All threads have started.")
 
     def status_thread(self) -> None:
@@ -155,6 +314,11 @@ class TelloEDUDrone:
             # Receive the status update and the address it came from.
             status, addr = self.status_socket.recvfrom(self.buffer_size)
 
+            # The relaybox uploads the newest one with its sync.
+            if self.synced.is_set():
+                self.status = status.decode('utf-8')
+                continue
+
             # We do not want to spam the backend, therefore we wait 100ms.
             sleep(0.1)
 
@@ -166,7 +330,7 @@ class TelloEDUDrone:
             }
 
             requests.post(
-                f'{BACKEND_URL}/drone/status_information', json=query)
+                f'{BACKEND_URL}/drone/status_information', **body(query))
 
     def landing_thread(self) -> None:
         """Check if the drone should land.
@@ -176,12 +340,19 @@ class TelloEDUDrone:
         """
         # Continuously listen for status updates while the drone is active.
         while self.drone_active:
-            should_land = requests.get(
-                f'{BACKEND_URL}/drone/should_land', json=self.query)
-            sleep(0.1)
+            # Pushed by the backend while the command channel is open, or synced.
+            if self.commands_delivered():
+                land: bool = self.should_land.wait(0.1)
+
+            else:
+                should_land = requests.get(
+                    f'{BACKEND_URL}/drone/should_land', json=self.query)
+                sleep(0.1)
+                land = '<Response [200]>' == str(should_land)
 
             # If the backend indicates that the drone should land
-            if '<Response [200]>' == str(should_land):
+            if land:
+                self.should_land.clear()
                 self.takeoff = False
                 self.send_control_command('land')
 
@@ -189,6 +360,9 @@ class TelloEDUDrone:
                     f'{BACKEND_URL}/drone/successful_land', json=self.query
                 )
 
+                # The same landing may have been both pushed and synced while the drone landed.
+                self.should_land.clear()
+
                 log.debug(
                     f'{self.name} succesfully landed with status: {status_message}'
                 )
@@ -203,39 +377,54 @@ class TelloEDUDrone:
         self.takeoff: bool = False
 
         while self.drone_active and (not self.takeoff):
-            # Sleep so that we do not spam the backend server.
-            sleep(1)
+            # Pushed by the backend while the command channel is open, or synced.
+            if self.commands_delivered():
+                if not self.should_takeoff.wait(1):
+                    continue
+                self.should_takeoff.clear()
+                takeoff: bool = True
+
+            else:
+                # Sleep so that we do not spam the backend server.
+                sleep(1)
+
+                # Try to check it the drone should takeoff
+                try:
+                    response = requests.get(
+                        f'{BACKEND_URL}/drone/should_takeoff',
+                        json=self.query
+                    )
+                    log.debug(f'{response}')
 
-            # Try to check it the drone should takeoff
-            try:
-                response = requests.get(
-                    f'{BACKEND_URL}/drone/should_takeoff',
-                    json=self.query
-                )
-                log.debug(f'{response}')
+                # If it fails to do so
+                except requests.exceptions.RequestException as exception:
+                    # Wait and repeat.
+                    log.critical(
+                        f'[{threading.current_thread().name}] {exception}')
+                    sleep(2)
+                    continue
 
-            # If it fails to do so
-            except requests.exceptions.RequestException as exception:
-                # Wait and repeat.
-                log.critical(
-                    f'[{threading.current_thread().name}] {exception}')
-                sleep(2)
-                self.rc_thread()
+                takeoff = response.ok
 
             # If the response was successful.
-            if response.ok:
+            if takeoff:
                 # The drone should now takeoff
                 self.send_control_command('takeoff', recv_timeout=7)
                 log.debug(
                     f'Completed takeoff for {self.name} at {self.parent}')
 
-                # Update the takeoff flag.
+                # Update the takeoff flag. Hover until the first rc command of this flight is pushed.
                 self.takeoff = True
+                self.rc_command = [0, 0, 0, 0]
+                self.backend_reached()
 
                 # Update the backend statues of the drone about the takeoff.
                 response = requests.post(
                     f'{BACKEND_URL}/drone/successful_takeoff', json=self.query)
 
+                # The same takeoff may have been both pushed and synced while the drone took off.
+                self.should_takeoff.clear()
+
             # Now we check for controls from the backend.
 
             # The reason for having the same while loop is because the drone
@@ -243,11 +432,27 @@ class TelloEDUDrone:
             # This saves a small amount of resource.
 
             while self.drone_active and self.takeoff:
-                # Get commands from the backend endpoint: cmd_queue.
-                commands = requests.get(
-                    f'{BACKEND_URL}/cmd_queue',
-                    json=self.query
-                ).json().get('message')
+                # The newest command, pushed by the backend while the command channel is open, synced, or
+                # long-polled by `cmd_queue_thread()`. It is sent again every `RC_RESEND_INTERVAL` seconds, or the drone
+                # lands by itself.
+                self.rc_changed.wait(RC_RESEND_INTERVAL)
+                self.rc_changed.clear()
+
+                # Lost the backend, so the user can not steer. Hover, and do not pick the old command up again
+                # when the link is back.
+                if time() - self.backend_reached_at > RC_LINK_TIMEOUT:
+                    with self.rc_lock:
+                        if self.rc_command != [0, 0, 0, 0]:
+                            log.warning(f'[{self.name}] No word from the backend, hovering')
+                            self.rc_command = [0, 0, 0, 0]
+
+                # Too old to fly again, like a command that arrives too late.
+                now: float | None = self.backend_time()
+                if now is not None:
+                    with self.rc_lock:
+                        self.hover_if_stale(now)
+
+                commands = self.rc_command
 
                 # Create a string that we can pass directly to the drone.
                 drone_command = f'rc {commands[0]} {commands[1]} {commands[2]} {commands[3]}'
@@ -272,11 +477,55 @@ class TelloEDUDrone:
                 # # Send the received command to the Tello drone.
                 # self.send_rc_command(drone_command)
 
+    def cmd_queue_thread(self) -> None:
+        """Long-poll the backend for new commands while the command channel is closed.
+
+        Sends the version of the last command it got, and the backend holds the request until there is a
+        newer one (or `CMD_QUEUE_LONG_POLL` seconds have passed). So while nothing changes, there is one
+        request every `CMD_QUEUE_LONG_POLL` seconds instead of as many as the backend can answer. It is held
+        for at most half of `RC_LINK_TIMEOUT`, so an answer tells `rc_thread()` the link works in time.
+        """
+        version: int | None = None
+
+        while self.drone_active:
+            # Only while flying, and the commands are not pushed or synced.
+            if self.commands_delivered() or not self.takeoff:
+                version = None
+                sleep(0.1)
+                continue
+
+            query = {'wait': min(CMD_QUEUE_LONG_POLL, RC_LINK_TIMEOUT / 2)}
+            if version is not None:
+                query['version'] = version
+
+            try:
+                response = decode(requests.get(
+                    f'{BACKEND_URL}/cmd_queue',
+                    params=query,
+                    timeout=CMD_QUEUE_LONG_POLL + 10,
+                    **body(self.query)
+                ))
+
+            except (requests.exceptions.RequestException, ValueError) as exception:
+                log.error(f'[{self.name}] Failed to get commands with exception: {exception}')
+                version = None
+                sleep(1)
+                continue
+
+            self.backend_reached()
+
+            # The drone may have landed while the request was held.
+            if response.get('version') != version and self.takeoff:
+                self.set_rc_command(response.get('message'), response.get('version'), response.get('issued'))
+            version = response.get('version')
+
     def RTS_handshake(self) -> None:
         """Perform a handshake with the backend to establish a drone's readiness to send video.
 
         Sends an Ready To Stream message to the backend to indicate that the drone is ready to stream video.
+        It carries the publisher token from `/new_drone`, without which the backend ignores it.
         """
+        message: bytes = b'RTS' if self.publisher_token is None else b'RTS ' + self.publisher_token.encode('utf-8')
 
         self.video_socket.settimeout(2)
 
@@ -285,7 +534,7 @@ class TelloEDUDrone:
             try:
                 # Send an RTS message to the backend to indicate that the drone is ready to stream video.
                 self.video_socket.sendto(
-                    b'RTS', (self.backend_IP, self.video_port)
+                    self.wrap(message), (self.backend_IP, self.video_port)
                 )
                 log.debug('Send an RTS message')
             except OSError as error:
@@ -319,27 +568,72 @@ class TelloEDUDrone:
         This method continuously receives video feed from the drone over a socket connection and sends it to the backend
         over the same socket connection. The specific video feed port to use is obtained from the backend by calling
         get_video_port(). The function runs until self.drone_active is set to False.
+
+        The video is received into a slab from `video_buffer_pool` and sent as a `memoryview` of it,
+        so no new `bytes` object is allocated per datagram. When multiplexed, the video is received
+        after room for the header, and the header is written in front of it in the same slab. The header
+        numbers the datagrams, and says when they were sent if `VIDEO_SEND_TIME` is set, so the backend can
+        tell when they are lost, reordered or delayed on the way. With `fec_group_size` a parity datagram
+        is sent after every group of that many, so the backend can rebuild one lost datagram per group.
         """
+        # Where the video goes in the slab.
+        offset: int = VIDEO_HEADER.size if self.stream_id is not None else 0
+        flags: int = FLAG_SEND_TIME if VIDEO_SEND_TIME else 0
+        sequence: int = 0
+        parity: ParityEncoder | None = ParityEncoder(self.fec_group_size) if offset and self.fec_group_size else None
+
         while self.drone_active:
+            slab: Slab = video_buffer_pool.acquire()
+
             try:
                 # Retrive the video feed from the Tello drone
-                video_feed, addr = self.video_socket.recvfrom(self.buffer_size)
+                size, addr = self.video_socket.recvfrom_into(slab.view[offset:])
 
-            except Exception:
-                log.error(f'Socket have already been closed: {addr}')
+                if offset:
+                    pack_header(slab.buffer, self.stream_id, sequence, flags, int(time() * 1000) if flags else 0)
 
-            try:
                 # Now send that video to the backend
                 self.video_socket.sendto(
-                    video_feed, (self.backend_IP, self.video_port))
+                    slab.view[:offset + size], (self.backend_IP, self.video_port))
+
+                # And the parity of its group, if it was the last of the group.
+                if parity is not None:
+                    datagram: bytes | None = parity.add(self.stream_id, sequence, slab.view[offset:offset + size])
+                    if datagram is not None:
+                        self.video_socket.sendto(datagram, (self.backend_IP, self.video_port))
+
+                sequence = (sequence + 1) & 0xFFFFFFFF
 
             except Exception:
-                log.error(f'Socket have already been closed: {addr}')
+                log.error(f'Socket have already been closed: {self.name}')
+
+            # The datagram has been sent. Reuse the slab.
+            finally:
+                video_buffer_pool.release(slab)
+
+    def wrap(self, data: bytes) -> bytes:
+        """Put the header in front of a message to the backend, if the video is multiplexed.
+
+        Arguments:
+            data (bytes): The message.
+        """
+        if self.stream_id is None:
+            return data
+
+        header = bytearray(VIDEO_HEADER.size)
+        pack_header(header, self.stream_id, 0)
+        return bytes(header) + data
 
     def get_video_port(self) -> None:
         """Gets a video port from the backend
+
+        If `VIDEO_MULTIPLEXED` is set, the backend returns its multiplexed ingest port and a stream id instead.
         """
-        response = requests.get(f'{BACKEND_URL}/new_drone', json=self.query)
+        response = requests.get(
+            f'{BACKEND_URL}/new_drone',
+            json=self.query,
+            params={'mux': VIDEO_MULTIPLEXED, 'fec': self.fec_group_size if VIDEO_MULTIPLEXED else 0}
+        )
 
         if not response.ok:
             log.error(
@@ -354,6 +648,8 @@ class TelloEDUDrone:
         # Update the drones video port.
         port: int = response.json().get('video_port')
         self.video_port = port
+        self.stream_id = response.json().get('stream_id')
+        self.publisher_token = response.json().get('publisher_token')
 
     def set_drone_ports(self) -> None:
         """Set drone status and video ports.
@@ -361,10 +657,12 @@ class TelloEDUDrone:
         Send a command to the drone to configure its status_port and video_port.        
         """
         # Bind the video_socket to the given video port, given by the backend server.
-        self.video_socket.bind(('', self.video_port))
+        # Multiplexed drones share the backend's port, so they get any free local port instead.
+        self.video_socket.bind(('', self.video_port if self.stream_id is None else 0))
+        self.local_video_port = self.video_socket.getsockname()[1]
 
         # Send a SDK command to tell the Tello drone to change its status and video feed ports.
-        self.send_control_command(f"port {self.status_port} {self.video_port}")
+        self.send_control_command(f"port {self.status_port} {self.local_video_port}")
 
     def send_control_command(self, command: str, recv_timeout: int = 1) -> bool | None:
         """Send a command to the drone with reurn.
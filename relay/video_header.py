@@ -0,0 +1,63 @@
+'''The header relays put in front of video datagrams sent to the multiplexed ingest port.
+
+In multiplexed mode every relay sends the video of every drone to one well-known port
+(returned by `/new_drone` when the relay asks for it) instead of one port per drone. Each datagram starts with a
+12 byte header, so the backend can tell which drone's stream it belongs to:
+
+    | magic (1) | flags (1) | send time (2) | stream id (4) | sequence number (4) | payload ... |
+
+All fields are in network byte order. The sequence number counts the video datagrams of a drone, so the
+backend can tell when datagrams are lost or reordered on the way. If `FLAG_SEND_TIME` is set, the send time is
+when the relay sent the datagram, in milliseconds modulo 2^16. The clocks of the relay and the backend are not
+the same, so it only tells how the delay changes, not the delay itself. It is 2 bytes so the header still fits
+a Tello datagram (1460 bytes) in one 1500 byte packet.
+
+If `FLAG_PARITY` is set, the datagram is not video but the parity of a group of video datagrams (see
+`fec.py`), and the sequence number and send time fields mean something else. The magic byte can never be the first byte of a control
+message like `SUB <ticket>`, so the backend can tell them apart from the first byte.
+
+Note:
+    `backend/video_header.py` is the backend's copy of this file. Keep them the same.
+'''
+
+# Default Python
+import struct
+
+VIDEO_HEADER: struct.Struct = struct.Struct('!BBHII')
+VIDEO_HEADER_MAGIC: int = 0xD7
+
+# The send time field is set.
+FLAG_SEND_TIME: int = 0x01
+# The datagram is the parity of a group of video datagrams.
+FLAG_PARITY: int = 0x02
+
+
+def pack_header(buffer: bytearray, stream_id: int, sequence: int, flags: int = 0, send_time: int = 0) -> None:
+    """Write a header at the start of a buffer.
+
+    Args:
+        buffer (bytearray): The buffer. The payload must start at `VIDEO_HEADER.size`.
+        stream_id (int): The stream id the backend gave the drone.
+        sequence (int): The sequence number of the datagram. Wraps at 2^32.
+        flags (int): Flags for the datagram.
+        send_time (int): When the datagram is sent, in milliseconds. Only read with `FLAG_SEND_TIME`. Wraps at 2^16.
+    """
+    VIDEO_HEADER.pack_into(
+        buffer, 0, VIDEO_HEADER_MAGIC, flags, send_time & 0xFFFF, stream_id, sequence & 0xFFFFFFFF
+    )
+
+
+def unpack_header(data: bytes | memoryview) -> tuple[int, int, int, int] | None:
+    """Read the header of a datagram.
+
+    Args:
+        data (bytes | memoryview): The datagram.
+
+    Returns:
+        tuple[int, int, int, int]: The flags, send time, stream id and sequence number.
+        None: If the datagram does not start with a header.
+    """
+    if len(data) < VIDEO_HEADER.size or data[0] != VIDEO_HEADER_MAGIC:
+        return None
+
+    return VIDEO_HEADER.unpack_from(data)[1:]
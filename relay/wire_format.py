@@ -0,0 +1,52 @@
+'''MessagePack bodies for the requests to the backend that are made all the time.
+
+`/sync`, `/heartbeat`, `/cmd_queue` and `/drone/status_information` are sent with a MessagePack body, and
+ask for a MessagePack answer, if `WIRE_FORMAT_MSGPACK` is set and the `msgpack` package is installed.
+Otherwise they are JSON, like every other request. The backend answers in JSON if it cannot do MessagePack.
+
+Functions:
+    body: Returns the keyword arguments for `requests` that send a body.
+    decode: Returns the decoded body of a response.
+'''
+
+import requests
+
+# Optional. Without it every body is JSON.
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from config import WIRE_FORMAT_MSGPACK
+
+MSGPACK = 'application/msgpack'
+
+
+def body(query: dict) -> dict:
+    """Returns the keyword arguments for `requests` that send `query` as the body of a request.
+
+    Arguments:
+        query (dict): The body.
+
+    Example:
+        >>> requests.post(f'{BACKEND_URL}/sync', timeout=2, **body(query))
+    """
+    if msgpack is None or not WIRE_FORMAT_MSGPACK:
+        return {'json': query}
+
+    return {
+        'data': msgpack.packb(query),
+        'headers': {'Content-Type': MSGPACK, 'Accept': MSGPACK}
+    }
+
+
+def decode(response: requests.Response) -> object:
+    """Returns the decoded body of a response, whether it is MessagePack or JSON.
+
+    Arguments:
+        response (requests.Response): The response.
+    """
+    if msgpack is not None and response.headers.get('Content-Type', '').startswith(MSGPACK):
+        return msgpack.unpackb(response.content)
+
+    return response.json()